@@ -0,0 +1,221 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Baked asset cache
+Decoding the sprite sheet and nine .ogg files on every start is slow, so scaled
+sprites and decoded sound samples are stored in a single cache file. At launch
+the file is memory-mapped and checked against hashes of the source files; if
+anything changed, assets are loaded from sources and the cache is rebuilt.
+
+Build (or rebuild) the cache by hand with: python assets.py
+"""
+
+import os, mmap, json, struct, hashlib, time, pygame
+
+class AssetCache():
+
+	# file layout: magic, header length, json header, data blocks
+	MAGIC = b"BCA1"
+
+	FILENAME = "assets.cache"
+
+	SPRITES_FILE = "images/sprites.gif"
+
+	# sprites are scaled to this size (pixely version)
+	SPRITES_SIZE = (192, 224)
+
+	# color of transparent pixels in sprites, see Atlas
+	KEY = (255, 0, 255)
+
+	SOUND_FILES = {
+		"start" : "sounds/gamestart.ogg",
+		"end" : "sounds/gameover.ogg",
+		"score" : "sounds/score.ogg",
+		"bg" : "sounds/background.ogg",
+		"fire" : "sounds/fire.ogg",
+		"bonus" : "sounds/bonus.ogg",
+		"explosion" : "sounds/explosion.ogg",
+		"brick" : "sounds/brick.ogg",
+		"steel" : "sounds/steel.ogg"
+	}
+
+	def __init__(self, filename = None):
+		self.filename = self.FILENAME if filename == None else filename
+
+	def load(self, with_sounds = True):
+		""" Load sprites and sounds, from cache if it's up to date
+		Sounds can only be loaded when mixer is initialized
+		@param boolean with_sounds Whether sounds are needed
+		@return tuple Sprites surface and dict of sounds
+		"""
+
+		loaded = self.loadCache(with_sounds)
+		if loaded != None:
+			return loaded
+
+		sprites = self.loadSprites()
+		sounds = self.loadSounds() if with_sounds else {}
+
+		try:
+			self.save(sprites, sounds)
+		except (IOError, OSError):
+			pass
+
+		return (sprites, sounds)
+
+	def loadSprites(self):
+		""" Load and scale sprites from source image
+		Sprite sheet is paletted and transparent pixels are told apart from white
+		ones only by palette index. It is flattened to RGB, so transparent pixels
+		are painted with KEY
+		@return pygame.Surface
+		"""
+		image = pygame.transform.scale(pygame.image.load(self.SPRITES_FILE), self.SPRITES_SIZE)
+
+		sprites = pygame.Surface(self.SPRITES_SIZE, 0, 24)
+		sprites.fill(self.KEY)
+		sprites.blit(image, (0, 0))
+		sprites.set_colorkey(self.KEY)
+		return sprites
+
+	def loadSounds(self):
+		""" Decode all sounds from source files
+		@return dict
+		"""
+		sounds = {}
+		for name, filename in self.SOUND_FILES.items():
+			sounds[name] = pygame.mixer.Sound(filename)
+		return sounds
+
+	def getSourceHashes(self, with_sounds):
+		""" @return dict Filename => sha1 of every source file """
+		filenames = [self.SPRITES_FILE]
+		if with_sounds:
+			filenames += self.SOUND_FILES.values()
+
+		hashes = {}
+		for filename in filenames:
+			f = open(filename, "rb")
+			hashes[filename] = hashlib.sha1(f.read()).hexdigest()
+			f.close()
+		return hashes
+
+	def save(self, sprites, sounds):
+		""" Write cache file
+		@param pygame.Surface sprites As returned by loadSprites()
+		@param dict sounds As returned by loadSounds()
+		@return None
+		"""
+
+		blocks = []
+		offset = 0
+
+		header = {
+			"sources" : self.getSourceHashes(len(sounds) > 0),
+			"mixer" : pygame.mixer.get_init() if len(sounds) > 0 else None,
+			"sounds" : {}
+		}
+
+		data = pygame.image.tostring(sprites, "RGB")
+		header["sprites"] = [offset, len(data)]
+		blocks.append(data)
+		offset += len(data)
+
+		for name, sound in sounds.items():
+			data = sound.get_raw()
+			header["sounds"][name] = [offset, len(data)]
+			blocks.append(data)
+			offset += len(data)
+
+		header = json.dumps(header).encode("utf-8")
+
+		# write to temporary file first, so a running game never sees half of it
+		f = open(self.filename + ".tmp", "wb")
+		f.write(self.MAGIC)
+		f.write(struct.pack("<I", len(header)))
+		f.write(header)
+		for data in blocks:
+			f.write(data)
+		f.close()
+
+		if os.path.isfile(self.filename):
+			os.remove(self.filename)
+		os.rename(self.filename + ".tmp", self.filename)
+
+	def loadCache(self, with_sounds = True):
+		""" Load sprites and sounds from cache file
+		@return tuple Sprites surface and dict of sounds, None if cache is missing
+		or out of date
+		"""
+
+		if not os.path.isfile(self.filename):
+			return None
+
+		f = open(self.filename, "rb")
+		try:
+			data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		except (ValueError, EnvironmentError):
+			f.close()
+			return None
+
+		try:
+			if data[:4] != self.MAGIC:
+				return None
+
+			size = struct.unpack("<I", data[4:8])[0]
+			header = json.loads(data[8:8+size].decode("utf-8"))
+			start = 8 + size
+
+			if with_sounds and (len(header["sounds"]) == 0 or header["mixer"] != list(pygame.mixer.get_init())):
+				return None
+
+			for filename, sha1 in self.getSourceHashes(with_sounds).items():
+				if header["sources"].get(filename) != sha1:
+					return None
+
+			offset, length = header["sprites"]
+			sprites = pygame.image.frombuffer(self.view(data, start + offset, length), self.SPRITES_SIZE, "RGB")
+
+			# copy pixels out of mapped file, converting them if display is set up
+			if pygame.display.get_surface() != None:
+				sprites = sprites.convert()
+			else:
+				sprites = sprites.copy()
+			sprites.set_colorkey(self.KEY)
+
+			sounds = {}
+			if with_sounds:
+				for name, (offset, length) in header["sounds"].items():
+					sounds[str(name)] = pygame.mixer.Sound(buffer = self.view(data, start + offset, length))
+
+			return (sprites, sounds)
+		except (ValueError, KeyError, struct.error):
+			return None
+		finally:
+			data.close()
+			f.close()
+
+	def view(self, data, offset, length):
+		""" Get part of mapped file without copying it """
+		return memoryview(data)[offset:offset+length]
+
+if __name__ == "__main__":
+
+	os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+	# same mixer settings as the game uses
+	pygame.mixer.pre_init(44100, -16, 1, 512)
+	pygame.init()
+	pygame.mixer.init(44100, -16, 1, 512)
+
+	cache = AssetCache()
+
+	start = time.time()
+	sprites = cache.loadSprites()
+	sounds = cache.loadSounds()
+	cache.save(sprites, sounds)
+	print("Built %s in %.1f ms" % (cache.filename, (time.time() - start) * 1000))
+
+	start = time.time()
+	cache.loadCache()
+	print("Loaded %s in %.1f ms" % (cache.filename, (time.time() - start) * 1000))
@@ -0,0 +1,1044 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Batch simulator
+Steps many games in lockstep for agent training. State of all games is kept in
+NumPy arrays, one row per game - tile grids, tanks, bullets, castles and timers
+- and every rule is applied to all games at once, the same way Game.update()
+applies it to one: player and enemy movement with Tank, Enemy and Level
+collision rules, bullets flying, hitting each other, tanks, castle and tiles,
+armor, paralysis, shields, explosions, respawning, enemies spawning and firing.
+
+Objects are processed in the same order as in the object engine, including its
+quirks (removing a dead enemy or bullet from list skips update of the next
+one), so a game loaded with loadGame() goes on exactly like the original as long
+as nothing random happens: enemy paths and spawns use NumPy's random number
+generator, not the game's one. Bonuses and hunting enemies are not simulated.
+checkParity() compares both engines tick by tick, with batch simulator making
+the same random choices as the game, see RecordedRandom.
+
+Timers are counters of ticks left: a timer added during a tick fires
+interval / TICK_MS ticks later, at the end of the tick, as in Timer.
+
+Players' actions are encoded the same way as in replays: bits 0-3 hold up,
+right, down and left buttons, bits 4-5 number of fire presses.
+
+Usage (from repository root):
+	python batch.py [--games=<n>] [--ticks=<n>] [--parity] [--seed=<n>]
+"""
+
+import sys, time, random
+import numpy as np
+
+from tanks import Game, Level, Tank, Bullet
+
+class BatchSim(object):
+
+	# fields of tanks array. a tank can have two paralysis timers pending, see
+	# updateTimers()
+	(X, Y, DIR, STATE, SIDE, TYPE, SPEED, HEALTH, SUPERPOWERS, MAX_BULLETS,
+	PARALISED, SHIELDED, PAUSED, SERIAL, LIVES, SCORE, EXPLOSION, SHIELD_TIMER,
+	PARALYSE_TIMER, PARALYSE_NEXT, SPAWN_TIMER, FIRE_TIMER, PATH_X, PATH_Y,
+	PATH_DX, PATH_DY, PATH_STEPS, PATH_STEP) = range(28)
+	TANK_FIELDS = 28
+
+	# fields of bullets array. OWNER is side, SHOOTER is serial of tank that fired
+	(BX, BY, BW, BH, BDIR, BSTATE, OWNER, SHOOTER, BSPEED, POWER, BEXPLOSION) = range(11)
+	BULLET_FIELDS = 11
+
+	TICK_MS = Game.TICK_MS
+
+	# enemies on map at once, Level.max_active_enemies is 4
+	ENEMY_SLOTS = 6
+
+	# bullets in list, including exploding ones
+	BULLET_SLOTS = 48
+
+	# enemies in stage's queue
+	QUEUE_SIZE = 64
+
+	GRID_SIZE = Level.GRID_SIZE
+	TILE_SIZE = Level.TILE_SIZE
+
+	# ticks explosions last: frames * 100 ms, see Explosion
+	TANK_EXPLOSION = 3 * 100 // TICK_MS + 1
+	BULLET_EXPLOSION = 2 * 100 // TICK_MS + 1
+
+	# ticks between enemy's shots and between spawns
+	FIRE_PERIOD = 1000 // TICK_MS
+	SPAWN_PERIOD = 3000 // TICK_MS
+
+	# movement along each axis by direction
+	DX = np.array([0, 1, 0, -1])
+	DY = np.array([-1, 0, 1, 0])
+
+	# bullet's rect relative to tank by direction, see Bullet
+	BULLET_X = np.array([11, 26, 11, -8])
+	BULLET_Y = np.array([-8, 11, 26, 11])
+	BULLET_W = np.array([6, 8, 6, 8])
+	BULLET_H = np.array([8, 6, 8, 6])
+
+	# tile type => stops tanks
+	OBSTACLES = np.array([tile in Level.OBSTACLE_TILES for tile in range(8)])
+
+	# enemy type => speed, health, superpowers
+	ENEMY_SPEED = np.array([1, 3, 2, 2])
+	ENEMY_HEALTH = np.array([100, 100, 100, 400])
+	ENEMY_SUPERPOWERS = np.array([0, 0, 1, 0])
+
+	CASTLE_RECT = (12 * 16, 24 * 16, 32, 32)
+
+	SPAWN_POSITIONS = np.array([[3, 3], [195, 3], [387, 3]])
+
+	PLAYER_POSITIONS = ((8 * 16 + 3, 24 * 16 + 3), (16 * 16 + 3, 24 * 16 + 3))
+
+	def __init__(self, games, players = 1, level_pack = None, seed = None):
+		"""
+		@param int games Number of games to run
+		@param int players Players in each game, 1 or 2
+		@param LevelPack level_pack Take levels from pack instead of levels/ directory
+		@param int seed Seed of random number generator
+		"""
+
+		self.games = games
+		self.players = players
+		self.level_pack = level_pack
+		self.rng = np.random.RandomState(seed)
+
+		# players are first in tanks, then enemies in order they are in enemies list
+		self.slots = players + self.ENEMY_SLOTS
+
+		self.grid = np.zeros((games, self.GRID_SIZE, self.GRID_SIZE), np.uint8)
+		self.tanks = np.zeros((games, self.slots, self.TANK_FIELDS), np.int32)
+		self.enemy_count = np.zeros(games, np.int32)
+		self.bullets = np.zeros((games, self.BULLET_SLOTS, self.BULLET_FIELDS), np.int32)
+		self.bullet_count = np.zeros(games, np.int32)
+
+		# enemies waiting to spawn, popped from the end
+		self.queue = np.zeros((games, self.QUEUE_SIZE), np.int32)
+		self.enemies_left = np.zeros(games, np.int32)
+
+		self.stage = np.zeros(games, np.int32)
+		self.castle = np.zeros(games, bool)
+		self.running = np.zeros(games, bool)
+		self.active = np.zeros(games, bool)
+		self.game_over = np.zeros(games, bool)
+		self.timefreeze = np.zeros(games, bool)
+		self.max_active_enemies = np.zeros(games, np.int32)
+		self.spawn_timer = np.zeros(games, np.int32)
+		self.next_serial = np.zeros(games, np.int32)
+
+		# buttons held by players, see step()
+		self.pressed = np.zeros((games, players), np.int32)
+
+		# makes enemies' path and spawn choices instead of rng if not None, see
+		# RecordedRandom
+		self.choices = None
+
+		# map cells covered by castle, always obstacles
+		self.castle_cells = np.zeros((self.GRID_SIZE, self.GRID_SIZE), bool)
+		x, y, w, h = self.CASTLE_RECT
+		self.castle_cells[y // 16:(y + h - 1) // 16 + 1, x // 16:(x + w - 1) // 16 + 1] = True
+
+	def reset(self, stage = 1, seed = None, indexes = None):
+		""" Start stage from scratch, like Game.startLevel() with new players
+		@param int stage
+		@param int seed Reseed random number generator first
+		@param array indexes Games to reset, all if None
+		@return dict Observation, see observe()
+		"""
+
+		if seed != None:
+			self.rng.seed(seed)
+		if indexes is None:
+			indexes = np.arange(self.games)
+
+		tiles, enemies = Level.getStage(stage, self.level_pack)
+		if tiles is None:
+			tiles = [Level.TILE_EMPTY] * (self.GRID_SIZE * self.GRID_SIZE)
+		tiles = np.frombuffer(bytearray(tiles), np.uint8).reshape(self.GRID_SIZE, self.GRID_SIZE)
+
+		queue = [0] * enemies[0] + [1] * enemies[1] + [2] * enemies[2] + [3] * enemies[3]
+		if len(queue) > self.QUEUE_SIZE:
+			raise ValueError("stage has more than %d enemies" % self.QUEUE_SIZE)
+
+		for g in indexes:
+			self.grid[g] = tiles
+			self.tanks[g] = 0
+			self.bullets[g] = 0
+			self.queue[g, :len(queue)] = self.rng.permutation(queue)
+			self.enemies_left[g] = len(queue)
+
+		self.enemy_count[indexes] = 0
+		self.bullet_count[indexes] = 0
+		self.stage[indexes] = stage
+		self.castle[indexes] = True
+		self.running[indexes] = True
+		self.active[indexes] = True
+		self.game_over[indexes] = False
+		self.timefreeze[indexes] = False
+		self.max_active_enemies[indexes] = 4
+		self.spawn_timer[indexes] = self.SPAWN_PERIOD + 1
+		self.next_serial[indexes] = self.players
+		self.pressed[indexes] = 0
+
+		t = self.tanks
+		for p in range(self.players):
+			t[indexes, p, self.SERIAL] = p
+			t[indexes, p, self.SIDE] = Tank.SIDE_PLAYER
+			t[indexes, p, self.LIVES] = 3
+			self.respawnPlayer(indexes, p)
+
+		return self.observe()
+
+	def respawnPlayer(self, g, p):
+		""" Put players back to start, shielded for 4 s, see Game.respawnPlayer() """
+		t = self.tanks
+		t[g, p, self.X], t[g, p, self.Y] = self.PLAYER_POSITIONS[p]
+		t[g, p, self.DIR] = Tank.DIR_UP
+		t[g, p, self.STATE] = Tank.STATE_ALIVE
+		t[g, p, self.SPEED] = 2
+		t[g, p, self.HEALTH] = 100
+		t[g, p, self.SUPERPOWERS] = 0
+		t[g, p, self.MAX_BULLETS] = 1
+		t[g, p, self.PARALISED] = 0
+		t[g, p, self.PAUSED] = 0
+		t[g, p, self.SHIELDED] = 1
+		t[g, p, self.SHIELD_TIMER] = 4000 // self.TICK_MS + 1
+
+	def step(self, actions):
+		""" Play one tick of every running game
+		@param array actions Input of each player in each game, shape (games, players),
+			encoded as in replays
+		@return tuple Observation (see observe()), points each player scored (games,
+			players) and whether game has ended (games)
+		"""
+
+		actions = np.asarray(actions).reshape(self.games, self.players)
+		score = self.tanks[:, :self.players, self.SCORE].copy()
+
+		running = np.nonzero(self.running)[0]
+		if len(running):
+			self.applyInput(running, actions[running])
+			self.update(running)
+
+		rewards = (self.tanks[:, :self.players, self.SCORE] - score).astype(np.float32)
+		return (self.observe(), rewards, ~self.running)
+
+	def observe(self):
+		""" State of all games. Arrays are the simulator's own, not copies, so they
+		change with the next step
+		@return dict grid (games, 26, 26) tile types, tanks (games, slots, TANK_FIELDS),
+			bullets (games, BULLET_SLOTS, BULLET_FIELDS), number of enemies and
+			bullets in them, castle standing and game running (games)
+		"""
+		return {
+			"grid" : self.grid,
+			"tanks" : self.tanks,
+			"enemies" : self.enemy_count,
+			"bullets" : self.bullets,
+			"bullet_count" : self.bullet_count,
+			"castle" : self.castle,
+			"running" : self.running
+		}
+
+	def applyInput(self, g, actions):
+		""" Press buttons and fire, see Game.setInput() """
+		for p in range(self.players):
+			self.pressed[g, p] = actions[:, p] & 15
+			presses = actions[:, p] >> 4
+			for i in range(presses.max() if len(presses) else 0):
+				self.fire(g[presses > i], p)
+
+	def update(self, g):
+		""" Advance games g by one tick, see Game.update() """
+
+		t = self.tanks
+		playing = ~self.game_over[g] & self.active[g]
+
+		# players
+		for p in range(self.players):
+			alive = playing & (t[g, p, self.STATE] == Tank.STATE_ALIVE)
+			pressed = self.pressed[g, p]
+			for direction in range(4):
+				moving = alive & (pressed & (1 << direction) != 0)
+				alive &= ~moving
+				if moving.any():
+					self.movePlayer(g[moving], p, direction)
+			self.updateExplosion(g, p)
+
+		# enemies, removing dead ones
+		for i in range(self.enemy_count[g].max()):
+			s = self.players + i
+			has = i < self.enemy_count[g]
+			dead = has & (t[g, s, self.STATE] == Tank.STATE_DEAD) & ~self.game_over[g] & self.active[g]
+			if dead.any():
+				gd = g[dead]
+				self.removeEnemy(gd, i)
+				done = gd[(self.enemy_count[gd] == 0) & (self.enemies_left[gd] == 0)]
+				self.active[done] = False
+				self.running[done] = False
+
+			gu = g[has & ~dead]
+			if len(gu):
+				self.updateExplosion(gu, s)
+				moving = (t[gu, s, self.STATE] == Tank.STATE_ALIVE) & (t[gu, s, self.PAUSED] == 0) & (t[gu, s, self.PARALISED] == 0)
+				if moving.any():
+					self.moveEnemy(gu[moving], s)
+
+		# dead players lose a life, unless last enemy has just been removed
+		playing = ~self.game_over[g] & self.active[g]
+		for p in range(self.players):
+			dead = g[playing & (t[g, p, self.STATE] == Tank.STATE_DEAD)]
+			t[dead, p, self.LIVES] -= 1
+			self.respawnPlayer(dead[t[dead, p, self.LIVES] > 0], p)
+			self.gameOver(dead[t[dead, p, self.LIVES] <= 0])
+
+		# bullets, removing used ones
+		i = 0
+		while True:
+			has = i < self.bullet_count[g]
+			if not has.any():
+				break
+			removed = has & (self.bullets[g, i, self.BSTATE] == Bullet.STATE_REMOVED)
+			if removed.any():
+				self.removeBullet(g[removed], i)
+			gu = g[has & ~removed]
+			if len(gu):
+				self.updateBullet(gu, i)
+			i += 1
+
+		self.gameOver(g[~self.game_over[g] & ~self.castle[g]])
+
+		self.updateTimers(g)
+
+	def gameOver(self, g):
+		""" End games, headless Game.gameOver() """
+		self.game_over[g] = True
+		self.running[g] = False
+
+	def updateExplosion(self, g, s):
+		""" Exploded tanks whose explosion is over are dead, see Tank.update() """
+		t = self.tanks
+		over = g[(t[g, s, self.STATE] == Tank.STATE_EXPLODING) & (t[g, s, self.EXPLOSION] == 0)]
+		t[over, s, self.STATE] = Tank.STATE_DEAD
+
+	def explodeTanks(self, g, s):
+		""" Start explosion of tanks in slot s, see Tank.explode() """
+		t = self.tanks
+		exploding = g[t[g, s, self.STATE] != Tank.STATE_DEAD]
+		t[exploding, s, self.STATE] = Tank.STATE_EXPLODING
+		t[exploding, s, self.EXPLOSION] = self.TANK_EXPLOSION
+
+	def hitsObstacle(self, g, x, y, w = 26, h = 26):
+		""" Check which rects overlap tiles tanks can't cross, see Level.hitsObstacle()
+		@param array g Games
+		@param array x Left of rect in each game, same for y
+		@return array of booleans
+		"""
+
+		last = self.GRID_SIZE - 1
+		x1 = np.maximum(x // 16, 0)
+		x2 = np.minimum((x + w - 1) // 16, last)
+		y1 = np.maximum(y // 16, 0)
+		y2 = np.minimum((y + h - 1) // 16, last)
+
+		hit = np.zeros(len(g), bool)
+		for dy in range((h + 14) // 16 + 1):
+			cy = np.minimum(y1 + dy, last)
+			row = y1 + dy <= y2
+			for dx in range((w + 14) // 16 + 1):
+				cx = np.minimum(x1 + dx, last)
+				hit |= row & (x1 + dx <= x2) & (self.OBSTACLES[self.grid[g, cy, cx]] | self.castle_cells[cy, cx])
+		return hit
+
+	def hitsTanks(self, g, x, y, first, last, s = None, alive = False):
+		""" Check which 26x26 rects overlap tanks in slots first to last - 1
+		@param int s Slot to leave out
+		@param boolean alive If true, only alive tanks count
+		@return array of booleans
+		"""
+
+		t = self.tanks[g, first:last]
+		hit = (np.abs(t[:, :, self.X] - x[:, None]) < 26) & (np.abs(t[:, :, self.Y] - y[:, None]) < 26)
+
+		if first >= self.players:
+			hit &= np.arange(first, last) < self.players + self.enemy_count[g][:, None]
+		if alive:
+			hit &= t[:, :, self.STATE] == Tank.STATE_ALIVE
+		if s != None and first <= s < last:
+			hit[:, s - first] = False
+		return hit.any(1)
+
+	def snap(self, g, s):
+		""" Align tanks to 8 px grid on turning, see Tank.rotate() """
+		t = self.tanks
+		for field in (self.X, self.Y):
+			value = t[g, s, field]
+			nearest = (value + 4) // 8 * 8 + 3
+			close = np.abs(value - nearest) < 5
+			t[g[close], s, field] = nearest[close]
+
+	def movePlayer(self, g, p, direction):
+		""" Move players if possible, see Player.move() """
+
+		t = self.tanks
+
+		turning = g[t[g, p, self.DIR] != direction]
+		t[turning, p, self.DIR] = direction
+		self.snap(turning, p)
+
+		g = g[t[g, p, self.PARALISED] == 0]
+
+		x = t[g, p, self.X] + self.DX[direction] * t[g, p, self.SPEED]
+		y = t[g, p, self.Y] + self.DY[direction] * t[g, p, self.SPEED]
+
+		free = (x >= 0) & (x <= 416 - 26) & (y >= 0) & (y <= 416 - 26)
+		free[free] = ~self.hitsObstacle(g[free], x[free], y[free])
+		free &= ~self.hitsTanks(g, x, y, 0, self.players, p, True)
+		free &= ~self.hitsTanks(g, x, y, self.players, self.slots)
+
+		t[g[free], p, self.X] = x[free]
+		t[g[free], p, self.Y] = y[free]
+
+	def moveEnemy(self, g, s):
+		""" Move enemies along their paths, see Enemy.move() """
+
+		t = self.tanks
+
+		ended = t[g, s, self.PATH_STEP] >= t[g, s, self.PATH_STEPS]
+		if ended.any():
+			self.generatePath(g[ended], s, None, True)
+
+		step = t[g, s, self.PATH_STEP]
+		t[g, s, self.PATH_STEP] = step + 1
+		x = t[g, s, self.PATH_X] + t[g, s, self.PATH_DX] * step
+		y = t[g, s, self.PATH_Y] + t[g, s, self.PATH_DY] * step
+
+		direction = t[g, s, self.DIR]
+		inside = ~(((direction == Tank.DIR_UP) & (y < 0)) | ((direction == Tank.DIR_RIGHT) & (x > 416 - 26)) | ((direction == Tank.DIR_DOWN) & (y > 416 - 26)) | ((direction == Tank.DIR_LEFT) & (x < 0)))
+
+		free = inside.copy()
+		free[inside] = ~self.hitsObstacle(g[inside], x[inside], y[inside])
+		blocked = ~free
+		if blocked.any():
+			self.generatePath(g[blocked], s, direction[blocked], True)
+
+		bumped = free & (self.hitsTanks(g, x, y, self.players, self.slots, s) | self.hitsTanks(g, x, y, 0, self.players))
+		if bumped.any():
+			gb = g[bumped]
+			t[gb, s, self.DIR] ^= 2
+			self.generatePath(gb, s, t[gb, s, self.DIR], False)
+
+		moved = free & ~bumped
+		t[g[moved], s, self.X] = x[moved]
+		t[g[moved], s, self.Y] = y[moved]
+
+	def generatePath(self, g, s, direction, fix):
+		""" Pick new straight path for enemies, see Enemy.generatePath()
+		@param array direction Direction to try first in each game, None to choose at random
+		@param boolean fix Align tank to grid if it turns
+		@return None
+		"""
+
+		t = self.tanks
+		count = len(g)
+		current = t[g, s, self.DIR]
+		preferred = current if direction is None else direction
+		opposite = preferred ^ 2
+
+		shuffled, pixels = self.choosePaths(count)
+
+		# random order, preferred direction first and opposite last
+		rows = np.arange(count)
+		keys = np.empty((count, 4))
+		keys[rows[:, None], shuffled] = np.arange(4)
+		if direction is not None:
+			keys[rows, direction] = -1
+		keys[rows, opposite] = 4
+		order = np.argsort(keys, axis = 1)
+
+		x = t[g, s, self.X]
+		y = t[g, s, self.Y]
+		valid = np.empty((count, 4), bool)
+		valid[:, Tank.DIR_UP] = (y // 16 > 1) & ~self.hitsObstacle(g, x, y - 8)
+		valid[:, Tank.DIR_RIGHT] = (x // 16 < 24) & ~self.hitsObstacle(g, x + 8, y)
+		valid[:, Tank.DIR_DOWN] = (y // 16 < 24) & ~self.hitsObstacle(g, x, y + 8)
+		valid[:, Tank.DIR_LEFT] = (x // 16 > 1) & ~self.hitsObstacle(g, x - 8, y)
+
+		ordered = np.take_along_axis(valid, order, 1)
+		first = np.argmax(ordered, 1)
+		new_direction = np.where(ordered[rows, first], order[rows, first], opposite)
+
+		t[g, s, self.DIR] = new_direction
+		if fix:
+			self.snap(g[new_direction != current], s)
+
+		pixels = pixels + 3
+		speed = t[g, s, self.SPEED]
+		t[g, s, self.PATH_X] = t[g, s, self.X]
+		t[g, s, self.PATH_Y] = t[g, s, self.Y]
+		t[g, s, self.PATH_DX] = self.DX[new_direction] * speed
+		t[g, s, self.PATH_DY] = self.DY[new_direction] * speed
+		t[g, s, self.PATH_STEPS] = (pixels + speed - 1) // speed
+		t[g, s, self.PATH_STEP] = 0
+
+	def choosePaths(self, count):
+		""" Random choices of new paths, see Enemy.generatePath()
+		@return tuple Directions in random order (count, 4) and path lengths in px,
+			multiples of 32 (count)
+		"""
+		if self.choices != None:
+			return self.choices.takePaths(count)
+		return (np.argsort(self.rng.random_sample((count, 4)), 1), self.rng.randint(1, 13, count) * 32)
+
+	def chooseSpawns(self, count):
+		""" Random choices of spawning enemies, see Enemy()
+		@return tuple Directions (count) and indexes of SPAWN_POSITIONS in order
+			they are tried (count, 3)
+		"""
+		if self.choices != None:
+			return self.choices.takeSpawns(count)
+		direction = self.rng.choice([Tank.DIR_RIGHT, Tank.DIR_DOWN, Tank.DIR_LEFT], count)
+		return (direction, np.argsort(self.rng.random_sample((count, 3)), 1))
+
+	def fire(self, g, s):
+		""" Tanks in slot s shoot, if they are alive and within bullet quota, see Tank.fire() """
+
+		t = self.tanks
+		b = self.bullets
+
+		ready = (t[g, s, self.STATE] == Tank.STATE_ALIVE) & (t[g, s, self.PAUSED] == 0)
+		g = g[ready]
+
+		listed = np.arange(self.BULLET_SLOTS) < self.bullet_count[g][:, None]
+		flying = listed & (b[g, :, self.BSTATE] == Bullet.STATE_ACTIVE) & (b[g, :, self.SHOOTER] == t[g, s, self.SERIAL][:, None])
+		g = g[flying.sum(1) < t[g, s, self.MAX_BULLETS]]
+		if len(g) == 0:
+			return
+
+		n = self.bullet_count[g]
+		if n.max() >= self.BULLET_SLOTS:
+			raise RuntimeError("out of bullet slots")
+
+		direction = t[g, s, self.DIR]
+		superpowers = t[g, s, self.SUPERPOWERS]
+		b[g, n] = 0
+		b[g, n, self.BX] = t[g, s, self.X] + self.BULLET_X[direction]
+		b[g, n, self.BY] = t[g, s, self.Y] + self.BULLET_Y[direction]
+		b[g, n, self.BW] = self.BULLET_W[direction]
+		b[g, n, self.BH] = self.BULLET_H[direction]
+		b[g, n, self.BDIR] = direction
+		b[g, n, self.BSTATE] = Bullet.STATE_ACTIVE
+		b[g, n, self.OWNER] = t[g, s, self.SIDE]
+		b[g, n, self.SHOOTER] = t[g, s, self.SERIAL]
+		b[g, n, self.BSPEED] = np.where(superpowers > 0, 8, 5)
+		b[g, n, self.POWER] = np.where(superpowers > 2, 2, 1)
+		self.bullet_count[g] += 1
+
+	def removeEnemy(self, g, i):
+		""" Take i-th enemy off the list """
+		s = self.players + i
+		self.tanks[g, s:-1] = self.tanks[g, s + 1:]
+		self.tanks[g, -1] = 0
+		self.enemy_count[g] -= 1
+
+	def removeBullet(self, g, i):
+		""" Take i-th bullet off the list """
+		self.bullets[g, i:-1] = self.bullets[g, i + 1:]
+		self.bullets[g, -1] = 0
+		self.bullet_count[g] -= 1
+
+	def updateBullet(self, g, i):
+		""" Move i-th bullets and resolve their hits, see Bullet.update() """
+
+		b = self.bullets
+		t = self.tanks
+
+		# explosion is over
+		over = g[(b[g, i, self.BSTATE] == Bullet.STATE_EXPLODING) & (b[g, i, self.BEXPLOSION] == 0)]
+		b[over, i, self.BSTATE] = Bullet.STATE_REMOVED
+
+		g = g[b[g, i, self.BSTATE] == Bullet.STATE_ACTIVE]
+		if len(g) == 0:
+			return
+
+		direction = b[g, i, self.BDIR]
+		speed = b[g, i, self.BSPEED]
+		x = b[g, i, self.BX] + self.DX[direction] * speed
+		y = b[g, i, self.BY] + self.DY[direction] * speed
+		w = b[g, i, self.BW]
+		h = b[g, i, self.BH]
+		b[g, i, self.BX] = x
+		b[g, i, self.BY] = y
+
+		outside = (y < 0) | (x > 416 - w) | (y > 416 - h) | (x < 0)
+		self.explodeBullets(g[outside], i)
+		inside = ~outside
+		g, x, y, w, h = g[inside], x[inside], y[inside], w[inside], h[inside]
+
+		# walls. bullet can destroy 2 tiles at once
+		power = b[g, i, self.POWER]
+		collided = np.zeros(len(g), bool)
+		x1, x2 = x // 16, np.minimum((x + w - 1) // 16, self.GRID_SIZE - 1)
+		y1, y2 = y // 16, np.minimum((y + h - 1) // 16, self.GRID_SIZE - 1)
+		for dy in range(2):
+			for dx in range(2):
+				within = (y1 + dy <= y2) & (x1 + dx <= x2)
+				cy = np.minimum(y1 + dy, y2)
+				cx = np.minimum(x1 + dx, x2)
+				tile = self.grid[g, cy, cx]
+				brick = within & (tile == Level.TILE_BRICK)
+				steel = within & (tile == Level.TILE_STEEL)
+				destroyed = brick | (steel & (power == 2))
+				self.grid[g[destroyed], cy[destroyed], cx[destroyed]] = Level.TILE_EMPTY
+				collided |= brick | steel
+		self.explodeBullets(g[collided], i)
+		left = ~collided
+		g, x, y, w, h = g[left], x[left], y[left], w[left], h[left]
+		if len(g) == 0:
+			return
+
+		# other side's bullets, even exploding ones
+		owner = b[g, i, self.OWNER]
+		others = b[g]
+		hit = (others[:, :, self.BX] < (x + w)[:, None]) & (x[:, None] < others[:, :, self.BX] + others[:, :, self.BW]) & (others[:, :, self.BY] < (y + h)[:, None]) & (y[:, None] < others[:, :, self.BY] + others[:, :, self.BH])
+		hit &= (others[:, :, self.OWNER] != owner[:, None]) & (np.arange(self.BULLET_SLOTS) < self.bullet_count[g][:, None])
+		hit[:, i] = False
+		stopped = hit.any(1)
+
+		# players, first one hit takes it
+		for p in range(self.players):
+			hit = ~stopped & (t[g, p, self.STATE] == Tank.STATE_ALIVE) & self.overlapsTank(g, p, x, y, w, h)
+			if hit.any():
+				self.playerHit(g[hit], p, owner[hit] == Tank.SIDE_PLAYER)
+				stopped |= hit
+
+		# enemies, only players' bullets hurt them
+		for e in range(self.enemy_count[g].max()):
+			s = self.players + e
+			hit = ~stopped & (owner == Tank.SIDE_PLAYER) & (e < self.enemy_count[g]) & (t[g, s, self.STATE] == Tank.STATE_ALIVE) & self.overlapsTank(g, s, x, y, w, h)
+			if hit.any():
+				self.enemyHit(g[hit], s, b[g[hit], i, self.SHOOTER])
+				stopped |= hit
+
+		# castle
+		cx, cy, cw, ch = self.CASTLE_RECT
+		hit = ~stopped & self.castle[g] & (x < cx + cw) & (cx < x + w) & (y < cy + ch) & (cy < y + h)
+		self.castle[g[hit]] = False
+		stopped |= hit
+
+		b[g[stopped], i, self.BSTATE] = Bullet.STATE_REMOVED
+
+	def overlapsTank(self, g, s, x, y, w, h):
+		""" Check which rects overlap tanks in slot s """
+		t = self.tanks
+		tx = t[g, s, self.X]
+		ty = t[g, s, self.Y]
+		return (x < tx + 26) & (tx < x + w) & (y < ty + 26) & (ty < y + h)
+
+	def explodeBullets(self, g, i):
+		""" Start explosion of i-th bullets, see Bullet.explode() """
+		self.bullets[g, i, self.BSTATE] = Bullet.STATE_EXPLODING
+		self.bullets[g, i, self.BEXPLOSION] = self.BULLET_EXPLOSION
+
+	def playerHit(self, g, p, friendly):
+		""" Bullets hit players: enemies' kill, other player's paralyse, see Tank.bulletImpact() """
+
+		t = self.tanks
+		exposed = t[g, p, self.SHIELDED] == 0
+
+		killed = g[exposed & ~friendly]
+		t[killed, p, self.HEALTH] -= 100
+		self.explodeTanks(killed[t[killed, p, self.HEALTH] < 1], p)
+
+		paralysed = g[exposed & friendly & (t[g, p, self.PARALISED] == 0)]
+		t[paralysed, p, self.PARALISED] = 1
+		pending = t[paralysed, p, self.PARALYSE_TIMER] > 0
+		t[paralysed[~pending], p, self.PARALYSE_TIMER] = 10000 // self.TICK_MS + 1
+		t[paralysed[pending], p, self.PARALYSE_NEXT] = 10000 // self.TICK_MS + 1
+
+	def enemyHit(self, g, s, shooter):
+		""" Players' bullets hit enemies, shooter scores when they die """
+
+		t = self.tanks
+		t[g, s, self.HEALTH] -= 100
+		dead = t[g, s, self.HEALTH] < 1
+		g, shooter = g[dead], shooter[dead]
+		t[g, shooter, self.SCORE] += (t[g, s, self.TYPE] + 1) * 100
+		self.explodeTanks(g, s)
+
+	def spawnEnemy(self, g):
+		""" Add enemy at a free spawning position, see Game.spawnEnemy() """
+
+		t = self.tanks
+		g = g[(self.enemy_count[g] < self.max_active_enemies[g]) & (self.enemies_left[g] > 0) & ~self.timefreeze[g]]
+		if len(g) == 0:
+			return
+
+		self.enemies_left[g] -= 1
+		kind = self.queue[g, self.enemies_left[g]]
+		direction, order = self.chooseSpawns(len(g))
+
+		# first of shuffled spawning positions no tank is on
+		x = np.zeros(len(g), np.int32)
+		y = np.zeros(len(g), np.int32)
+		found = np.zeros(len(g), bool)
+		for k in range(3):
+			px = self.SPAWN_POSITIONS[order[:, k], 0]
+			py = self.SPAWN_POSITIONS[order[:, k], 1]
+			free = ~found & ~self.hitsTanks(g, px, py, self.players, self.slots) & ~self.hitsTanks(g, px, py, 0, self.players)
+			x[free] = px[free]
+			y[free] = py[free]
+			found |= free
+
+		# when there is no room, Enemy() fails and its timer is destroyed, so
+		# enemy is lost and no more enemies spawn
+		self.spawn_timer[g[~found]] = 0
+		g, kind, direction, x, y = g[found], kind[found], direction[found], x[found], y[found]
+
+		s = self.players + self.enemy_count[g]
+		t[g, s] = 0
+		t[g, s, self.X] = x
+		t[g, s, self.Y] = y
+		t[g, s, self.DIR] = direction
+		t[g, s, self.STATE] = Tank.STATE_SPAWNING
+		t[g, s, self.SIDE] = Tank.SIDE_ENEMY
+		t[g, s, self.TYPE] = kind
+		t[g, s, self.SPEED] = self.ENEMY_SPEED[kind]
+		t[g, s, self.HEALTH] = self.ENEMY_HEALTH[kind]
+		t[g, s, self.SUPERPOWERS] = self.ENEMY_SUPERPOWERS[kind]
+		t[g, s, self.MAX_BULLETS] = 1
+		t[g, s, self.SERIAL] = self.next_serial[g]
+		t[g, s, self.SPAWN_TIMER] = 1000 // self.TICK_MS + 1
+		t[g, s, self.FIRE_TIMER] = self.FIRE_PERIOD + 1
+		self.next_serial[g] += 1
+		self.enemy_count[g] += 1
+
+		for slot in np.unique(s):
+			gs = g[s == slot]
+			self.generatePath(gs, slot, t[gs, slot, self.DIR], False)
+
+	def updateTimers(self, g):
+		""" Count timers down and fire those that are due, see Timer.update() """
+
+		t = self.tanks
+		b = self.bullets
+
+		# all timers due in a tick have the same due time, so they fire in order
+		# they were added: spawning, then each enemy's own in order of enemies
+		due = {}
+		for field in (self.EXPLOSION, self.SHIELD_TIMER, self.PARALYSE_TIMER, self.PARALYSE_NEXT, self.SPAWN_TIMER, self.FIRE_TIMER):
+			timers = t[g, :, field]
+			due[field] = timers == 1
+			t[g, :, field] = timers - (timers > 0)
+
+		explosions = b[g, :, self.BEXPLOSION]
+		b[g, :, self.BEXPLOSION] = explosions - (explosions > 0)
+
+		spawn = g[self.spawn_timer[g] == 1]
+		self.spawn_timer[g] -= self.spawn_timer[g] > 0
+		if len(spawn):
+			self.spawn_timer[spawn] = self.SPAWN_PERIOD
+			self.spawnEnemy(spawn)
+
+		for s in range(self.slots):
+			gs = g[due[self.SHIELD_TIMER][:, s]]
+			t[gs, s, self.SHIELDED] = 0
+
+			# paralysis timer of player who has respawned meanwhile is still there
+			# and ends the next paralysis early. if tank isn't alive, it destroys
+			# the latest timer instead
+			gs = g[due[self.PARALYSE_TIMER][:, s]]
+			if len(gs):
+				alive = t[gs, s, self.STATE] == Tank.STATE_ALIVE
+				t[gs[alive], s, self.PARALISED] = 0
+				t[gs[~alive], s, self.PARALYSE_NEXT] = 0
+				t[gs, s, self.PARALYSE_TIMER] = t[gs, s, self.PARALYSE_NEXT]
+				t[gs, s, self.PARALYSE_NEXT] = 0
+
+			gs = g[due[self.SPAWN_TIMER][:, s]]
+			t[gs, s, self.STATE] = Tank.STATE_ALIVE
+
+			gs = g[due[self.FIRE_TIMER][:, s]]
+			if len(gs):
+				# timer of enemy that isn't alive is gone for good
+				alive = gs[t[gs, s, self.STATE] == Tank.STATE_ALIVE]
+				t[alive, s, self.FIRE_TIMER] = self.FIRE_PERIOD
+				self.fire(alive, s)
+
+	def loadGame(self, index, game):
+		""" Copy state of object engine's game into game index
+		@param int index
+		@param tanks.Game game Game with players created, bonuses are left out
+		@return None
+		"""
+
+		world = game.world
+		level = game.level
+		g = index
+
+		if len(world.players) != self.players:
+			raise ValueError("game has %d players, expected %d" % (len(world.players), self.players))
+		if len(world.enemies) > self.ENEMY_SLOTS or len(world.bullets) > self.BULLET_SLOTS or len(level.enemies_left) > self.QUEUE_SIZE:
+			raise ValueError("game doesn't fit into slots")
+
+		self.grid[g] = np.frombuffer(bytearray(level.grid), np.uint8).reshape(self.GRID_SIZE, self.GRID_SIZE)
+		self.castle[g] = world.castle.active
+		self.stage[g] = game.stage
+		self.running[g] = game.running
+		self.active[g] = game.active
+		self.game_over[g] = game.game_over
+		self.timefreeze[g] = game.timefreeze
+		self.max_active_enemies[g] = level.max_active_enemies
+		self.queue[g] = 0
+		self.queue[g, :len(level.enemies_left)] = level.enemies_left
+		self.enemies_left[g] = len(level.enemies_left)
+		self.pressed[g] = 0
+
+		# ticks until each timer fires next
+		tanks = world.players + world.enemies
+		serials = dict((tank, i) for i, tank in enumerate(tanks))
+		timers = {}
+		self.spawn_timer[g] = 0
+		for timer in world.timer.timers.values():
+			target = getattr(timer["callback"], "__self__", None)
+			name = timer["callback"].__name__
+			ticks = (timer["due"] - world.timer.time) // self.TICK_MS + 1
+			if name == "update" and timer["repeat"] > 0:
+				# explosion ends when its last frame is over
+				ticks += (timer["repeat"] - timer["times"] - 1) * (timer["interval"] // self.TICK_MS)
+			if name == "shieldPlayer":
+				target = timer["args"][0]
+			if name == "spawnEnemy":
+				self.spawn_timer[g] = ticks
+			timers.setdefault((target, name), []).append(ticks)
+		for key in timers:
+			timers[key].sort()
+
+		def ticksLeft(target, name, n = 0):
+			""" Ticks until n-th pending timer of target fires, 0 if there is none """
+			pending = timers.get((target, name), [])
+			return pending[n] if n < len(pending) else 0
+
+		t = self.tanks
+		t[g] = 0
+		for s, tank in enumerate(tanks):
+			t[g, s, self.X], t[g, s, self.Y] = tank.rect.topleft
+			t[g, s, self.DIR] = tank.direction
+			t[g, s, self.STATE] = tank.state
+			t[g, s, self.SIDE] = tank.side
+			t[g, s, self.SPEED] = tank.speed
+			t[g, s, self.HEALTH] = tank.health
+			t[g, s, self.SUPERPOWERS] = tank.superpowers
+			t[g, s, self.MAX_BULLETS] = tank.max_active_bullets
+			t[g, s, self.PARALISED] = tank.paralised
+			t[g, s, self.SHIELDED] = tank.shielded
+			t[g, s, self.PAUSED] = tank.paused
+			t[g, s, self.SERIAL] = s
+			t[g, s, self.SHIELD_TIMER] = ticksLeft(tank, "shieldPlayer")
+			t[g, s, self.PARALYSE_TIMER] = ticksLeft(tank, "setParalised")
+			t[g, s, self.PARALYSE_NEXT] = ticksLeft(tank, "setParalised", 1)
+			t[g, s, self.SPAWN_TIMER] = ticksLeft(tank, "endSpawning")
+			t[g, s, self.FIRE_TIMER] = ticksLeft(tank, "fire")
+			if hasattr(tank, "explosion"):
+				t[g, s, self.EXPLOSION] = ticksLeft(tank.explosion, "update") if tank.explosion.active else 0
+
+			if tank.side == Tank.SIDE_PLAYER:
+				t[g, s, self.LIVES] = tank.lives
+				t[g, s, self.SCORE] = tank.score
+			else:
+				t[g, s, self.TYPE] = tank.type
+				t[g, s, self.PATH_X] = tank.path_x
+				t[g, s, self.PATH_Y] = tank.path_y
+				t[g, s, self.PATH_DX] = tank.path_dx
+				t[g, s, self.PATH_DY] = tank.path_dy
+				t[g, s, self.PATH_STEPS] = tank.path_steps
+				t[g, s, self.PATH_STEP] = tank.path_step
+		self.enemy_count[g] = len(world.enemies)
+		self.next_serial[g] = len(tanks)
+
+		b = self.bullets
+		b[g] = 0
+		for i, bullet in enumerate(world.bullets):
+			b[g, i, self.BX], b[g, i, self.BY], b[g, i, self.BW], b[g, i, self.BH] = bullet.rect
+			b[g, i, self.BDIR] = bullet.direction
+			b[g, i, self.BSTATE] = bullet.state
+			b[g, i, self.OWNER] = bullet.owner
+			b[g, i, self.SHOOTER] = serials.get(bullet.owner_class, -1)
+			b[g, i, self.BSPEED] = bullet.speed
+			b[g, i, self.POWER] = bullet.power
+			if hasattr(bullet, "explosion"):
+				b[g, i, self.BEXPLOSION] = ticksLeft(bullet.explosion, "update") if bullet.explosion.active else 0
+		self.bullet_count[g] = len(world.bullets)
+
+	def describe(self, index):
+		""" Game's state as plain data, comparable with describeGame() """
+
+		t = self.tanks[index]
+		b = self.bullets[index]
+		players = [tuple(t[p, [self.X, self.Y, self.DIR, self.STATE, self.LIVES, self.SCORE, self.PARALISED, self.SHIELDED]]) for p in range(self.players)]
+		enemies = [tuple(t[s, [self.X, self.Y, self.DIR, self.STATE, self.TYPE, self.HEALTH]]) for s in range(self.players, self.players + self.enemy_count[index])]
+		bullets = [tuple(b[i, [self.BX, self.BY, self.BDIR, self.BSTATE, self.OWNER]]) for i in range(self.bullet_count[index])]
+		flags = (bool(self.castle[index]), bool(self.running[index]), bool(self.game_over[index]), int(self.enemies_left[index]))
+		return (self.grid[index].tobytes(), flags, [tuple(int(v) for v in row) for row in players], [tuple(int(v) for v in row) for row in enemies], [tuple(int(v) for v in row) for row in bullets])
+
+class RecordedRandom(random.Random):
+	""" Game's random number generator that keeps choices enemies make with it,
+	so BatchSim can make the same ones instead of its own, see BatchSim.choices
+	"""
+
+	# x of spawning positions, by index in BatchSim.SPAWN_POSITIONS
+	SPAWN_X = [int(x) for x in BatchSim.SPAWN_POSITIONS[:, 0]]
+
+	def __init__(self, seed = None):
+		random.Random.__init__(self, seed)
+		self.forget()
+
+	def forget(self):
+		""" Drop choices made so far """
+
+		# directions and orders of spawning positions of spawning enemies
+		self.spawn_directions = []
+		self.spawn_orders = []
+
+		# orders of directions and lengths of new paths
+		self.path_orders = []
+		self.path_pixels = []
+
+	def choice(self, seq):
+		value = random.Random.choice(self, seq)
+		self.spawn_directions.append(value)
+		return value
+
+	def shuffle(self, x, *args):
+		random.Random.shuffle(self, x, *args)
+		if isinstance(x[0], list):
+			self.spawn_orders.append([self.SPAWN_X.index(position[0]) for position in x])
+		else:
+			self.path_orders.append(list(x))
+
+	def randint(self, a, b):
+		value = random.Random.randint(self, a, b)
+		# path length in 32 px, see Enemy.generatePath()
+		if (a, b) == (1, 12):
+			self.path_pixels.append(value * 32)
+		return value
+
+	def takePaths(self, count):
+		""" Oldest choices of new paths, see BatchSim.choosePaths() """
+		orders, self.path_orders = self.path_orders[:count], self.path_orders[count:]
+		pixels, self.path_pixels = self.path_pixels[:count], self.path_pixels[count:]
+		return (np.array(orders).reshape(count, 4), np.array(pixels, np.int32))
+
+	def takeSpawns(self, count):
+		""" Oldest choices of spawning enemies, see BatchSim.chooseSpawns() """
+		directions, self.spawn_directions = self.spawn_directions[:count], self.spawn_directions[count:]
+		orders, self.spawn_orders = self.spawn_orders[:count], self.spawn_orders[count:]
+		return (np.array(directions, np.int32), np.array(orders).reshape(count, 3))
+
+def describeGame(game):
+	""" Game's state as plain data, see BatchSim.describe() """
+
+	world = game.world
+	players = [(p.rect.left, p.rect.top, p.direction, p.state, p.lives, p.score, int(p.paralised), int(p.shielded)) for p in world.players]
+	enemies = [(e.rect.left, e.rect.top, e.direction, e.state, e.type, e.health) for e in world.enemies]
+	bullets = [(b.rect.left, b.rect.top, b.direction, b.state, b.owner) for b in world.bullets]
+	flags = (world.castle.active, game.running, game.game_over, len(game.level.enemies_left))
+	return (bytes(bytearray(game.level.grid)), flags, players, enemies, bullets)
+
+def checkParity(game, stage = 1, seed = 0, ticks = 3000, players = 2):
+	""" Play the same input in object engine and batch simulator and compare them
+	after every tick. Enemies spawn, move and shoot in both, making the same
+	random choices, see RecordedRandom. Enemies don't carry bonuses, as batch
+	simulator has none
+	@param tanks.Game game Headless game to play in
+	@return int Tick of first difference, None if there was none
+	"""
+
+	world = game.world
+	rng = world.rng
+
+	try:
+		world.rng = RecordedRandom(seed)
+		game.nr_of_players = players
+		del world.players[:]
+		game.stage = stage - 1
+		game.startLevel()
+		world.rng.forget()
+
+		batch = BatchSim(1, players)
+		batch.choices = world.rng
+		batch.loadGame(0, game)
+
+		inputs_rng = random.Random(seed)
+		held = [0] * players
+		for tick in range(ticks):
+			if not game.running:
+				break
+
+			# wander around and shoot, but not at own castle
+			inputs = []
+			for p, player in enumerate(world.players):
+				if inputs_rng.randint(1, 20) == 1:
+					held[p] = 1 << inputs_rng.randint(0, 3) if inputs_rng.randint(0, 4) else 0
+				safe = player.direction == Tank.DIR_UP or (player.direction != Tank.DIR_DOWN and player.rect.bottom <= world.castle.rect.top)
+				inputs.append(held[p] | (16 if safe and inputs_rng.randint(1, 4) == 1 else 0))
+
+			for player, value in zip(world.players, inputs):
+				if player.state == player.STATE_ALIVE:
+					game.setInput(player, value)
+				else:
+					game.setInput(player, value & 15)
+			game.update(game.TICK_MS)
+
+			for enemy in world.enemies:
+				if enemy.bonus:
+					enemy.bonus = False
+					enemy.flash = False
+					world.timer.destroy(enemy.timer_uuid_flash)
+
+			batch.step(np.array([inputs]))
+
+			if describeGame(game) != batch.describe(0):
+				return tick
+		return None
+
+	finally:
+		world.rng = rng
+
+if __name__ == "__main__":
+
+	options = {}
+	for arg in sys.argv[1:]:
+		if arg.startswith("--"):
+			name, sep, value = arg[2:].partition("=")
+			options[name] = value
+
+	seed = int(options.get("seed", 0))
+
+	if "parity" in options:
+		game = Game(True)
+		failed = 0
+		for stage in range(1, 36):
+			for players in (1, 2):
+				tick = checkParity(game, stage, seed + stage, players = players)
+				print("stage %2d, %d player(s): %s" % (stage, players, "ok" if tick == None else "differs at tick %d" % tick))
+				if tick != None:
+					failed += 1
+		sys.exit(1 if failed else 0)
+
+	games = int(options.get("games", 1000))
+	ticks = int(options.get("ticks", 500))
+
+	sim = BatchSim(games, 1, seed = seed)
+	sim.reset(1)
+	rng = np.random.RandomState(seed)
+	start = time.time()
+	for i in range(ticks):
+		actions = (1 << rng.randint(0, 4, (games, 1))) | (rng.randint(0, 2, (games, 1)) << 4)
+		obs, rewards, done = sim.step(actions)
+		if done.any():
+			sim.reset(1, indexes = np.nonzero(done)[0])
+	elapsed = time.time() - start
+	print("%d games, %d ticks: %.0f steps per second" % (games, ticks, games * ticks / elapsed))
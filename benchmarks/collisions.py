@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Collision broadphase benchmark
+Synthetic part moves N tanks and bullets around a map whose area grows with N,
+so that local density stays the same, and times finding what each object
+collides with: by scanning all objects, by SpatialHash looking up cells only
+and by SpatialHash as the game uses it, scanning kinds with up to SCAN_LIMIT
+objects. Scan cost per object grows with N, cell lookup cost should stay about
+flat.
+
+Game part times the real users of the index, Enemy.move() and Bullet.update(),
+on an empty stage with as many enemies and bullets as a game has and with
+more, with cell lookup only and as the game uses it.
+
+Run from repository root: python benchmarks/collisions.py
+"""
+
+import time, random, pygame
+
+from common import tanks, setUp, clearLevel, spawnEnemies
+
+from tanks import SpatialHash
+
+clock = getattr(time, "perf_counter", time.time)
+
+class Tank(object):
+
+	def __init__(self, rect, speed):
+		self.rect = rect
+		self.speed = speed
+
+class Bullet(Tank):
+	pass
+
+def makeEntities(count, size):
+	""" Half tanks (26x26, speed 2), half bullets (6x8, speed 5) """
+	entities = []
+	for i in range(count):
+		if i % 2 == 0:
+			kind, w, h, speed = Tank, 26, 26, 2
+		else:
+			kind, w, h, speed = Bullet, 6, 8, 5
+		rect = pygame.Rect(random.randint(0, size - w), random.randint(0, size - h), w, h)
+		entities.append(kind(rect, random.choice([(0, -speed), (speed, 0), (0, speed), (-speed, 0)])))
+	return entities
+
+def step(entities, size, index = None):
+	""" Move entities, bouncing off map edges """
+	for entity in entities:
+		entity.rect.move_ip(entity.speed)
+		if entity.rect.left < 0 or entity.rect.top < 0 or entity.rect.right > size or entity.rect.bottom > size:
+			entity.speed = (-entity.speed[0], -entity.speed[1])
+			entity.rect.move_ip(entity.speed)
+		if index != None:
+			index.update(entity)
+
+def run(count, ticks, scan_limit = None):
+	""" Run ticks of movement and collision checks. Like the game, every object
+	looks for tanks and bullets separately
+	@param int scan_limit SpatialHash.SCAN_LIMIT to use, None to scan all objects
+		without index
+	@return tuple (seconds, number of collisions found)
+	"""
+	random.seed(count)
+
+	# 416x416 map with 30 objects is about what the game has
+	size = int(416 * (count / 30.0) ** 0.5)
+	entities = makeEntities(count, size)
+
+	index = None
+	if scan_limit != None:
+		index = SpatialHash()
+		index.SCAN_LIMIT = scan_limit
+		for entity in entities:
+			index.add(entity)
+
+	collisions = 0
+	start = clock()
+	for tick in range(ticks):
+		step(entities, size, index)
+		for entity in entities:
+			for kind in (Tank, Bullet):
+				if index != None:
+					candidates = index.query(entity.rect, kind)
+				else:
+					candidates = [other for other in entities if other.__class__ is kind]
+				for other in candidates:
+					if other is not entity and entity.rect.colliderect(other.rect):
+						collisions += 1
+	return (clock() - start, collisions)
+
+def runGame(world, enemies, bullets, ticks, scan_limit):
+	""" Move enemies and fly bullets on empty stage
+	@param int scan_limit SpatialHash.SCAN_LIMIT to use
+	@return tuple Microseconds per Enemy.move() and per Bullet.update()
+	"""
+	rng = world.rng
+	rng.seed(enemies)
+	world.timer.clear()
+	del world.enemies[:]
+	del world.bullets[:]
+	level = tanks.Level(world, 1)
+	level.spatial.SCAN_LIMIT = scan_limit
+	clearLevel(level)
+	spawnEnemies(level, enemies, rng)
+
+	# bullets that leave the map are fired again, so there are always as many
+	def fire():
+		bullet = tanks.Bullet(world, level, (rng.randint(0, 410), rng.randint(0, 400)), rng.randint(0, 3))
+		bullet.owner = bullet.OWNER_ENEMY
+		world.bullets.append(bullet)
+		level.spatial.add(bullet)
+
+	for i in range(bullets):
+		fire()
+
+	move_time = update_time = 0.0
+	moves = updates = 0
+	for tick in range(ticks):
+		start = clock()
+		for enemy in world.enemies:
+			enemy.move()
+		move_time += clock() - start
+		moves += len(world.enemies)
+
+		start = clock()
+		for bullet in world.bullets:
+			if bullet.state == bullet.STATE_ACTIVE:
+				bullet.update()
+				updates += 1
+		update_time += clock() - start
+
+		for bullet in world.bullets[:]:
+			if bullet.state != bullet.STATE_ACTIVE:
+				world.bullets.remove(bullet)
+				level.spatial.remove(bullet)
+				fire()
+
+	return (move_time * 1000000.0 / max(moves, 1), update_time * 1000000.0 / max(updates, 1))
+
+if __name__ == "__main__":
+
+	world = setUp().world
+
+	ticks = 20
+
+	print("%8s %14s %14s %14s" % ("objects", "scan us/obj", "cells us/obj", "hash us/obj"))
+	for count in (30, 100, 300, 1000, 3000):
+		scan_time, scan_collisions = run(count, ticks)
+		cells_time, cells_collisions = run(count, ticks, 0)
+		hash_time, hash_collisions = run(count, ticks, SpatialHash.SCAN_LIMIT)
+		if not scan_collisions == cells_collisions == hash_collisions:
+			print("Mismatch at %d objects: scan found %d collisions, cells %d, hash %d" % (count, scan_collisions, cells_collisions, hash_collisions))
+			raise SystemExit(1)
+
+		per_object = 1000000.0 / (count * ticks)
+		print("%8d %14.1f %14.1f %14.1f" % (count, scan_time * per_object, cells_time * per_object, hash_time * per_object))
+
+	ticks = 500
+
+	print("")
+	print("%8s %8s %16s %16s %16s %16s" % ("enemies", "bullets", "cells move us", "hash move us", "cells bullet us", "hash bullet us"))
+	for enemies, bullets in ((4, 6), (20, 10), (40, 40), (80, 120)):
+		cells_move, cells_bullet = runGame(world, enemies, bullets, ticks, 0)
+		hash_move, hash_bullet = runGame(world, enemies, bullets, ticks, SpatialHash.SCAN_LIMIT)
+		print("%8d %8d %16.2f %16.2f %16.2f %16.2f" % (enemies, bullets, cells_move, hash_move, cells_bullet, hash_bullet))
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Shared setup of benchmarks
+Runs the game offscreen with SDL dummy drivers, from repository root so assets
+and levels are found
+"""
+
+import os, sys, random
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root)
+os.chdir(root)
+
+import tanks
+
+def setUp(seed = 0, level_pack = None):
+	""" Create headless game
+	@param int seed Seed of game's random number generator
+	@param LevelPack level_pack
+	@return tanks.Game Headless game
+	"""
+	game = tanks.Game(True, level_pack)
+	game.world.rng.seed(seed)
+	return game
+
+def clearLevel(level):
+	""" Remove all tiles from level """
+	for i in range(len(level.grid)):
+		if level.grid[i] != level.TILE_EMPTY:
+			level.setTile(i % level.GRID_SIZE, i // level.GRID_SIZE, level.TILE_EMPTY)
+
+def spawnEnemies(level, count, rng = random):
+	""" Put count alive enemies of random types on free 32x32 spots of level
+	@return list Enemies
+	"""
+	spots = [(x, y) for x in range(0, 416 - 32, 32) for y in range(0, 416 - 64, 32)]
+	rng.shuffle(spots)
+
+	spawned = []
+	for x, y in spots[:count]:
+		level.enemies_left = [rng.choice([0, 1, 2, 3])]
+		enemy = tanks.Enemy(level.world, level, 1, (x, y))
+		enemy.rect.topleft = (x, y)
+		enemy.state = enemy.STATE_ALIVE
+		enemy.generatePath(enemy.direction)
+		level.world.enemies.append(enemy)
+		level.spatial.add(enemy)
+		spawned.append(enemy)
+	return spawned
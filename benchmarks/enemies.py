@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Enemy movement benchmark
+Puts N alive enemies on an empty map and times Enemy.move() per tick. Paths are
+straight segments evaluated step by step, so cost per enemy should not depend
+on N or on path length. For comparison, the same paths are also built and
+consumed the old way, as lists of positions popped from the front.
+
+Run from repository root: python benchmarks/enemies.py
+"""
+
+import time, random
+
+from common import tanks, setUp, clearLevel, spawnEnemies
+
+def runMoves(world, count, ticks):
+	""" @return float Microseconds per Enemy.move() call """
+	random.seed(count)
+	del world.enemies[:]
+	level = tanks.Level(world, 1)
+	clearLevel(level)
+	spawnEnemies(level, count)
+
+	start = time.time()
+	for tick in range(ticks):
+		for enemy in world.enemies:
+			enemy.move()
+	return (time.time() - start) * 1000000.0 / (len(world.enemies) * ticks)
+
+def listPath(x, y, pixels, speed):
+	""" Path as it used to be stored: every position along it """
+	return [[x, y - px] for px in range(0, pixels, speed)]
+
+def runPaths(world, paths):
+	""" Walk paths of all lengths both ways
+	@return tuple Microseconds per step with position lists, with segments
+	"""
+
+	steps = 0
+	start = time.time()
+	for pixels in paths:
+		path = listPath(200, 400, pixels, 1)
+		while path != []:
+			path.pop(0)
+			steps += 1
+	list_time = time.time() - start
+
+	enemy = world.enemies[0]
+	start = time.time()
+	for pixels in paths:
+		enemy.path_x, enemy.path_y, enemy.path_dx, enemy.path_dy = 200, 400, 0, -1
+		enemy.path_steps = pixels
+		enemy.path_step = 0
+		while enemy.path_step < enemy.path_steps:
+			enemy.nextPathPosition()
+	segment_time = time.time() - start
+
+	return (list_time * 1000000.0 / steps, segment_time * 1000000.0 / steps)
+
+if __name__ == "__main__":
+
+	world = setUp().world
+
+	ticks = 200
+
+	print("%8s %16s" % ("enemies", "us per move"))
+	for count in (4, 20, 60, 120):
+		print("%8d %16.2f" % (count, runMoves(world, count, ticks)))
+
+	random.seed(0)
+	paths = [random.randint(1, 12) * 32 + 3 for i in range(2000)]
+	list_step, segment_step = runPaths(world, paths)
+	print("")
+	print("path step with position list: %.3f us, with segment: %.3f us" % (list_step, segment_step))
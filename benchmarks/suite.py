@@ -0,0 +1,394 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Benchmark suite
+Micro benchmarks time single hot functions. Macro scenarios play stages
+headless with scripted input - Game.autopilot() driven by seeded random number
+generator - and draw every frame offscreen: each of the 35 stages, a stage full
+of bricks and a stress case with 40 enemies.
+
+Every benchmark is timed in ROUNDS rounds, each repeated until it has taken at
+least ROUND_SECONDS, and the result is their median. Rounds are interleaved:
+first round of every benchmark, then second round of every one and so on, so a
+slow moment of the machine spoils one round of a few benchmarks rather than all
+rounds of one. How much rounds spread around the median, as median absolute
+deviation (MAD), is kept with the result.
+
+How fast the machine is at the moment is measured too: a fixed reference
+workload, that doesn't touch game code, is timed before every round. Rounds are
+scaled to the run's median speed, and results to baseline's speed before they
+are compared, so that machine running slower for a while or all through a run
+isn't taken for a regression. Slower game code doesn't slow the reference, so
+it isn't hidden.
+
+Results are written as JSON and compared against baselines. Micro benchmark
+slower than baseline, scenario with fewer ticks per second or longer p95 frame
+time is reported as regression, and exit status is 1, when the difference is
+over SPREAD_FACTOR standard errors, estimated from MADs of result and
+baseline, and also over tolerance.
+Baselines depend on the machine, so none are shipped: save your own with
+--save-baseline on first run. Host name and Python and pygame versions are
+saved with them; results from another host or other versions are not compared.
+
+Usage (from repository root):
+	python benchmarks/suite.py [--output=<file>] [--baseline=<file>]
+		[--tolerance=<fraction>] [--only=<name prefix>] [--save-baseline]
+"""
+
+import sys, json, time, math, random, platform, pygame
+
+from common import tanks, setUp, clearLevel, spawnEnemies
+
+clock = getattr(time, "perf_counter", time.time)
+
+BASELINE_FILE = "benchmarks/baselines.json"
+
+# rounds each benchmark is timed in, result is their median
+ROUNDS = 15
+
+# least time a round is timed for: its run is repeated until then, so that a
+# scheduler hiccup is a small part of it
+ROUND_SECONDS = 0.1
+
+# difference from baseline, in standard errors of the difference, that is
+# reported as regression, see compare()
+SPREAD_FACTOR = 3.0
+
+# ticks played in each scenario run
+SCENARIO_TICKS = 500
+
+def median(values):
+	values = sorted(values)
+	return (values[(len(values) - 1) // 2] + values[len(values) // 2]) / 2.0
+
+def summarize(samples):
+	""" @return tuple Median of samples and their median absolute deviation """
+	middle = median(samples)
+	return (middle, median([abs(sample - middle) for sample in samples]))
+
+def measure(world, prepare, run):
+	""" Time one round: run(state) on fresh state from prepare(), repeated until
+	ROUND_SECONDS have been timed
+	@param tanks.World world World prepare sets up state in
+	@param callable prepare Returns state for run
+	@param callable run Returns number of calls it made
+	@return float Microseconds per call
+	"""
+	elapsed = 0.0
+	calls = 0
+	while elapsed < ROUND_SECONDS:
+		world.timer.clear()
+		state = prepare()
+		start = clock()
+		calls += run(state)
+		elapsed += clock() - start
+	return elapsed * 1000000.0 / calls
+
+def newLevel(world):
+	del world.enemies[:]
+	del world.bullets[:]
+	return tanks.Level(world, 1)
+
+def benchHitTile(world):
+	positions = [(x * 16, y * 16) for y in range(26) for x in range(26)]
+	def run(level):
+		for pos in positions:
+			level.hitTile(pos)
+		return len(positions)
+	return measure(world, lambda: newLevel(world), run)
+
+def benchUpdateObstacleRows(world):
+	def run(level):
+		for i in range(50):
+			level.updateObstacleRows()
+		return 50
+	return measure(world, lambda: newLevel(world), run)
+
+def benchGeneratePath(world):
+	def prepare():
+		level = newLevel(world)
+		world.rng.seed(0)
+		return spawnEnemies(level, 1, world.rng)[0]
+	def run(enemy):
+		for i in range(2000):
+			enemy.generatePath(None, True)
+		return 2000
+	return measure(world, prepare, run)
+
+def benchBulletUpdate(world):
+	rng = world.rng
+	def prepare():
+		level = newLevel(world)
+		clearLevel(level)
+		rng.seed(0)
+		for i in range(60):
+			bullet = tanks.Bullet(world, level, (rng.randint(0, 390), rng.randint(0, 330)), rng.randint(0, 3))
+			bullet.owner = bullet.OWNER_ENEMY
+			world.bullets.append(bullet)
+			level.spatial.add(bullet)
+		return world.bullets
+	def run(bullets):
+		calls = 0
+		active = True
+		while active:
+			active = False
+			for bullet in bullets:
+				if bullet.state == bullet.STATE_ACTIVE:
+					bullet.update()
+					calls += 1
+					active = True
+		return calls
+	return measure(world, prepare, run)
+
+def benchTimerUpdate(world):
+	def prepare():
+		timer = tanks.Timer()
+		rng = random.Random(0)
+		for i in range(500):
+			timer.add(rng.randint(20, 2000), lambda :None, rng.choice([-1, -1, 1, 5]))
+		return timer
+	def run(timer):
+		for i in range(2000):
+			timer.update(20)
+		return 2000
+	return measure(world, prepare, run)
+
+def benchLevelDrawLayers(world):
+	def run(level):
+		for i in range(200):
+			level.drawTerrain()
+			level.drawGrass()
+		return 200
+	return measure(world, lambda: newLevel(world), run)
+
+def playScenario(game, stage, prepare = None):
+	""" Play SCENARIO_TICKS ticks of stage from its start, drawing every frame, over
+	and over until ROUND_SECONDS have passed
+	@param int stage
+	@param callable prepare Called with game after stage has started
+	@return dict Results
+	"""
+
+	sim_time = 0.0
+	ticks = 0
+	frame_times = []
+	while sim_time + sum(frame_times) / 1000 < ROUND_SECONDS:
+		startStage(game, stage)
+		if prepare != None:
+			prepare(game)
+
+		for i in range(SCENARIO_TICKS):
+			start = clock()
+			for player in game.world.players:
+				game.autopilot(player)
+			game.update(game.TICK_MS)
+			simulated = clock()
+			game.draw()
+			end = clock()
+
+			sim_time += simulated - start
+			frame_times.append((end - start) * 1000)
+		ticks += SCENARIO_TICKS
+
+	frame_times.sort()
+	return {
+		"ticks_per_sec" : ticks / sim_time,
+		"frame_p95_ms" : frame_times[len(frame_times) * 95 // 100]
+	}
+
+def startStage(game, stage):
+	""" Start stage with one player, from scratch """
+	game.world.rng.seed(stage)
+	del game.world.players[:]
+	game.nr_of_players = 1
+	game.stage = stage - 1
+	game.startLevel()
+
+def fillWithBricks(game):
+	""" Turn every free cell except spawning places and castle area into brick """
+	level = game.level
+	for y in range(2, 23):
+		for x in range(26):
+			if level.grid[y * 26 + x] == level.TILE_EMPTY:
+				level.setTile(x, y, level.TILE_BRICK)
+
+def addEnemies(game):
+	""" Fill empty map with 40 enemies """
+	clearLevel(game.level)
+	game.level.max_active_enemies = 40
+	spawnEnemies(game.level, 40, game.world.rng)
+
+SCENARIOS = [("stage%02d" % stage, stage, None) for stage in range(1, 36)] + [
+	("bricks", 1, fillWithBricks),
+	("stress", 1, addEnemies)
+]
+
+MICRO = [
+	("hitTile", benchHitTile),
+	("updateObstacleRows", benchUpdateObstacleRows),
+	("generatePath", benchGeneratePath),
+	("Bullet.update", benchBulletUpdate),
+	("Timer.update", benchTimerUpdate),
+	("Level.drawLayers", benchLevelDrawLayers)
+]
+
+def reference():
+	""" Time fixed workload that doesn't depend on game code
+	@return float Seconds taken
+	"""
+	rects = [pygame.Rect(i * 37 % 390, i * 53 % 390, 26, 26) for i in range(48)]
+	cells = {}
+	hits = 0
+	start = clock()
+	for n in range(40):
+		for i, rect in enumerate(rects):
+			cells[(rect.x // 32, rect.y // 32)] = i
+			for other in rects:
+				if rect.colliderect(other):
+					hits += 1
+	return clock() - start
+
+def scale(name, value, slowdown):
+	""" Scale result to machine slowdown times faster """
+	if isHigherBetter(name):
+		return value * slowdown
+	return value / slowdown
+
+def runBenchmarks(game, only):
+	""" Time benchmarks whose name starts with only, a round of each at a time
+	@return tuple Result name => median and MAD, scaled to median speed of
+		machine during run, and reference time at that speed
+	"""
+
+	# name => callable timing one round and returning metric => value. micro
+	# benchmarks are in us per call, lower is better
+	benchmarks = []
+	for name, bench in MICRO:
+		benchmarks.append((name, lambda bench = bench: {"us_per_call" : bench(game.world)}))
+	for name, stage, prepare in SCENARIOS:
+		benchmarks.append((name, lambda stage = stage, prepare = prepare: playScenario(game, stage, prepare)))
+
+	# name => list of value and reference time of round
+	samples = {}
+	for i in range(ROUNDS):
+		for name, bench in benchmarks:
+			if name.startswith(only):
+				seconds = reference()
+				for metric, value in bench().items():
+					samples.setdefault(name + "." + metric, []).append((value, seconds))
+
+	if not samples:
+		return ({}, reference())
+	speed = median([seconds for key in samples for value, seconds in samples[key]])
+
+	results = {}
+	for key in samples:
+		results[key] = summarize([scale(key, value, seconds / speed) for value, seconds in samples[key]])
+	return (results, speed)
+
+def isHigherBetter(name):
+	return name.endswith("ticks_per_sec")
+
+def compare(results, spreads, baselines, base_spreads, tolerance):
+	""" Print results next to baselines
+	@param dict results Name => median
+	@param dict spreads Name => MAD of results
+	@param float tolerance Smallest change, as fraction of baseline, that counts
+		as regression however little results spread. Rounds of one run don't
+		show how much a machine drifts between runs, this has to cover it
+	@return list Names of regressed results
+	"""
+
+	regressions = []
+	print("%-32s %14s %14s %9s %9s" % ("benchmark", "baseline", "result", "change", "allowed"))
+	for name in sorted(results):
+		value = results[name]
+		if name not in baselines:
+			print("%-32s %14s %14.3f" % (name, "-", value))
+			continue
+
+		base = baselines[name]
+		change = (value - base) / base
+
+		# MAD * 1.4826 estimates standard deviation of rounds and median of n
+		# rounds deviates by 1.2533 times that over square root of n
+		error = 1.4826 * 1.2533 * math.sqrt(spreads[name] ** 2 + base_spreads.get(name, 0.0) ** 2) / math.sqrt(ROUNDS)
+		allowed = max(SPREAD_FACTOR * error / base, tolerance)
+		if isHigherBetter(name):
+			regressed = change < -allowed
+		else:
+			regressed = change > allowed
+		if regressed:
+			regressions.append(name)
+
+		print("%-32s %14.3f %14.3f %+8.1f%% %8.1f%%%s" % (name, base, value, change * 100, allowed * 100, " REGRESSION" if regressed else ""))
+	return regressions
+
+if __name__ == "__main__":
+
+	options = {}
+	for arg in sys.argv[1:]:
+		if arg.startswith("--"):
+			name, sep, value = arg[2:].partition("=")
+			options[name] = value
+
+	only = options.get("only", "")
+	tolerance = float(options.get("tolerance", 0.10))
+	baseline_file = options.get("baseline", BASELINE_FILE)
+
+	game = setUp()
+
+	measured, speed = runBenchmarks(game, only)
+
+	results = dict([(name, measured[name][0]) for name in measured])
+	spreads = dict([(name, measured[name][1]) for name in measured])
+
+	report = {
+		"host" : platform.node(),
+		"python" : sys.version.split()[0],
+		"pygame" : pygame.version.ver,
+		"results" : results,
+		"spreads" : spreads,
+		"reference" : speed
+	}
+
+	if "output" in options:
+		f = open(options["output"], "w")
+		json.dump(report, f, indent = 1, sort_keys = True)
+		f.close()
+
+	if "save-baseline" in options:
+		f = open(baseline_file, "w")
+		json.dump(report, f, indent = 1, sort_keys = True)
+		f.close()
+		print("Saved %d results to %s" % (len(results), baseline_file))
+		sys.exit(0)
+
+	try:
+		f = open(baseline_file)
+		saved = json.load(f)
+		f.close()
+		baselines = saved["results"]
+		base_spreads = saved["spreads"]
+		base_speed = saved["reference"]
+	except (IOError, ValueError, KeyError):
+		compare(results, spreads, {}, {}, tolerance)
+		sys.exit("No baselines in %s, save them with --save-baseline first" % baseline_file)
+
+	for key in ("host", "python", "pygame"):
+		if saved.get(key) != report[key]:
+			print("%s: baselines are from %s %s, this is %s %s" % (baseline_file, key, saved.get(key), key, report[key]))
+			sys.exit("Not comparing, save baselines with --save-baseline first")
+
+	# as if machine were as fast as when baselines were saved
+	slowdown = speed / base_speed
+	print("Reference workload takes %+.1f%% longer than when baselines were saved" % ((slowdown - 1) * 100))
+	for name in results:
+		results[name] = scale(name, results[name], slowdown)
+		spreads[name] = scale(name, spreads[name], slowdown)
+
+	regressions = compare(results, spreads, baselines, base_spreads, tolerance)
+	if regressions:
+		print("%d regression(s) beyond spread and %.0f%% tolerance" % (len(regressions), tolerance * 100))
+		sys.exit(1)
+	print("No regressions in %d results" % len(results))
@@ -0,0 +1,260 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Thin client
+Plays game running on server (see server.py): keyboard input goes to server and
+screen shows states server sends back, nothing is simulated here. Map is drawn
+from pre-rendered layers of a Level whose tiles follow the server's, sprites
+straight from Atlas.
+
+Client's player is moved with arrow keys and fires with space, whichever player
+server has given it. Clients that came when both players were taken only watch.
+
+Usage (from repository root):
+	python tanks.py --connect=<host>:<port>
+"""
+
+import socket, errno, pygame
+
+from tanks import Game, Level, Tank, Bullet, Label
+from netstate import NetState, StateDecoder, MessageBuffer, packMessage, HELLO, INPUT, SPECTATOR, MSG_HELLO, MSG_INPUT, MSG_STATE
+
+class Client(object):
+
+	# keys: fire, up, right, down, left
+	CONTROLS = [pygame.K_SPACE, pygame.K_UP, pygame.K_RIGHT, pygame.K_DOWN, pygame.K_LEFT]
+
+	# entity kinds in order they are drawn, as in Game.drawSprites()
+	DRAW_ORDER = (NetState.KIND_ENEMY, NetState.KIND_LABEL, NetState.KIND_PLAYER, NetState.KIND_BULLET, NetState.KIND_BONUS)
+
+	def __init__(self, game, host, port):
+		"""
+		@param tanks.Game game Game to draw with, not played
+		@param str host
+		@param int port
+		"""
+
+		self.game = game
+
+		self.sock = socket.create_connection((host, port))
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.sock.setblocking(False)
+
+		self.buffer = MessageBuffer()
+		self.decoder = StateDecoder()
+
+		# player index server has given, SPECTATOR if none. None until server says
+		self.player = None
+
+		# buttons held and fire presses not sent yet
+		self.pressed = [False] * 4
+		self.fire_presses = 0
+
+		# level being drawn, created with the first state
+		self.level = None
+
+	def run(self):
+		""" Draw states as they come until window is closed or server goes away """
+
+		game = self.game
+
+		while True:
+			game.clock.tick(game.fps)
+
+			changed = self.handleEvents()
+			if changed == None:
+				break
+
+			try:
+				state = self.receive()
+			except socket.error:
+				state = None
+				self.sock = None
+			if self.sock == None:
+				print("Disconnected from server")
+				break
+
+			if state != None or changed:
+				self.sendInput()
+			if state != None:
+				self.draw(state)
+
+		if self.sock != None:
+			self.sock.close()
+
+	def handleEvents(self):
+		""" Take keyboard events
+		@return boolean Whether input has changed, None if window is closed
+		"""
+
+		changed = False
+		for event in pygame.event.get():
+			if event.type == pygame.QUIT:
+				return None
+			elif event.type == pygame.KEYDOWN:
+				if event.key == pygame.K_q:
+					return None
+				if event.key in self.CONTROLS:
+					index = self.CONTROLS.index(event.key)
+					if index == 0:
+						self.fire_presses += 1
+					else:
+						self.pressed[index - 1] = True
+					changed = True
+			elif event.type == pygame.KEYUP and event.key in self.CONTROLS:
+				index = self.CONTROLS.index(event.key)
+				if index > 0:
+					self.pressed[index - 1] = False
+					changed = True
+		return changed
+
+	def receive(self):
+		""" Read everything server has sent
+		@return NetState Newest state received, None if none. If server has closed
+			connection, self.sock is set to None
+		"""
+
+		state = None
+		while True:
+			try:
+				data = self.sock.recv(65536)
+			except socket.error as e:
+				if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+					break
+				raise
+			if not data:
+				self.sock.close()
+				self.sock = None
+				break
+
+			for msg_type, payload in self.buffer.feed(data):
+				if msg_type == MSG_HELLO:
+					self.player = HELLO.unpack(payload)[0]
+					if self.player == SPECTATOR:
+						pygame.display.set_caption("Battle City - watching")
+					else:
+						pygame.display.set_caption("Battle City - player " + str(self.player + 1))
+				elif msg_type == MSG_STATE:
+					state = self.decoder.decode(payload)
+
+		return state
+
+	def sendInput(self):
+		""" Send buttons held and fire presses, acknowledging newest state """
+
+		game = self.game
+
+		# encoded as player's input in replays
+		value = game.getInput(self)
+		self.fire_presses = 0
+
+		tick = self.decoder.state.tick if self.decoder.state != None else 0xffffffff
+		try:
+			self.sock.sendall(packMessage(MSG_INPUT, INPUT.pack(tick, value)))
+		except socket.error as e:
+			# buttons are sent again with next state anyway
+			if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+				raise
+
+	def draw(self, state):
+		""" Draw whole screen from state """
+
+		game = self.game
+		world = game.world
+		atlas = world.atlas
+		screen = world.screen
+
+		stage, flags, castle_state, castle_frame, enemies, game_over_y, players = state.game
+
+		level = self.updateLevel(state)
+		level.drawTerrain()
+		level.dirty_cells = []
+
+		screen.set_clip(game.MAP_RECT)
+
+		castle = world.castle.rect
+		screen.blit(atlas.castle[castle_state], castle.topleft)
+		if castle_frame >= 0:
+			screen.blit(atlas.explosion[castle_frame], (castle.left - 16, castle.top - 16))
+
+		entities = state.getEntities()
+		for kind in self.DRAW_ORDER:
+			for entity in entities:
+				if entity[0] == kind:
+					self.drawEntity(entity)
+
+		level.drawGrass()
+
+		if flags & NetState.FLAG_GAME_OVER:
+			game.game_over_y = game_over_y
+			game.drawGameOver()
+
+		screen.set_clip(None)
+
+		lives = [entity[8] for entity in sorted(entities, key = lambda entity: entity[1]) if entity[0] == NetState.KIND_PLAYER]
+		game.drawSidebar((enemies, lives, stage))
+
+		pygame.display.flip()
+
+	def drawEntity(self, entity):
+		""" Draw tank, bullet, bonus or label from its record """
+
+		world = self.game.world
+		atlas = world.atlas
+		screen = world.screen
+
+		kind, variant, x, y, direction, state, flags, frame, lives, value = entity
+
+		if kind == NetState.KIND_PLAYER or kind == NetState.KIND_ENEMY:
+			if state == Tank.STATE_ALIVE:
+				if kind == NetState.KIND_PLAYER:
+					image = atlas.rotations(Game.PLAYER_IMAGES[variant])[direction]
+				else:
+					image = atlas.enemies[variant][int(flags & NetState.TANK_FLASH != 0)][direction]
+				screen.blit(image, (x, y))
+				if flags & NetState.TANK_SHIELDED:
+					screen.blit(atlas.shield[int(flags & NetState.TANK_SHIELD_IMAGE != 0)], (x - 3, y - 3))
+			elif state == Tank.STATE_SPAWNING:
+				screen.blit(atlas.spawn[int(flags & NetState.TANK_SPAWN_IMAGE != 0)], (x, y))
+			elif state == Tank.STATE_EXPLODING and frame >= 0:
+				screen.blit(atlas.explosion[frame], (x, y))
+
+		elif kind == NetState.KIND_BULLET:
+			if state == Bullet.STATE_ACTIVE:
+				screen.blit(atlas.bullet[direction], (x, y))
+			elif state == Bullet.STATE_EXPLODING and frame >= 0:
+				screen.blit(atlas.explosion[frame], (x, y))
+
+		elif kind == NetState.KIND_BONUS:
+			if state:
+				screen.blit(atlas.bonuses[variant], (x, y))
+
+		elif kind == NetState.KIND_LABEL:
+			Label(world, (x, y), str(value)).draw()
+
+	def updateLevel(self, state):
+		""" Bring drawn level's tiles and waves to state
+		@return Level
+		"""
+
+		game = self.game
+		world = game.world
+
+		if self.level == None:
+			level = Level.__new__(Level)
+			level.world = world
+			level.setState({"grid" : list(state.grid), "max_active_enemies" : 4, "enemies_by_type" : [0] * 4, "enemies_left" : [], "waves" : False})
+			self.level = level
+
+		level = self.level
+
+		grid = level.grid
+		if bytearray(grid) != state.grid:
+			for i in range(len(grid)):
+				if grid[i] != state.grid[i]:
+					level.setTile(i % level.GRID_SIZE, i // level.GRID_SIZE, state.grid[i])
+
+		if bool(state.game[1] & NetState.FLAG_WAVES) != (level.tile_water is level.tile_water2):
+			level.toggleWaves()
+
+		return level
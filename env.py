@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Agent environment
+Lets agents play the game through code instead of keyboard. reset() starts a
+stage, step() applies each player's action straight to Player - buttons held
+and fire - and plays a few ticks with it (frame skip, the action is repeated on
+every tick). Game runs headless: no event queue is read and nothing is drawn,
+so a step costs only the ticks it plays.
+
+Actions are indexes to ACTIONS: direction to move in (None to stand still) and
+whether to fire. Fire is pressed on every tick of the step, so the tank shoots
+as soon as its bullet quota allows.
+
+Observation is the World itself, or NumPy feature planes if Env is given an
+Observer, see observation.py.
+
+Reward is a weighted sum of what changed during the step, taken from players'
+trophies and score, their lives and castle, see REWARD_WEIGHTS. Each part is
+returned in info too, so agents can weigh them in their own way.
+
+Usage (from repository root), plays random actions:
+	python env.py [--steps=<n>] [--frame-skip=<n>] [--players=<n>] [--seed=<n>]
+"""
+
+import sys, time, random
+
+from tanks import Game
+
+class Env(object):
+
+	# action index => direction, fire
+	ACTIONS = [(None, False)] + [(direction, False) for direction in range(4)] + [(None, True)] + [(direction, True) for direction in range(4)]
+
+	# reward part => its weight in reward
+	#	score: points scored, kills: enemies destroyed, bonuses: bonuses picked up,
+	#	lives: lives gained (negative when lost), castle: 1 when castle is destroyed,
+	#	cleared: 1 when stage is cleared
+	REWARD_WEIGHTS = {
+		"score" : 0.01,
+		"kills" : 0.0,
+		"bonuses" : 0.0,
+		"lives" : 1.0,
+		"castle" : -10.0,
+		"cleared" : 10.0
+	}
+
+	def __init__(self, players = 1, frame_skip = 4, max_ticks = 15000, level_pack = None, weights = None, observer = None):
+		"""
+		@param int players Number of players, 1 or 2
+		@param int frame_skip Ticks to play with each action
+		@param int max_ticks Give up stage after this many ticks (15000 = 5 minutes)
+		@param LevelPack level_pack Take levels from pack instead of levels/ directory
+		@param dict weights Reward part => weight, overrides REWARD_WEIGHTS
+		@param observation.Observer observer Encodes observations, None to observe World
+		"""
+
+		self.players = players
+		self.frame_skip = frame_skip
+		self.max_ticks = max_ticks
+		self.observer = observer
+
+		self.weights = dict(self.REWARD_WEIGHTS)
+		if weights != None:
+			self.weights.update(weights)
+
+		self.game = Game(True, level_pack)
+		self.world = self.game.world
+
+		# ticks played in current stage
+		self.ticks = 0
+
+		# players' totals after last step, see getTotals()
+		self.totals = None
+
+	def reset(self, stage = 1, seed = None):
+		""" Start stage with new players
+		@param int stage Stage number, starting from 1
+		@param int seed Seed of game's random number generator, None to go on with
+			current sequence
+		@return World Observation, see observe()
+		"""
+
+		game = self.game
+		world = self.world
+
+		if seed != None:
+			world.rng.seed(seed)
+
+		del world.players[:]
+		game.nr_of_players = self.players
+		game.stage = stage - 1
+		game.startLevel()
+
+		self.ticks = 0
+		self.totals = self.getTotals()
+
+		return self.observe()
+
+	def step(self, actions):
+		""" Play frame_skip ticks with given actions, or less if stage ends meanwhile
+		@param list actions Action index for each player, int if there is only one
+		@return tuple Observation (see observe()), reward, whether stage has ended
+			and info dict: reward parts, ticks played in stage and, once stage has
+			ended, its summary (see Game.stageSummary())
+		"""
+
+		game = self.game
+		world = self.world
+
+		if not isinstance(actions, (list, tuple)):
+			actions = [actions]
+
+		castle = world.castle.active
+		active = game.active
+
+		for i in range(self.frame_skip):
+			if not game.running or self.ticks >= self.max_ticks:
+				break
+			for player, action in zip(world.players, actions):
+				self.applyAction(player, action)
+			game.update(game.TICK_MS)
+			self.ticks += 1
+
+		totals = self.getTotals()
+		parts = {}
+		for name in totals:
+			parts[name] = totals[name] - self.totals[name]
+		self.totals = totals
+
+		parts["castle"] = int(castle and not world.castle.active)
+		parts["cleared"] = int(active and not game.active and not game.game_over)
+
+		reward = 0.0
+		for name in parts:
+			reward += self.weights[name] * parts[name]
+
+		done = not game.running or self.ticks >= self.max_ticks
+
+		info = {"rewards" : parts, "ticks" : self.ticks}
+		if done:
+			info["summary"] = game.stageSummary(self.ticks)
+
+		return (self.observe(), reward, done, info)
+
+	def applyAction(self, player, action):
+		""" Hold player's buttons and fire, as keys in Game.handleEvents() do """
+
+		direction, fire = self.ACTIONS[action]
+
+		self.game.applyInput(player, 0 if direction == None else 1 << direction, int(fire))
+
+	def getTotals(self):
+		""" Sum up players' trophies, score and lives
+		@return dict Reward part => total
+		"""
+
+		totals = {"score" : 0, "kills" : 0, "bonuses" : 0, "lives" : 0}
+		for player in self.world.players:
+			totals["score"] += player.score
+			totals["kills"] += sum([player.trophies["enemy"+str(i)] for i in range(4)])
+			totals["bonuses"] += player.trophies["bonus"]
+			totals["lives"] += player.lives
+		return totals
+
+	def observe(self):
+		""" Game's state: planes written by observer, or World with players, enemies,
+		bullets, bonuses and castle, and level in game.level. Either is live, not a copy
+		@return numpy.ndarray|World
+		"""
+		if self.observer != None:
+			return self.observer.encode(self.game)
+		return self.world
+
+if __name__ == "__main__":
+
+	options = {}
+	for arg in sys.argv[1:]:
+		if arg.startswith("--") and "=" in arg:
+			name, value = arg[2:].split("=", 1)
+			options[name] = value
+
+	steps = int(options.get("steps", 10000))
+	seed = int(options.get("seed", 0))
+
+	env = Env(int(options.get("players", 1)), int(options.get("frame-skip", 4)))
+	rng = random.Random(seed)
+
+	env.reset(1, seed)
+	episodes = 0
+	total = 0.0
+	start = time.time()
+	for i in range(steps):
+		actions = [rng.randrange(len(env.ACTIONS)) for player in range(env.players)]
+		observation, reward, done, info = env.step(actions)
+		total += reward
+		if done:
+			episodes += 1
+			env.reset(1)
+	elapsed = time.time() - start
+
+	print("%d steps (%d ticks each), %d stages ended, reward %.2f: %.0f steps per second" % (steps, env.frame_skip, episodes, total, steps / elapsed))
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Binary level pack
+All levels in one file, so large generated level sets can be used without
+parsing thousands of text files. File is memory-mapped and any level can be
+read in O(1).
+
+File layout (little endian):
+	header	: magic "BCLP", version (uint16), grid size (uint16), number of
+			  levels (uint32), record size (uint32), index offset (uint32)
+	index	: offset of each level's record (uint32 per level)
+	records	: grid size * grid size tile types (uint8 per tile, row by row,
+			  same values as Level.TILE_*), then number of enemies by type:
+			  basic, fast, power, armor (uint8 each)
+
+Convert levels/ directory into a pack with: python levelpack.py levels levels.pack
+"""
+
+import sys, mmap, struct
+from tanks import Level
+
+class LevelPack():
+
+	MAGIC = b"BCLP"
+
+	VERSION = 1
+
+	HEADER = struct.Struct("<4sHHIII")
+
+	TILES_SIZE = Level.GRID_SIZE * Level.GRID_SIZE
+
+	RECORD_SIZE = TILES_SIZE + 4
+
+	def __init__(self, filename):
+		""" Open level pack
+		@param string filename
+		"""
+
+		self.file = open(filename, "rb")
+		self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+
+		magic, version, grid_size, self.count, record_size, index_offset = self.HEADER.unpack(self.data[:self.HEADER.size])
+
+		if magic != self.MAGIC or version != self.VERSION:
+			raise ValueError(filename + " is not a level pack")
+		if grid_size != Level.GRID_SIZE or record_size != self.RECORD_SIZE:
+			raise ValueError(filename + " has unsupported level size")
+
+		self.offsets = struct.unpack("<%dI" % self.count, self.data[index_offset:index_offset + 4 * self.count])
+
+	def __len__(self):
+		return self.count
+
+	def getTiles(self, nr):
+		""" Get tiles of level
+		@param int nr Level index, starting from 0
+		@return bytes Tile type of each cell, row by row
+		"""
+		offset = self.offsets[nr]
+		return self.data[offset:offset + self.TILES_SIZE]
+
+	def getEnemies(self, nr):
+		""" Get enemies of level
+		@param int nr Level index, starting from 0
+		@return tuple Number of basic, fast, power and armor enemies
+		"""
+		offset = self.offsets[nr] + self.TILES_SIZE
+		return struct.unpack("<4B", self.data[offset:offset + 4])
+
+	def close(self):
+		self.data.close()
+		self.file.close()
+
+	@classmethod
+	def write(cls, filename, levels):
+		""" Write level pack
+		@param string filename
+		@param list levels (tiles, enemies) of each level. tiles is sequence of
+			GRID_SIZE * GRID_SIZE tile types, enemies is (basic, fast, power, armor)
+		@return None
+		"""
+
+		index_offset = cls.HEADER.size
+		records_offset = index_offset + 4 * len(levels)
+
+		f = open(filename, "wb")
+		f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, Level.GRID_SIZE, len(levels), cls.RECORD_SIZE, index_offset))
+		f.write(struct.pack("<%dI" % len(levels), *[records_offset + i * cls.RECORD_SIZE for i in range(len(levels))]))
+
+		for tiles, enemies in levels:
+			if len(tiles) != cls.TILES_SIZE:
+				raise ValueError("level must have %d tiles" % cls.TILES_SIZE)
+			f.write(struct.pack("<%dB" % cls.TILES_SIZE, *tiles))
+			f.write(struct.pack("<4B", *enemies))
+		f.close()
+
+	@classmethod
+	def convert(cls, directory, filename):
+		""" Pack levels/ directory
+		Levels are numbered files starting from 1, enemies are taken from
+		Level.LEVELS_ENEMIES (last entry for levels beyond it)
+		@param string directory
+		@param string filename Output file
+		@return int Number of packed levels
+		"""
+
+		levels = []
+		nr = 1
+		while True:
+			tiles = Level.readTiles(nr, directory)
+			if tiles == None:
+				break
+
+			enemies = Level.LEVELS_ENEMIES[min(nr, len(Level.LEVELS_ENEMIES)) - 1]
+			levels.append((tiles, enemies))
+			nr += 1
+
+		cls.write(filename, levels)
+		return len(levels)
+
+if __name__ == "__main__":
+
+	if len(sys.argv) != 3:
+		print("Usage: levelpack.py <levels directory> <output file>")
+		sys.exit(1)
+
+	count = LevelPack.convert(sys.argv[1], sys.argv[2])
+	print("Packed %d levels into %s" % (count, sys.argv[2]))
@@ -0,0 +1,376 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Match host
+Runs many independent matches in one process. Each match is a headless Game with
+a World of its own - timer, random number generator, objects in play - but
+sprites, fonts, the offscreen screen and levels read from disk are loaded once
+and shared by all of them, see Game's template.
+
+A single scheduler steps all matches. Every match is due a tick each TICK_MS of
+real time from when it was created, and due ticks are played in order of when
+they were due, so a busy moment in one match delays the others evenly instead of
+starving some. How late a tick is played is the match's lag. A match more than
+MAX_CATCH_UP_TICKS behind skips the ticks it's missed instead of playing them
+all at once.
+
+Matches are played by input given to them, as server gives players' input, or by
+autopilot. Matches that are over - game over or all their stages played - are
+evicted, as are those nobody has given input for idle_ticks.
+
+Capacity benchmark keeps adding autopilot matches, replacing those that end,
+until ticks get late: 99th percentile lag over MAX_LAG or skipped ticks.
+The last count that kept up is how many matches one core sustains.
+
+Usage (from repository root):
+	python matchhost.py [--matches=<n>] [--seconds=<n>] [--players=<n>]
+	python matchhost.py --capacity [--step=<n>] [--max-lag=<ms>] [--players=<n>]
+"""
+
+import os, sys, time, heapq
+
+from tanks import Game
+
+clock = getattr(time, "perf_counter", time.time)
+
+class Match(object):
+
+	def __init__(self, match_id, game, players, stages, max_ticks, autopilot, due):
+		"""
+		@param int match_id
+		@param tanks.Game game Game with stage started
+		@param int players Number of players
+		@param int stages Number of stages to play, 0 for no limit
+		@param int max_ticks Give up stage after this many ticks
+		@param boolean autopilot Players are driven by Game.autopilot()
+		@param float due When first tick is due, see clock()
+		"""
+
+		self.id = match_id
+		self.game = game
+		self.stages = stages
+		self.max_ticks = max_ticks
+		self.autopilot = autopilot
+
+		# when next tick is due
+		self.due = due
+
+		# ticks played in whole match and current stage
+		self.ticks = 0
+		self.stage_ticks = 0
+
+		# summary of each stage played, see Game.stageSummary()
+		self.summaries = []
+
+		self.finished = False
+
+		# players' buttons held and fire presses not played yet, see Game.getInput()
+		self.buttons = [0] * players
+		self.fire_presses = [0] * players
+
+		# ticks since last input
+		self.idle = 0
+
+		# lag of ticks played, in seconds, and ticks skipped to catch up
+		self.lag_total = 0.0
+		self.lag_max = 0.0
+		self.lag_ticks = 0
+		self.skipped = 0
+
+	def setInput(self, player, value):
+		""" Hold player's buttons and add fire presses, played with next tick
+		@param int player Player index
+		@param int value Input as in Game.getInput()
+		"""
+		self.buttons[player] = value & 0x0f
+		self.fire_presses[player] += value >> 4
+		self.idle = 0
+
+	def update(self):
+		""" Play one tick and go on to next stage if this one ends """
+
+		game = self.game
+		world = game.world
+
+		for i, player in enumerate(world.players):
+			if self.autopilot:
+				game.autopilot(player)
+				continue
+
+			game.applyInput(player, self.buttons[i], self.fire_presses[i])
+			self.fire_presses[i] = 0
+
+		game.update(game.TICK_MS)
+		self.ticks += 1
+		self.stage_ticks += 1
+		self.idle += 1
+
+		if not game.running or self.stage_ticks >= self.max_ticks:
+			self.summaries.append(game.stageSummary(self.stage_ticks))
+			self.stage_ticks = 0
+			if game.game_over or len(self.summaries) == self.stages:
+				self.finished = True
+			else:
+				game.startLevel()
+
+	def addLag(self, lag):
+		""" Record how late a tick was played
+		@param float lag Seconds
+		"""
+		self.lag_total += lag
+		self.lag_max = max(self.lag_max, lag)
+		self.lag_ticks += 1
+
+	def getLag(self):
+		""" @return dict Mean and max lag in ms and ticks skipped """
+		return {
+			"mean" : self.lag_total / max(self.lag_ticks, 1) * 1000,
+			"max" : self.lag_max * 1000,
+			"skipped" : self.skipped
+		}
+
+class MatchHost(object):
+
+	# most ticks a match plays late to catch up, later are skipped
+	MAX_CATCH_UP_TICKS = 5
+
+	# matches without input this long are evicted (1 minute)
+	IDLE_TICKS = 3000
+
+	def __init__(self, level_pack = None, idle_ticks = IDLE_TICKS, onEvict = None):
+		"""
+		@param LevelPack level_pack Take levels from pack instead of levels/ directory
+		@param int idle_ticks Evict matches without input for this many ticks
+		@param callable onEvict Called with match and reason ("finished" or "idle")
+			when match is evicted
+		"""
+
+		self.level_pack = level_pack
+		self.idle_ticks = idle_ticks
+		self.onEvict = onEvict
+
+		# loads sprites and fonts all matches share. never played
+		self.template = Game(True, level_pack)
+
+		# match id => Match
+		self.matches = {}
+		self.last_id = 0
+
+		# heap of (due time, match id). evicted matches are dropped when popped
+		self.queue = []
+
+		self.interval = Game.TICK_MS / 1000.0
+
+		# lag of every tick since resetStats(), in seconds
+		self.lags = []
+
+		self.stats = {"ticks" : 0, "skipped" : 0, "finished" : 0, "idle" : 0}
+
+	def create(self, players = 1, seed = None, stages = 0, max_ticks = 15000, autopilot = False):
+		""" Start new match from the first stage
+		@param int players Number of players, 1 or 2
+		@param int seed Seed of match's random number generator, None for random
+		@param int stages Number of stages to play, 0 for no limit
+		@param int max_ticks Give up stage after this many ticks (15000 = 5 minutes)
+		@param boolean autopilot Drive players by Game.autopilot() instead of input.
+			Such matches are never idle
+		@return Match
+		"""
+
+		game = Game(True, self.level_pack, self.template)
+		game.nr_of_players = players
+		if seed != None:
+			game.world.rng.seed(seed)
+		game.startCampaign()
+
+		self.last_id += 1
+		match = Match(self.last_id, game, players, stages, max_ticks, autopilot, clock() + self.interval)
+		self.matches[match.id] = match
+		heapq.heappush(self.queue, (match.due, match.id))
+
+		return match
+
+	def evict(self, match, reason):
+		""" Remove match from host
+		@param Match match
+		@param str reason "finished" or "idle"
+		"""
+
+		if self.matches.pop(match.id, None) == None:
+			return
+		self.stats[reason] += 1
+		if self.onEvict != None:
+			self.onEvict(match, reason)
+
+	def update(self):
+		""" Play every tick that is due by now, oldest first
+		@return float Seconds until next tick is due
+		"""
+
+		queue = self.queue
+		now = clock()
+
+		# only ticks due when called are played, so a host with more matches than
+		# it keeps up with still returns, and lag shows how far behind it is
+		start = now
+
+		while queue and queue[0][0] <= start:
+			due, match_id = heapq.heappop(queue)
+			match = self.matches.get(match_id)
+			if match == None or match.due != due:
+				continue
+
+			lag = now - due
+			behind = int(lag / self.interval)
+			if behind >= self.MAX_CATCH_UP_TICKS:
+				match.skipped += behind
+				self.stats["skipped"] += behind
+				match.due += behind * self.interval
+
+			match.update()
+			match.addLag(lag)
+			self.lags.append(lag)
+			self.stats["ticks"] += 1
+
+			if match.finished:
+				self.evict(match, "finished")
+			elif not match.autopilot and match.idle >= self.idle_ticks:
+				self.evict(match, "idle")
+			else:
+				match.due += self.interval
+				heapq.heappush(queue, (match.due, match.id))
+
+			now = clock()
+
+		if not queue:
+			return self.interval
+		return queue[0][0] - now
+
+	def run(self, seconds):
+		""" Play matches in real time
+		@param float seconds How long to play
+		"""
+
+		end = clock() + seconds
+		while True:
+			wait = self.update()
+			left = end - clock()
+			if left <= 0:
+				break
+			if wait > 0:
+				time.sleep(min(wait, left))
+
+	def resetStats(self):
+		""" Start collecting lag and counts anew """
+		self.lags = []
+		for name in self.stats:
+			self.stats[name] = 0
+
+	def getLagPercentile(self, fraction):
+		""" @return float Lag of ticks since resetStats() at given percentile, in ms """
+		if not self.lags:
+			return 0.0
+		lags = sorted(self.lags)
+		return lags[min(int(len(lags) * fraction), len(lags) - 1)] * 1000
+
+	def report(self, seconds, worst = 3):
+		""" Describe ticks played since resetStats() and matches' lag
+		@param float seconds Time stats were collected over
+		@param int worst Number of most lagging matches to list
+		@return str
+		"""
+
+		stats = self.stats
+		lines = ["%d matches, %.0f ticks/s, lag p50 %.2f ms, p99 %.2f ms, %d ticks skipped, %d finished, %d idle" % (
+			len(self.matches), stats["ticks"] / seconds, self.getLagPercentile(0.5),
+			self.getLagPercentile(0.99), stats["skipped"], stats["finished"], stats["idle"]
+		)]
+
+		matches = sorted(self.matches.values(), key = lambda match: match.lag_max, reverse = True)
+		for match in matches[:worst]:
+			lag = match.getLag()
+			lines.append("  match %d: stage %d, %d ticks, lag mean %.2f ms, max %.2f ms, %d skipped" % (
+				match.id, match.game.stage, match.ticks, lag["mean"], lag["max"], lag["skipped"]
+			))
+
+		return "\n".join(lines)
+
+def getMemory():
+	""" @return float Resident memory of process in MB, 0 if it can't be told """
+	try:
+		f = open("/proc/self/statm")
+		pages = int(f.read().split()[1])
+		f.close()
+	except (IOError, OSError):
+		return 0.0
+	return pages * os.sysconf("SC_PAGE_SIZE") / 1000000.0
+
+def measureCapacity(players = 2, step = 10, window = 2.0, max_lag = 20.0):
+	""" Add autopilot matches step at a time until they don't keep up
+	@param int players Players in each match
+	@param int step Matches added at a time
+	@param float window Seconds to play each count of matches
+	@param float max_lag Most 99th percentile lag in ms that still counts as keeping up
+	@return int Most matches that kept up
+	"""
+
+	host = MatchHost()
+	memory = getMemory()
+	target = 0
+	sustained = 0
+	seed = 0
+
+	while True:
+		target += step
+
+		# matches that end are replaced, so count stays the same
+		while len(host.matches) < target:
+			host.create(players, seed, autopilot = True)
+			seed += 1
+
+		host.resetStats()
+		start = clock()
+		end = start + window
+		while clock() < end:
+			host.run(min(0.1, end - clock()))
+			while len(host.matches) < target:
+				host.create(players, seed, autopilot = True)
+				seed += 1
+
+		seconds = clock() - start
+		print(host.report(seconds, 1))
+
+		if host.getLagPercentile(0.99) > max_lag or host.stats["skipped"] > 0:
+			break
+		sustained = target
+
+	print("%d matches sustained on one core, %.2f MB each" % (sustained, (getMemory() - memory) / max(target, 1)))
+	return sustained
+
+if __name__ == "__main__":
+
+	options = {}
+	for arg in sys.argv[1:]:
+		if arg.startswith("--") and "=" in arg:
+			name, value = arg[2:].split("=", 1)
+			options[name] = value
+
+	players = int(options.get("players", 2))
+
+	if "--capacity" in sys.argv[1:]:
+		measureCapacity(players, int(options.get("step", 10)), max_lag = float(options.get("max-lag", 20)))
+		sys.exit()
+
+	host = MatchHost()
+	memory = getMemory()
+
+	matches = int(options.get("matches", 100))
+	for i in range(matches):
+		host.create(players, i, autopilot = True)
+
+	seconds = float(options.get("seconds", 10))
+	host.resetStats()
+	host.run(seconds)
+
+	print(host.report(seconds))
+	print("%.2f MB per match" % ((getMemory() - memory) / matches))
@@ -0,0 +1,381 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Network game state
+What server (see server.py) sends to clients and how. Every tick the server
+captures what clients need to draw the game - map tiles, castle, stage flags and
+a record for each tank, bullet, bonus and score label - and sends each client a
+delta: only what changed since the last tick client has acknowledged. Clients
+keep states they've received, rebuild the new one from its base state and the
+delta, and acknowledge it with their next input. A client that hasn't
+acknowledged anything yet, or has fallen too far behind, gets a delta against
+empty state, which is the whole state.
+
+Entities keep their id as long as they are in game, so a moving tank costs one
+record and a bullet that flies off costs its id only. The delta is then zlib
+compressed, unless that doesn't make it any shorter.
+
+Messages (little endian): length of payload (uint32), type (uint8), payload
+	HELLO	: player index (uint8, 255 for spectator), number of players
+			  (uint8), tick duration in ms (uint16). Sent once, on connect
+	INPUT	: tick of last state received (uint32, 0xffffffff for none),
+			  player's input (uint8, see Game.getInput())
+	STATE	: tick (uint32), base tick (uint32, 0xffffffff for empty state),
+			  whether delta is compressed (uint8), delta: game record, tile
+			  changes (uint16 count, then grid index (uint16) and tile (uint8)
+			  each), changed entities (uint16 count, then id (uint32) and
+			  entity record each), removed entities (uint16 count, then id
+			  (uint32) each)
+
+Works on Python 2 and 3, so tanks.py can be a client on either.
+"""
+
+import struct, zlib
+
+class NetState(object):
+	""" State of game at one tick, as clients see it """
+
+	# stage (uint16), flags (uint8, see FLAG_*), castle's state (uint8), castle's
+	# explosion frame (int8, -1 for none), enemies left (uint8), y of "game
+	# over" text (int16), number of players (uint8)
+	GAME = struct.Struct("<HBBbBhB")
+
+	(FLAG_RUNNING, FLAG_ACTIVE, FLAG_GAME_OVER, FLAG_WAVES) = (1, 2, 4, 8)
+
+	# kind (uint8, see KIND_*), variant (uint8: player index, enemy type, bullet
+	# owner or bonus type), x, y (int16; explosion's position while exploding),
+	# direction (uint8), state (uint8: tank's or bullet's state, whether bonus
+	# is visible), flags (uint8, see TANK_*), explosion frame (int8, -1 for
+	# none), lives (uint16), score or label's points (uint32)
+	ENTITY = struct.Struct("<BBhhBBBbHI")
+
+	(KIND_PLAYER, KIND_ENEMY, KIND_BULLET, KIND_BONUS, KIND_LABEL) = range(5)
+
+	(TANK_SHIELDED, TANK_PARALISED, TANK_FLASH, TANK_SHIELD_IMAGE, TANK_SPAWN_IMAGE) = (1, 2, 4, 8, 16)
+
+	GRID_BYTES = 26 * 26
+
+	def __init__(self, tick = 0, game = None, grid = None, entities = None):
+		"""
+		@param int tick
+		@param tuple game Fields of GAME record
+		@param bytearray grid Tile type of every map cell, see Level.grid
+		@param dict entities Entity id => ENTITY record (bytes)
+		"""
+
+		self.tick = tick
+		self.game = game if game != None else (0, 0, 0, -1, 0, 0, 0)
+		self.grid = grid if grid != None else bytearray(self.GRID_BYTES)
+		self.entities = entities if entities != None else {}
+
+	def getEntities(self):
+		""" @return list Fields of every entity's record, ordered by id """
+		return [self.ENTITY.unpack(self.entities[i]) for i in sorted(self.entities)]
+
+	def digest(self):
+		""" Checksum of state, to compare states of server and client
+		@return int
+		"""
+		crc = zlib.crc32(self.GAME.pack(*self.game))
+		crc = zlib.crc32(bytes(self.grid), crc)
+		for i in sorted(self.entities):
+			crc = zlib.crc32(struct.pack("<I", i) + self.entities[i], crc)
+		return crc & 0xffffffff
+
+class StateEncoder(object):
+	""" Server's side: captures game's state every tick and encodes deltas """
+
+	# no base state
+	NO_TICK = 0xffffffff
+
+	# zlib compression level of deltas, fastest is enough for tile and entity changes
+	COMPRESSION = 1
+
+	def __init__(self, history = 64):
+		"""
+		@param int history How many past states to keep as bases for deltas
+		"""
+
+		self.history = history
+
+		# tick => NetState
+		self.states = {}
+
+		# tick => {base tick => encoded delta}, clients with the same base share it
+		self.encoded = {}
+
+		# game object => entity id
+		self.ids = {}
+		self.last_id = 0
+
+		self.empty = NetState()
+
+	def capture(self, game, tick):
+		""" Take game's state and keep it as base for later deltas
+		@param tanks.Game game
+		@param int tick
+		@return NetState
+		"""
+
+		world = game.world
+		level = game.level
+		castle = world.castle
+
+		flags = 0
+		if game.running:
+			flags |= NetState.FLAG_RUNNING
+		if game.active:
+			flags |= NetState.FLAG_ACTIVE
+		if game.game_over:
+			flags |= NetState.FLAG_GAME_OVER
+		if level.tile_water is level.tile_water2:
+			flags |= NetState.FLAG_WAVES
+
+		# castle stops drawing explosion once it's over, tanks and bullets don't
+		castle_frame = -1
+		if castle.state == castle.STATE_EXPLODING and castle.explosion.active:
+			castle_frame = self.getFrame(castle.explosion)
+
+		state = NetState(tick, (
+			game.stage, flags, int(castle.state != castle.STATE_STANDING), castle_frame,
+			min(len(level.enemies_left) + len(world.enemies), 255), game.game_over_y, len(world.players)
+		), bytearray(level.grid))
+
+		ids = {}
+		entities = state.entities
+		pack = NetState.ENTITY.pack
+
+		for i, player in enumerate(world.players):
+			entities[self.getId(player, ids)] = self.packTank(NetState.KIND_PLAYER, i, player, player.lives, player.score)
+		for enemy in world.enemies:
+			# enemies that found no type to spawn as are dead and have none
+			entities[self.getId(enemy, ids)] = self.packTank(NetState.KIND_ENEMY, getattr(enemy, "type", 0), enemy, 0, 0)
+
+		for bullet in world.bullets:
+			if bullet.state == bullet.STATE_EXPLODING:
+				position = bullet.explosion.position
+				frame = self.getFrame(bullet.explosion)
+			else:
+				position = bullet.rect.topleft
+				frame = -1
+			entities[self.getId(bullet, ids)] = pack(NetState.KIND_BULLET, bullet.owner or 0, position[0], position[1], bullet.direction, bullet.state, 0, frame, 0, 0)
+
+		for bonus in world.bonuses:
+			entities[self.getId(bonus, ids)] = pack(NetState.KIND_BONUS, bonus.bonus, bonus.rect.left, bonus.rect.top, 0, int(bonus.visible), 0, -1, 0, 0)
+
+		for label in world.labels:
+			entities[self.getId(label, ids)] = pack(NetState.KIND_LABEL, 0, label.position[0], label.position[1], 0, 0, 0, -1, 0, int(label.text))
+
+		# objects no longer in game are forgotten, their ids aren't used again
+		self.ids = ids
+
+		self.states[tick] = state
+		self.states.pop(tick - self.history, None)
+		self.encoded.pop(tick - self.history, None)
+
+		return state
+
+	def getId(self, obj, ids):
+		""" Find object's entity id, or give it new one
+		@param object obj
+		@param dict ids Ids of objects seen in current capture
+		@return int
+		"""
+		i = self.ids.get(obj)
+		if i == None:
+			self.last_id += 1
+			i = self.last_id
+		ids[obj] = i
+		return i
+
+	def getFrame(self, explosion):
+		""" @return int Explosion's current frame in Atlas.explosion """
+		return len(explosion.frames) - len(explosion.images) - 1
+
+	def packTank(self, kind, variant, tank, lives, score):
+		""" @return bytes Tank's entity record """
+
+		flags = 0
+		if tank.shielded:
+			flags |= NetState.TANK_SHIELDED
+		if tank.paralised:
+			flags |= NetState.TANK_PARALISED
+		if tank.flash:
+			flags |= NetState.TANK_FLASH
+		if tank.shield_index:
+			flags |= NetState.TANK_SHIELD_IMAGE
+		if tank.spawn_index:
+			flags |= NetState.TANK_SPAWN_IMAGE
+
+		if tank.state == tank.STATE_EXPLODING:
+			position = tank.explosion.position
+			frame = self.getFrame(tank.explosion)
+		else:
+			position = tank.rect.topleft
+			frame = -1
+
+		return NetState.ENTITY.pack(kind, variant, position[0], position[1], tank.direction, tank.state, flags, frame, lives, score)
+
+	def encode(self, tick, base_tick):
+		""" Encode state of tick as delta against state of base_tick
+		@param int tick Captured tick
+		@param int base_tick Last tick client has acknowledged. If it's no longer
+			kept, or NO_TICK, delta is against empty state
+		@return bytes STATE message
+		"""
+
+		if base_tick not in self.states or base_tick >= tick:
+			base_tick = self.NO_TICK
+
+		encoded = self.encoded.setdefault(tick, {})
+		message = encoded.get(base_tick)
+		if message != None:
+			return message
+
+		state = self.states[tick]
+		base = self.states.get(base_tick, self.empty)
+
+		parts = [NetState.GAME.pack(*state.game)]
+
+		# tiles
+		if state.grid == base.grid:
+			parts.append(struct.pack("<H", 0))
+		else:
+			grid = state.grid
+			base_grid = base.grid
+			changes = [i for i in range(NetState.GRID_BYTES) if grid[i] != base_grid[i]]
+			parts.append(struct.pack("<H", len(changes)))
+			parts.extend([struct.pack("<HB", i, grid[i]) for i in changes])
+
+		# entities
+		entities = state.entities
+		base_entities = base.entities
+		changed = [i for i in entities if base_entities.get(i) != entities[i]]
+		parts.append(struct.pack("<H", len(changed)))
+		for i in changed:
+			parts.append(struct.pack("<I", i))
+			parts.append(entities[i])
+
+		removed = [i for i in base_entities if i not in entities]
+		parts.append(struct.pack("<H", len(removed)))
+		parts.extend([struct.pack("<I", i) for i in removed])
+
+		delta = b"".join(parts)
+		compressed = zlib.compress(delta, self.COMPRESSION)
+		if len(compressed) < len(delta):
+			payload = struct.pack("<IIB", tick, base_tick, 1) + compressed
+		else:
+			payload = struct.pack("<IIB", tick, base_tick, 0) + delta
+
+		message = packMessage(MSG_STATE, payload)
+		encoded[base_tick] = message
+		return message
+
+class StateDecoder(object):
+	""" Client's side: rebuilds states from deltas """
+
+	def __init__(self):
+
+		# tick => NetState, states deltas can still be based on
+		self.states = {}
+
+		# latest state received, None before the first one
+		self.state = None
+
+	def decode(self, payload):
+		""" Apply delta from STATE message to its base state
+		@param bytes payload Message's payload
+		@return NetState New state, also kept in self.state
+		"""
+
+		tick, base_tick, compressed = struct.unpack_from("<IIB", payload, 0)
+		if compressed:
+			payload = zlib.decompress(bytes(payload[9:]))
+		else:
+			payload = payload[9:]
+		offset = 0
+
+		if base_tick == StateEncoder.NO_TICK:
+			base = NetState()
+		else:
+			base = self.states[base_tick]
+
+		game = NetState.GAME.unpack_from(payload, offset)
+		offset += NetState.GAME.size
+
+		grid = bytearray(base.grid)
+		count, = struct.unpack_from("<H", payload, offset)
+		offset += 2
+		for n in range(count):
+			i, tile = struct.unpack_from("<HB", payload, offset)
+			offset += 3
+			grid[i] = tile
+
+		entities = dict(base.entities)
+		size = NetState.ENTITY.size
+		count, = struct.unpack_from("<H", payload, offset)
+		offset += 2
+		for n in range(count):
+			i, = struct.unpack_from("<I", payload, offset)
+			entities[i] = bytes(payload[offset + 4:offset + 4 + size])
+			offset += 4 + size
+
+		count, = struct.unpack_from("<H", payload, offset)
+		offset += 2
+		for n in range(count):
+			i, = struct.unpack_from("<I", payload, offset)
+			offset += 4
+			del entities[i]
+
+		state = NetState(tick, game, grid, entities)
+
+		# server acknowledges in order, so older states than this base won't be
+		# needed again
+		for old in [t for t in self.states if t < base_tick]:
+			del self.states[old]
+		self.states[tick] = state
+		self.state = state
+
+		return state
+
+# message types
+(MSG_HELLO, MSG_INPUT, MSG_STATE) = range(3)
+
+HEADER = struct.Struct("<IB")
+
+HELLO = struct.Struct("<BBH")
+
+INPUT = struct.Struct("<IB")
+
+# player index of clients who only watch
+SPECTATOR = 255
+
+def packMessage(msg_type, payload):
+	""" @return bytes Message ready to be sent """
+	return HEADER.pack(len(payload), msg_type) + payload
+
+class MessageBuffer(object):
+	""" Splits stream of bytes into messages """
+
+	def __init__(self):
+		self.data = bytearray()
+
+	def feed(self, data):
+		""" Add bytes received
+		@return list Type and payload of each message completed
+		"""
+
+		self.data.extend(data)
+
+		messages = []
+		offset = 0
+		while len(self.data) - offset >= HEADER.size:
+			length, msg_type = HEADER.unpack_from(self.data, offset)
+			end = offset + HEADER.size + length
+			if len(self.data) < end:
+				break
+			messages.append((msg_type, bytes(self.data[offset + HEADER.size:end])))
+			offset = end
+
+		del self.data[:offset]
+		return messages
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Observations for agents
+Observer writes game's state into NumPy feature planes, one 52x52 grid of 8x8 px
+cells per feature: tile types, castle, tanks by player and enemy type, their
+directions, bullets by owner and direction, bonus and shield/paralysis flags.
+Cells an object covers are set to 1, all others are 0.
+
+Planes and everything else are allocated once and overwritten in place by
+encode(), so agents can keep references to them. Level's tiles are read
+through a view of Level.grid, not copied.
+
+Pixel observations are optional: screen is drawn and sampled every n-th pixel
+through pygame.surfarray.pixels3d view of it, straight into preallocated array.
+
+Usage (from repository root), measures encode() while playing headless:
+	python observation.py [--ticks=<n>] [--pixels=<n>]
+"""
+
+import sys, time
+import numpy as np
+import pygame
+
+from tanks import Game, Level, Tank
+
+class Observer(object):
+
+	# planes
+	(PLANE_BRICK, PLANE_STEEL, PLANE_WATER, PLANE_GRASS, PLANE_ICE, PLANE_CASTLE,
+	PLANE_PLAYER1, PLANE_PLAYER2, PLANE_BASIC, PLANE_FAST, PLANE_POWER,
+	PLANE_ARMOR, PLANE_SPAWNING, PLANE_TANK_UP, PLANE_TANK_RIGHT, PLANE_TANK_DOWN,
+	PLANE_TANK_LEFT, PLANE_PLAYER_BULLETS, PLANE_ENEMY_BULLETS, PLANE_BULLET_UP,
+	PLANE_BULLET_RIGHT, PLANE_BULLET_DOWN, PLANE_BULLET_LEFT, PLANE_BONUS,
+	PLANE_SHIELD, PLANE_PARALYSED) = range(26)
+	PLANES = 26
+
+	# cell size in px and map size in cells
+	CELL = 8
+	SIZE = 416 // CELL
+
+	# map cells per tile along each axis
+	TILE_CELLS = Level.TILE_SIZE // CELL
+
+	# tile type => plane
+	TILE_PLANES = (
+		(Level.TILE_BRICK, PLANE_BRICK),
+		(Level.TILE_STEEL, PLANE_STEEL),
+		(Level.TILE_WATER, PLANE_WATER),
+		(Level.TILE_GRASS, PLANE_GRASS),
+		(Level.TILE_FROZE, PLANE_ICE)
+	)
+
+	def __init__(self, pixels = 0):
+		"""
+		@param int pixels Take every n-th pixel of map for pixel observation, 0 for none
+		"""
+
+		self.planes = np.zeros((self.PLANES, self.SIZE, self.SIZE), np.uint8)
+
+		# same memory as planes, with each tile's cells on axes of their own
+		size = Level.GRID_SIZE
+		self.tile_planes = self.planes.reshape(self.PLANES, size, self.TILE_CELLS, size, self.TILE_CELLS)
+
+		# Level.grid viewed as 2d array, and where it comes from
+		self.grid = None
+		self.grid_source = None
+
+		# tiles of one type
+		self.tile_mask = np.zeros((size, size), bool)
+		self.tile_cells = self.tile_mask.view(np.uint8)[:, None, :, None]
+
+		self.pixel_step = pixels
+		if pixels:
+			size = -(-416 // pixels)
+			self.pixels = np.zeros((size, size, 3), np.uint8)
+		else:
+			self.pixels = None
+
+	def encode(self, game):
+		""" Write game's current state into planes
+		@param tanks.Game game
+		@return numpy.ndarray planes, shape (PLANES, SIZE, SIZE)
+		"""
+
+		world = game.world
+		planes = self.planes
+
+		planes.fill(0)
+
+		# tiles
+		if game.level.grid is not self.grid_source:
+			self.grid_source = game.level.grid
+			self.grid = np.frombuffer(self.grid_source, np.uint8).reshape(Level.GRID_SIZE, Level.GRID_SIZE)
+		for tile, plane in self.TILE_PLANES:
+			np.equal(self.grid, tile, out = self.tile_mask)
+			self.tile_planes[plane] = self.tile_cells
+
+		if world.castle.active:
+			self.fill(self.PLANE_CASTLE, world.castle.rect)
+
+		# tanks
+		for i, player in enumerate(world.players):
+			self.fillTank(self.PLANE_PLAYER1 + i, player)
+		for enemy in world.enemies:
+			self.fillTank(self.PLANE_BASIC + enemy.type, enemy)
+
+		# bullets
+		for bullet in world.bullets:
+			if bullet.state == bullet.STATE_ACTIVE:
+				if bullet.owner == bullet.OWNER_PLAYER:
+					self.fill(self.PLANE_PLAYER_BULLETS, bullet.rect)
+				else:
+					self.fill(self.PLANE_ENEMY_BULLETS, bullet.rect)
+				self.fill(self.PLANE_BULLET_UP + bullet.direction, bullet.rect)
+
+		for bonus in world.bonuses:
+			if bonus.active:
+				self.fill(self.PLANE_BONUS, bonus.rect)
+
+		return planes
+
+	def fillTank(self, plane, tank):
+		""" Mark tank in its plane and planes of its direction and flags """
+
+		if tank.state == Tank.STATE_SPAWNING:
+			self.fill(self.PLANE_SPAWNING, tank.rect)
+		if tank.state != Tank.STATE_ALIVE:
+			return
+
+		self.fill(plane, tank.rect)
+		self.fill(self.PLANE_TANK_UP + tank.direction, tank.rect)
+		if tank.shielded:
+			self.fill(self.PLANE_SHIELD, tank.rect)
+		if tank.paralised:
+			self.fill(self.PLANE_PARALYSED, tank.rect)
+
+	def fill(self, plane, rect):
+		""" Set cells rect overlaps to 1
+		@param int plane
+		@param pygame.Rect rect Area in px
+		@return None
+		"""
+		x1 = max(rect.left // self.CELL, 0)
+		y1 = max(rect.top // self.CELL, 0)
+		x2 = min((rect.right - 1) // self.CELL + 1, self.SIZE)
+		y2 = min((rect.bottom - 1) // self.CELL + 1, self.SIZE)
+		self.planes[plane, y1:y2, x1:x2] = 1
+
+	def encodePixels(self, game):
+		""" Draw game and sample every pixel_step-th pixel of map
+		Screen is locked only while pixels are being copied
+		@param tanks.Game game
+		@return numpy.ndarray pixels, shape (height, width, 3)
+		"""
+
+		game.draw()
+
+		view = pygame.surfarray.pixels3d(game.world.screen)
+		np.copyto(self.pixels, view[:416:self.pixel_step, :416:self.pixel_step].swapaxes(0, 1))
+		del view
+
+		return self.pixels
+
+if __name__ == "__main__":
+
+	options = {}
+	for arg in sys.argv[1:]:
+		if arg.startswith("--") and "=" in arg:
+			name, value = arg[2:].split("=", 1)
+			options[name] = value
+
+	ticks = int(options.get("ticks", 3000))
+
+	game = Game(True)
+	observer = Observer(int(options.get("pixels", 0)))
+
+	game.world.rng.seed(0)
+	game.stage = 0
+	game.startLevel()
+
+	encoding = 0.0
+	drawing = 0.0
+	for i in range(ticks):
+		if not game.running:
+			game.stage = 0
+			game.startLevel()
+		for player in game.world.players:
+			game.autopilot(player)
+		game.update(game.TICK_MS)
+
+		start = time.time()
+		observer.encode(game)
+		encoding += time.time() - start
+
+		if observer.pixels is not None:
+			start = time.time()
+			observer.encodePixels(game)
+			drawing += time.time() - start
+
+	print("encode: %.1f us per tick" % (encoding / ticks * 1000000))
+	if observer.pixels is not None:
+		print("encodePixels: %.1f us per tick" % (drawing / ticks * 1000000))
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Tick profiler
+Measures how long each phase of a game tick takes. Game marks the end of every
+phase with lap(), which books time since previous lap (or tick start) to that
+phase, so one clock read per phase is all it costs. Phase durations of the last
+WINDOW ticks are kept to report percentiles, ticks over budget are
+counted by stage, and a number of ticks can be saved as Chrome trace-event JSON
+(open in chrome://tracing or ui.perfetto.dev).
+
+When rendering is decoupled from ticks, a frame plays any number of ticks and
+then draws once. Game wraps it in startFrame() and endFrame(): laps outside of
+ticks are booked to the frame, so per-tick percentiles and budget still cover
+single ticks, and drawing is reported per frame next to them.
+
+Detail laps (draw.* phases, one per entity type) are only booked when detail is
+on, otherwise their time goes to the next regular phase.
+"""
+
+import time, json
+from collections import deque
+
+# high resolution clock where available
+clock = getattr(time, "perf_counter", time.time)
+
+class TickProfiler():
+
+	# ticks to compute percentiles from
+	WINDOW = 1000
+
+	# ms one tick may take at 50 fps
+	BUDGET = 20.0
+
+	def __init__(self, enabled = False, detail = False):
+
+		self.enabled = enabled
+
+		# if true, book detail laps too
+		self.detail = detail
+
+		# phase name => durations in ms of last WINDOW ticks
+		self.samples = {}
+
+		# phase names of ticks and frames in order they were first seen
+		self.phases = []
+		self.frame_phases = []
+
+		# stage => number of ticks over budget
+		self.over_budget = {}
+
+		self.ticks = 0
+		self.stage = None
+
+		# duration of each phase in current tick and frame
+		self.current = {}
+		self.tick_start = None
+		self.frame = {}
+		self.frame_start = None
+		self.last = None
+
+		# trace being recorded: events, ticks left, file to save it to
+		self.trace = None
+		self.trace_ticks = 0
+		self.trace_filename = None
+
+	def setStage(self, stage):
+		""" Book following over budget ticks to stage """
+		self.stage = stage
+
+	def startFrame(self):
+		if not self.enabled:
+			return
+		self.frame_start = self.last = clock()
+		self.frame = {}
+
+	def startTick(self):
+		if not self.enabled:
+			return
+		self.tick_start = self.last = clock()
+		self.current = {}
+
+	def lap(self, phase, detail = False):
+		""" End phase: book time since last lap or tick start to it, or to current
+		frame if no tick is being played
+		@param string phase
+		@param boolean detail If true, only book when detail is on
+		@return None
+		"""
+
+		if not self.enabled or (detail and not self.detail):
+			return
+
+		if self.tick_start != None:
+			current, phases = self.current, self.phases
+		elif self.frame_start != None:
+			current, phases = self.frame, self.frame_phases
+		else:
+			return
+
+		if phase not in self.samples:
+			self.samples[phase] = deque(maxlen = self.WINDOW)
+		if phase not in phases:
+			phases.append(phase)
+
+		now = clock()
+		current[phase] = current.get(phase, 0.0) + (now - self.last) * 1000
+
+		if self.trace != None:
+			self.trace.append({"name" : phase, "ph" : "X", "ts" : self.last * 1000000, "dur" : (now - self.last) * 1000000, "pid" : 1, "tid" : 1})
+
+		self.last = now
+
+	def endTick(self):
+		""" Book durations of tick's phases """
+
+		if not self.enabled or self.tick_start == None:
+			return
+
+		now = clock()
+		duration = (now - self.tick_start) * 1000
+		self.current["tick"] = duration
+
+		if "tick" not in self.samples:
+			self.samples["tick"] = deque(maxlen = self.WINDOW)
+
+		for phase, ms in self.current.items():
+			self.samples[phase].append(ms)
+
+		self.ticks += 1
+		if duration > self.BUDGET:
+			self.over_budget[self.stage] = self.over_budget.get(self.stage, 0) + 1
+
+		if self.trace != None:
+			self.trace.append({"name" : "tick", "ph" : "X", "ts" : self.tick_start * 1000000, "dur" : duration * 1000, "pid" : 1, "tid" : 1, "args" : {"stage" : self.stage}})
+			self.trace_ticks -= 1
+			if self.trace_ticks <= 0:
+				self.saveTrace()
+
+		self.tick_start = None
+
+		# frame's next lap starts after the tick
+		self.last = now
+
+	def endFrame(self):
+		""" Book durations of frame's phases outside of ticks """
+
+		if not self.enabled or self.frame_start == None:
+			return
+
+		now = clock()
+		duration = (now - self.frame_start) * 1000
+		self.frame["frame"] = duration
+
+		if "frame" not in self.samples:
+			self.samples["frame"] = deque(maxlen = self.WINDOW)
+
+		for phase, ms in self.frame.items():
+			self.samples[phase].append(ms)
+
+		if self.trace != None:
+			self.trace.append({"name" : "frame", "ph" : "X", "ts" : self.frame_start * 1000000, "dur" : duration * 1000, "pid" : 1, "tid" : 1})
+
+		self.frame_start = None
+
+	def startTrace(self, filename, ticks = 250):
+		""" Record next ticks as Chrome trace and save it when done
+		Enables profiler if it's off
+		@param string filename
+		@param int ticks
+		@return None
+		"""
+		self.enabled = True
+		self.trace = []
+		self.trace_ticks = ticks
+		self.trace_filename = filename
+
+	def saveTrace(self):
+		""" Save trace recorded so far, if any """
+
+		if self.trace == None:
+			return
+
+		f = open(self.trace_filename, "w")
+		json.dump({"traceEvents" : self.trace, "displayTimeUnit" : "ms"}, f)
+		f.close()
+
+		self.trace = None
+
+	def getPercentiles(self, phase):
+		""" @return tuple p50, p95, p99 and max of phase in ms """
+		samples = sorted(self.samples[phase])
+		last = len(samples) - 1
+		return (samples[last * 50 // 100], samples[last * 95 // 100], samples[last * 99 // 100], samples[last])
+
+	def report(self):
+		""" @return string Percentiles of every phase and ticks over budget """
+
+		lines = ["%-16s %8s %8s %8s %8s %8s" % ("phase (ms)", "count", "p50", "p95", "p99", "max")]
+		for phase in ["tick"] + self.phases + ["frame"] + self.frame_phases:
+			if phase not in self.samples:
+				continue
+			lines.append("%-16s %8d %8.3f %8.3f %8.3f %8.3f" % ((phase, len(self.samples[phase])) + self.getPercentiles(phase)))
+
+		lines.append("%d of %d ticks over %.0f ms budget" % (sum(self.over_budget.values()), self.ticks, self.BUDGET))
+		for stage in sorted(self.over_budget):
+			lines.append("  stage %s: %d" % (stage, self.over_budget[stage]))
+
+		return "\n".join(lines)
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Input replays
+With fixed tick duration and seeded random number generator the game plays out
+exactly the same way every time players press the same buttons, so a replay
+only holds the seed and players' input on every tick. Input rarely changes from
+one tick to the next, so it's stored run-length encoded: a minute of play is
+usually a few hundred bytes. See Game.seekReplay() for playing it back.
+
+Seeking plays the replay from its start, or from the closest keyframe before
+the tick sought. Keyframes are full snapshots of the game (see snapshot.py),
+taken during playback at the start of every stage and every KEYFRAME_TICKS
+ticks. They are saved apart from the replay, in a file of the same name with
+KEYFRAMES_SUFFIX appended, so replays stay small.
+
+Replays are bound to levels they were recorded with: play them back with the
+same level pack (or levels/ directory) and game version.
+
+File layout (little endian):
+	header	: magic "BCRP", version (uint16), seed (uint32), number of players
+			  (uint8), first stage (uint16), number of stages (uint16)
+	stages	: number of runs (uint32), then runs: number of ticks (uint16) and
+			  input of each player during them (uint8 each)
+
+Player's input: bits 0-3 are up, right, down and left buttons being held, bits
+4-5 how many times fire was pressed during the tick, see Game.getInput()
+
+Keyframes file layout (little endian):
+	header	: magic "BCRK", version (uint16), replay's seed (uint32), number of
+			  players (uint8), first stage (uint16) and number of ticks (uint32),
+			  number of keyframes (uint32)
+	frames	: tick (uint32), length (uint32) and snapshot as encoded by
+			  Snapshot.dumps()
+"""
+
+import struct, bisect
+
+from snapshot import Snapshot
+
+class Replay():
+
+	MAGIC = b"BCRP"
+
+	VERSION = 1
+
+	HEADER = struct.Struct("<4sHIBHH")
+
+	# longest run that fits in file
+	MAX_RUN = 0xffff
+
+	KEYFRAMES_MAGIC = b"BCRK"
+
+	KEYFRAMES_HEADER = struct.Struct("<4sHIBHII")
+
+	KEYFRAME = struct.Struct("<II")
+
+	# appended to replay's file name to get its keyframes file
+	KEYFRAMES_SUFFIX = ".keys"
+
+	# ticks between keyframes (10 seconds)
+	KEYFRAME_TICKS = 500
+
+	def __init__(self, seed, players, first_stage = 1):
+		"""
+		@param int seed Seed of game's random number generator
+		@param int players Number of players
+		@param int first_stage Stage replay starts with
+		"""
+
+		self.seed = seed
+		self.players = players
+		self.first_stage = first_stage
+
+		# runs of each stage, run is [number of ticks, tuple of players' input]
+		self.stages = []
+
+		# tick each stage starts at
+		self.starts = []
+
+		self.ticks = 0
+
+		# tick => snapshot of game before tick is played, see Game.seekReplay()
+		self.keyframes = {}
+
+	def __len__(self):
+		return self.ticks
+
+	def startStage(self):
+		""" Start recording next stage """
+		self.stages.append([])
+		self.starts.append(self.ticks)
+
+	def addTick(self, inputs):
+		""" Record players' input of one tick
+		@param tuple inputs Input of each player
+		@return None
+		"""
+		runs = self.stages[-1]
+		if runs and runs[-1][1] == inputs and runs[-1][0] < self.MAX_RUN:
+			runs[-1][0] += 1
+		else:
+			runs.append([1, inputs])
+		self.ticks += 1
+
+	def getStageTicks(self, index):
+		""" @return int Number of ticks in stage """
+		if index + 1 < len(self.starts):
+			return self.starts[index + 1] - self.starts[index]
+		return self.ticks - self.starts[index]
+
+	def getKeyframeBefore(self, tick):
+		""" @return int Tick of closest keyframe at or before tick, None if there's none """
+		ticks = [i for i in self.keyframes if i <= tick]
+		return max(ticks) if ticks else None
+
+	def getStageAt(self, tick):
+		""" Find stage that is being played at tick
+		Tick a stage starts at belongs to that stage, end of replay to the last one
+		@return int Stage index
+		"""
+		return max(bisect.bisect_right(self.starts, tick) - 1, 0)
+
+	def iterTicks(self, index, offset = 0):
+		""" Iterate over players' input during stage
+		@param int index Stage index
+		@param int offset Number of ticks to skip from stage's start
+		@return generator Tuples of players' input
+		"""
+		for length, inputs in self.stages[index]:
+			if offset >= length:
+				offset -= length
+				continue
+			for i in range(length - offset):
+				yield inputs
+			offset = 0
+
+	def save(self, filename):
+		""" Write replay file
+		@param string filename
+		@return None
+		"""
+
+		f = open(filename, "wb")
+		f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.seed, self.players, self.first_stage, len(self.stages)))
+
+		run = struct.Struct("<H%dB" % self.players)
+		for runs in self.stages:
+			f.write(struct.pack("<I", len(runs)))
+			for length, inputs in runs:
+				f.write(run.pack(length, *inputs))
+		f.close()
+
+	@classmethod
+	def load(cls, filename):
+		""" Read replay file
+		@param string filename
+		@return Replay
+		"""
+
+		f = open(filename, "rb")
+		data = f.read()
+		f.close()
+
+		magic, version, seed, players, first_stage, stages = cls.HEADER.unpack(data[:cls.HEADER.size])
+		if magic != cls.MAGIC or version != cls.VERSION:
+			raise ValueError(filename + " is not a replay")
+
+		replay = cls(seed, players, first_stage)
+
+		run = struct.Struct("<H%dB" % players)
+		offset = cls.HEADER.size
+		for i in range(stages):
+			count = struct.unpack("<I", data[offset:offset + 4])[0]
+			offset += 4
+			replay.startStage()
+			for j in range(count):
+				values = run.unpack(data[offset:offset + run.size])
+				offset += run.size
+				replay.stages[-1].append([values[0], values[1:]])
+				replay.ticks += values[0]
+
+		return replay
+
+	def saveKeyframes(self, filename):
+		""" Write keyframes file
+		@param string filename
+		@return None
+		"""
+
+		f = open(filename, "wb")
+		f.write(self.KEYFRAMES_HEADER.pack(self.KEYFRAMES_MAGIC, self.VERSION, self.seed, self.players, self.first_stage, self.ticks, len(self.keyframes)))
+		for tick in sorted(self.keyframes):
+			data = Snapshot.dumps(self.keyframes[tick])
+			f.write(self.KEYFRAME.pack(tick, len(data)))
+			f.write(data)
+		f.close()
+
+	def loadKeyframes(self, filename):
+		""" Read keyframes file saved for this replay, adding them to keyframes
+		@param string filename
+		@return None
+		"""
+
+		f = open(filename, "rb")
+		data = f.read()
+		f.close()
+
+		magic, version, seed, players, first_stage, ticks, count = self.KEYFRAMES_HEADER.unpack(data[:self.KEYFRAMES_HEADER.size])
+		if magic != self.KEYFRAMES_MAGIC or version != self.VERSION:
+			raise ValueError(filename + " is not a keyframes file")
+		if (seed, players, first_stage, ticks) != (self.seed, self.players, self.first_stage, self.ticks):
+			raise ValueError(filename + " belongs to another replay")
+
+		offset = self.KEYFRAMES_HEADER.size
+		for i in range(count):
+			tick, length = self.KEYFRAME.unpack(data[offset:offset + self.KEYFRAME.size])
+			offset += self.KEYFRAME.size
+			self.keyframes[tick] = Snapshot.loads(data[offset:offset + length])
+			offset += length
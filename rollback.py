@@ -0,0 +1,612 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Rollback netcode
+Two players on two machines, each running the whole game, peer to peer. Waiting
+for the other peer's input before every tick (lockstep) would delay each key
+press by a round trip. Instead, each peer plays its own input right away, after
+a small input delay, and predicts the remote player's: buttons held stay held,
+no fire presses. When real input comes and differs from the prediction, the game
+is rolled back to the state before the first mispredicted tick and played again
+up to the present, all within one tick.
+
+The state before every tick is saved with Game.getSnapshot(). Game.restoreSnapshot()
+reverts the stage being played in place instead of loading it anew, so rolling
+back costs less than two ticks.
+
+Peers send each other their input over UDP every tick. Each datagram carries
+every tick the other peer hasn't acknowledged yet, so lost or reordered datagrams
+don't matter. It also carries a checksum of the newest tick whose input is known
+from both players. Checksums of the same tick are compared, and the first tick
+they differ at is reported as a desync. A peer that gets ahead of the other waits
+a tick now and then, and never plays more than MAX_ROLLBACK ticks past the remote
+input it has.
+
+Stages follow one another without score screens. After game over the campaign
+starts again from the first stage, as on the server (see server.py).
+
+The test harness plays two bot peers in separate processes. Their datagrams go
+through a relay that delays each one by latency plus random jitter, which also
+reorders them, and may drop some. At the end every checksum both peers agreed on
+is compared.
+
+Usage (from repository root):
+	python rollback.py --port=<n> --peer=<host>:<port> --player=<1|2> [--seed=<n>] [--delay=<ticks>] [--levels=<file>] [--fps=<n>] [-f]
+	python rollback.py --test [--ticks=<n>] [--latency=<ms>] [--jitter=<ms>] [--loss=<percent>] [--delay=<ticks>]
+"""
+
+import sys, time, random, struct, zlib, socket, select, errno, heapq, multiprocessing, pygame
+
+from tanks import Game
+from netstate import StateEncoder
+
+clock = getattr(time, "perf_counter", time.time)
+
+# datagram (little endian): sender's next tick (uint32), number of receiver's
+# ticks sender has input for (uint32), how many ticks sender thinks it is ahead
+# (int16), tick of checksum (uint32, 0xffffffff for none), checksum (uint32),
+# first tick of input (uint32), number of ticks of input (uint8), then input of
+# each tick (uint8, see Game.getInput())
+INPUT = struct.Struct("<IIhIIIB")
+
+NO_TICK = StateEncoder.NO_TICK
+
+# state of random number generator: 624 words and position
+RANDOM_STATE = struct.Struct("<625I")
+
+def getChecksum(game):
+	""" Checksum of game's state: what clients of server see (see netstate.py),
+	timers and random number generator
+	@return int
+	"""
+
+	world = game.world
+
+	# fresh encoder numbers objects in order, so the same state gets the same ids
+	crc = StateEncoder(1).capture(game, 0).digest()
+	crc = zlib.crc32(struct.pack("<II", world.timer.time, world.timer.last_id), crc)
+	crc = zlib.crc32(RANDOM_STATE.pack(*world.rng.getstate()[1]), crc)
+	return crc & 0xffffffff
+
+class Peer(object):
+
+	# keys: fire, up, right, down, left
+	CONTROLS = [pygame.K_SPACE, pygame.K_UP, pygame.K_RIGHT, pygame.K_DOWN, pygame.K_LEFT]
+
+	# most ticks played ahead of remote input, beyond that peer waits for it
+	MAX_ROLLBACK = 12
+
+	# ticks to show how stage ended before next one starts
+	PAUSE_TICKS = 150
+
+	# how many ticks' checksums are kept to compare with remote peer's
+	CHECKSUMS = 256
+
+	def __init__(self, game, player, sock, address, delay = 2):
+		"""
+		@param tanks.Game game Headless game seeded the same on both peers, stage not
+			started. Games with window play sounds and show score screens, which
+			changes how they play out
+		@param int player Index of local player, 0 or 1
+		@param socket.socket sock Bound UDP socket
+		@param tuple address Remote peer's address
+		@param int delay Ticks local input is played after it's given. The longer,
+			the less often the remote peer mispredicts it
+		"""
+
+		self.game = game
+		self.player = player
+		self.remote = 1 - player
+		self.sock = sock
+		self.address = address
+		self.delay = delay
+
+		sock.setblocking(False)
+
+		# next tick to play
+		self.tick = 0
+
+		# input of every tick by player, see Game.getInput(). Local player's runs
+		# delay ticks ahead, remote player's as far as it has come
+		self.inputs = ([], [])
+		self.inputs[player].extend([0] * delay)
+
+		# tick => remote input it was played with, for ticks played before it came
+		self.predicted = {}
+
+		# tick => snapshot and pause before it, for ticks that may be played again
+		self.states = {}
+
+		# first mispredicted tick, None if there's none
+		self.rollback = None
+
+		# ticks below this are confirmed and their states dropped
+		self.confirmed = 0
+
+		# ticks since stage ended, saved with states
+		self.pause = 0
+
+		# number of local player's ticks remote peer has input for
+		self.acked = 0
+
+		# remote peer's next tick and how far it thinks it is ahead, as last heard
+		self.remote_tick = 0
+		self.remote_advantage = 0
+
+		# tick => checksum of state after it, and remote peer's ones not compared yet
+		self.checksums = {}
+		self.remote_checksums = {}
+
+		# first tick whose checksums differ, None if all agree
+		self.desync = None
+
+		# tick => checksum of every confirmed tick, kept only if not None, see test()
+		self.digests = None
+
+		# buttons held and fire presses not played yet, see run()
+		self.pressed = [False] * 4
+		self.fire_presses = 0
+
+		self.stats = {"ticks" : 0, "waits" : 0, "rollbacks" : 0, "resimulated" : 0, "max_rollback" : 0, "sent" : 0, "received" : 0}
+
+		# time each update() took, in seconds
+		self.update_times = []
+
+		game.nr_of_players = 2
+		game.startCampaign()
+
+	def update(self, value):
+		""" Take remote input, roll back if it was mispredicted and play next tick,
+		unless peer is too far ahead
+		@param int value Local player's input, see Game.getInput()
+		@return boolean Whether tick was played and input taken
+		"""
+
+		start = clock()
+
+		self.poll()
+
+		played = self.canPlay()
+		if played:
+			self.advance(value)
+		else:
+			self.stats["waits"] += 1
+
+		self.send()
+
+		self.update_times.append(clock() - start)
+		return played
+
+	def poll(self):
+		""" Take datagrams received, replay mispredicted ticks and compare checksums """
+
+		self.receive()
+		if self.rollback != None:
+			self.rollBack()
+		self.verify()
+
+	def canPlay(self):
+		""" @return boolean Whether next tick can be played: it's not too far ahead of
+		remote input, nor of remote peer """
+
+		if self.tick - len(self.inputs[self.remote]) >= self.MAX_ROLLBACK:
+			return False
+
+		# both peers see each other's ticks late by the same latency, so half the
+		# difference of their advantages is how far this one is really ahead
+		ahead = ((self.tick - self.remote_tick) - self.remote_advantage) / 2.0
+		return ahead < 1.5
+
+	def advance(self, value):
+		""" Save state and play next tick
+		@param int value Local player's input, played delay ticks later
+		"""
+
+		self.inputs[self.player].append(value)
+		self.states[self.tick] = (self.game.getSnapshot(), self.pause)
+		self.play(self.tick)
+		self.tick += 1
+		self.stats["ticks"] += 1
+
+	def play(self, tick):
+		""" Play tick with both players' input, predicting remote one if it hasn't come """
+
+		game = self.game
+		world = game.world
+
+		remote_inputs = self.inputs[self.remote]
+		if tick < len(remote_inputs):
+			remote_value = remote_inputs[tick]
+			self.predicted.pop(tick, None)
+		else:
+			remote_value = remote_inputs[-1] & 0x0f if remote_inputs else 0
+			self.predicted[tick] = remote_value
+
+		if not game.running:
+			self.pause += 1
+			if self.pause >= self.PAUSE_TICKS:
+				self.pause = 0
+				if game.game_over:
+					game.startCampaign()
+				else:
+					game.startLevel()
+
+		for i, player in enumerate(world.players):
+			value = remote_value if i == self.remote else self.inputs[i][tick]
+			game.applyInput(player, value, value >> 4)
+
+		game.update(game.TICK_MS)
+
+		self.checksums[tick] = getChecksum(game)
+
+	def rollBack(self):
+		""" Restore state before first mispredicted tick and play up to current one again """
+
+		game = self.game
+
+		start = self.rollback
+		self.rollback = None
+
+		snapshot, self.pause = self.states[start]
+		game.restoreSnapshot(snapshot)
+
+		for tick in range(start, self.tick):
+			if tick > start:
+				self.states[tick] = (game.getSnapshot(), self.pause)
+			self.play(tick)
+
+		self.stats["rollbacks"] += 1
+		self.stats["resimulated"] += self.tick - start
+		self.stats["max_rollback"] = max(self.stats["max_rollback"], self.tick - start)
+
+	def verify(self):
+		""" Compare checksums of ticks confirmed by both peers, forget states of
+		confirmed ticks """
+
+		confirmed = min(self.tick, len(self.inputs[self.remote]))
+
+		for tick in sorted(self.remote_checksums):
+			if tick >= confirmed:
+				break
+			checksum = self.remote_checksums.pop(tick)
+			if tick in self.checksums and self.checksums[tick] != checksum and (self.desync == None or tick < self.desync):
+				self.desync = tick
+
+		for tick in range(self.confirmed, confirmed):
+			self.states.pop(tick, None)
+			if self.digests != None:
+				self.digests[tick] = self.checksums[tick]
+			self.checksums.pop(tick - self.CHECKSUMS, None)
+		self.confirmed = max(self.confirmed, confirmed)
+
+	def receive(self):
+		""" Take remote input from every datagram received, noting first mispredicted tick """
+
+		remote_inputs = self.inputs[self.remote]
+
+		while True:
+			try:
+				data, address = self.sock.recvfrom(2048)
+			except socket.error as e:
+				if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+					break
+				raise
+
+			if len(data) < INPUT.size:
+				continue
+			tick, acked, advantage, checksum_tick, checksum, first, count = INPUT.unpack_from(data, 0)
+			values = bytearray(data[INPUT.size:INPUT.size + count])
+			self.stats["received"] += 1
+
+			self.acked = max(self.acked, acked)
+
+			if tick >= self.remote_tick:
+				self.remote_tick = tick
+				self.remote_advantage = advantage
+
+			if checksum_tick != NO_TICK and checksum_tick >= self.confirmed - self.CHECKSUMS:
+				self.remote_checksums[checksum_tick] = checksum
+
+			# inputs come in order, ones already known are skipped
+			for i in range(len(remote_inputs) - first, len(values)):
+				if i < 0:
+					break
+				tick = first + i
+				value = values[i]
+				remote_inputs.append(value)
+
+				predicted = self.predicted.pop(tick, None)
+				if predicted != None and predicted != value and (self.rollback == None or tick < self.rollback):
+					self.rollback = tick
+
+	def send(self):
+		""" Send local input remote peer hasn't acknowledged yet and newest confirmed checksum """
+
+		local_inputs = self.inputs[self.player]
+
+		first = self.acked
+		values = local_inputs[first:first + 255]
+
+		checksum_tick = min(self.tick, len(self.inputs[self.remote])) - 1
+		checksum = self.checksums.get(checksum_tick)
+		if checksum == None:
+			checksum_tick = NO_TICK
+			checksum = 0
+
+		advantage = max(min(self.tick - self.remote_tick, 0x7fff), -0x8000)
+
+		data = INPUT.pack(self.tick, len(self.inputs[self.remote]), advantage, checksum_tick, checksum, first, len(values)) + bytes(bytearray(values))
+		try:
+			self.sock.sendto(data, self.address)
+		except socket.error as e:
+			# sent again with next tick anyway
+			if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+				raise
+		self.stats["sent"] += 1
+
+	def isSettled(self, ticks):
+		""" @return boolean Whether both players' input up to ticks is known to both peers """
+		return min(self.tick, len(self.inputs[self.remote])) >= ticks and self.acked >= ticks
+
+	def run(self):
+		""" Play with keyboard until window is closed """
+
+		game = self.game
+
+		pygame.display.set_caption("Battle City - player " + str(self.player + 1))
+
+		# real time not spent on ticks yet, in ms
+		lag = 0
+		desync = None
+
+		while True:
+			lag += game.clock.tick(game.fps)
+
+			for event in pygame.event.get():
+				if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_q):
+					return
+				elif event.type == pygame.KEYDOWN and event.key in self.CONTROLS:
+					index = self.CONTROLS.index(event.key)
+					if index == 0:
+						self.fire_presses += 1
+					else:
+						self.pressed[index - 1] = True
+				elif event.type == pygame.KEYUP and event.key in self.CONTROLS:
+					index = self.CONTROLS.index(event.key)
+					if index > 0:
+						self.pressed[index - 1] = False
+
+			ticks = 0
+			while lag >= game.TICK_MS:
+				if ticks == game.MAX_CATCH_UP_TICKS:
+					lag = 0
+					break
+
+				# encoded as player's input in replays
+				if self.update(game.getInput(self)):
+					self.fire_presses = 0
+				lag -= game.TICK_MS
+				ticks += 1
+
+			if self.desync != desync:
+				desync = self.desync
+				print("Desync at tick %d" % desync)
+
+			game.draw()
+
+	def formatStats(self):
+		""" @return str Ticks played and rolled back and time updates took """
+
+		times = sorted(self.update_times) or [0.0]
+		stats = self.stats
+
+		return "player %d: %d ticks, %d waits, %d rollbacks (%.1f ticks mean, %d max), %d ticks resimulated, update mean %.2f ms, p99 %.2f ms, max %.2f ms, %d datagrams sent, %d received" % (
+			self.player + 1, stats["ticks"], stats["waits"], stats["rollbacks"],
+			stats["resimulated"] / float(max(stats["rollbacks"], 1)), stats["max_rollback"], stats["resimulated"],
+			sum(times) / len(times) * 1000, times[int(len(times) * 0.99)] * 1000, times[-1] * 1000,
+			stats["sent"], stats["received"]
+		)
+
+def runPeer(player, address, ticks, seed, delay, results):
+	""" Test peer process: play ticks in real time with random buttons, put results on queue
+	@param tuple address Relay's address
+	"""
+
+	game = Game(True)
+	game.world.rng.seed(seed)
+
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	sock.bind(("127.0.0.1", 0))
+
+	peer = Peer(game, player, sock, address, delay)
+	peer.digests = {}
+
+	# pressing buttons as server's bots do, each player differently
+	rng = random.Random(seed * 2 + player)
+	buttons = 0
+
+	interval = Game.TICK_MS / 1000.0
+	next_tick = clock()
+
+	# give up if the other peer doesn't keep up
+	end = next_tick + ticks * interval * 2 + 10
+
+	# ticks to keep exchanging after all input is settled, so the other peer
+	# learns its input has come
+	linger = 25
+
+	while linger > 0 and clock() < end:
+		now = clock()
+		if now < next_tick:
+			time.sleep(next_tick - now)
+			continue
+		next_tick = max(next_tick + interval, now - interval * Game.MAX_CATCH_UP_TICKS)
+
+		if peer.tick < ticks:
+			if rng.randint(1, 25) == 1:
+				buttons = 1 << rng.randint(0, 3)
+			fire = int(rng.randint(1, 10) == 1)
+			peer.update(buttons | fire << 4)
+		else:
+			peer.poll()
+			peer.send()
+			if peer.isSettled(ticks):
+				linger -= 1
+
+	sock.close()
+
+	results.put({"player" : player, "report" : peer.formatStats(), "digests" : peer.digests, "desync" : peer.desync})
+
+def relay(sockets, latency, jitter, loss, rng, finished):
+	""" Pass datagrams between two peers, each delayed by latency plus random
+	jitter and some lost
+	@param list sockets Two bound UDP sockets, each peer sends to one of them
+	@param float latency Seconds
+	@param float jitter Most extra seconds
+	@param float loss Fraction of datagrams dropped
+	@param callable finished Called between datagrams, relay ends when it returns True
+	@return dict Datagrams passed, dropped and their mean delay
+	"""
+
+	# where each peer sends from, learned from its first datagram
+	addresses = [None, None]
+
+	# heap of (when to deliver, sequence, socket index to send from, data)
+	queue = []
+	sequence = 0
+
+	stats = {"passed" : 0, "dropped" : 0, "delay" : 0.0}
+
+	while not finished():
+		now = clock()
+		timeout = 0.005
+		if queue:
+			timeout = max(min(queue[0][0] - now, timeout), 0)
+
+		readable = select.select(sockets, [], [], timeout)[0]
+		now = clock()
+
+		for sock in readable:
+			i = sockets.index(sock)
+			try:
+				data, address = sock.recvfrom(2048)
+			except socket.error:
+				continue
+			addresses[i] = address
+
+			if rng.random() < loss:
+				stats["dropped"] += 1
+				continue
+
+			# datagram goes out of the other peer's relay socket
+			delay = latency + rng.random() * jitter
+			heapq.heappush(queue, (now + delay, sequence, 1 - i, data))
+			sequence += 1
+			stats["delay"] += delay
+
+		while queue and queue[0][0] <= now:
+			due, n, i, data = heapq.heappop(queue)
+			if addresses[i] == None:
+				stats["dropped"] += 1
+				continue
+			sockets[i].sendto(data, addresses[i])
+			stats["passed"] += 1
+
+	stats["delay"] /= max(stats["passed"] + stats["dropped"], 1)
+	return stats
+
+def test(ticks = 1500, latency = 40, jitter = 20, loss = 0.0, delay = 2, seed = 0):
+	""" Play two bot peers through relay injecting latency, jitter and loss
+	@param int ticks Ticks to play
+	@param float latency One way delay of datagrams, in ms
+	@param float jitter Most random extra delay, in ms
+	@param float loss Percent of datagrams dropped
+	@return str Report
+	"""
+
+	sockets = []
+	for i in range(2):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		sock.bind(("127.0.0.1", 0))
+		sockets.append(sock)
+
+	results = multiprocessing.Queue()
+	workers = []
+	for player in range(2):
+		worker = multiprocessing.Process(target = runPeer, args = (player, sockets[player].getsockname(), ticks, seed, delay, results))
+		worker.start()
+		workers.append(worker)
+
+	peers = []
+	def finished():
+		while not results.empty():
+			peers.append(results.get())
+		return len(peers) == len(workers) or not [worker for worker in workers if worker.is_alive()]
+
+	start = time.time()
+	stats = relay(sockets, latency / 1000.0, jitter / 1000.0, loss / 100.0, random.Random(seed), finished)
+	seconds = time.time() - start
+
+	for worker in workers:
+		worker.join()
+	for sock in sockets:
+		sock.close()
+
+	peers.sort(key = lambda peer: peer["player"])
+	lines = ["%d ticks in %.1f s, latency %d ms + up to %d ms jitter, %.1f%% lost, input delay %d ticks" % (ticks, seconds, latency, jitter, loss, delay)]
+	lines.extend([peer["report"] for peer in peers])
+	lines.append("relay: %d datagrams passed, %d dropped, mean delay %.1f ms" % (stats["passed"], stats["dropped"], stats["delay"] * 1000))
+
+	if len(peers) < 2:
+		lines.append("peer process failed")
+		return "\n".join(lines)
+
+	digests = [peer["digests"] for peer in peers]
+	common = sorted(set(digests[0]) & set(digests[1]))
+	differ = [tick for tick in common if digests[0][tick] != digests[1][tick]]
+	lines.append("%d ticks confirmed by both, %d checksums differ%s, desync detected by peers at %s" % (
+		len(common), len(differ), " (first at tick %d)" % differ[0] if differ else "",
+		", ".join([str(peer["desync"]) for peer in peers])
+	))
+
+	return "\n".join(lines)
+
+if __name__ == "__main__":
+
+	options = {}
+	for arg in sys.argv[1:]:
+		if arg.startswith("--") and "=" in arg:
+			name, value = arg[2:].split("=", 1)
+			options[name] = value
+
+	delay = int(options.get("delay", 2))
+
+	if "--test" in sys.argv[1:]:
+		print(test(
+			int(options.get("ticks", 1500)), float(options.get("latency", 40)), float(options.get("jitter", 20)),
+			float(options.get("loss", 0)), delay, int(options.get("seed", 0))
+		))
+		sys.exit()
+
+	level_pack = None
+	if "levels" in options:
+		from levelpack import LevelPack
+		level_pack = LevelPack(options["levels"])
+
+	# game is played headless, like the other peer's, and drawn into window of
+	# one that isn't played
+	view = Game(False, level_pack, fullscreen = "-f" in sys.argv[1:])
+	game = Game(True, level_pack, view, fps = int(options["fps"]) if "fps" in options else None)
+	game.world.screen = view.world.screen
+	game.world.rng.seed(int(options.get("seed", 0)))
+
+	host, port = options["peer"].rsplit(":", 1)
+
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	sock.bind(("", int(options.get("port", 8766))))
+
+	peer = Peer(game, int(options.get("player", 1)) - 1, sock, (host, int(port)), delay)
+	try:
+		peer.run()
+	finally:
+		print(peer.formatStats())
@@ -0,0 +1,424 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Multi-process runner
+Plays independent seeded games on a pool of worker processes, one per core by
+default. Each game is played headless by autopilot, like Game.simulate(), from
+the first stage on.
+
+Only seeds are sent to workers. Results come back through
+multiprocessing.shared_memory: every worker has a block holding its status, a
+ring buffer of stage summaries and, if observations are asked for, a ring
+buffer of feature planes (see observation.py) taken every n ticks. Parent reads
+them in place, nothing is pickled.
+
+Workers that die are replaced and the game they were playing is played again,
+unless its summaries made it to the ring before the worker died. Summaries carry
+the game's seed, and those of a game already finished are ignored, so no game is
+counted twice.
+With recycle, workers also exit after so many games and new ones take over, so
+memory doesn't pile up in long runs.
+
+Requires Python 3.8 or later.
+
+Usage (from repository root):
+	python runner.py [--games=<n>] [--workers=<n>] [--stages=<n>] [--seed=<n>]
+		[--observe=<ticks>] [--recycle=<games>]
+"""
+
+import sys, time, struct
+import multiprocessing
+from multiprocessing import shared_memory
+
+class Ring(object):
+	""" Ring buffer of fixed size records in shared memory, for one writer and one reader
+	Layout: number of records written (head) and read (tail), both uint64, then records
+	"""
+
+	HEADER = struct.Struct("<QQ")
+
+	def __init__(self, buf, offset, record_size, capacity):
+		"""
+		@param memoryview buf Shared memory
+		@param int offset Where ring starts in buf
+		@param int record_size Bytes per record
+		@param int capacity Number of records
+		"""
+		self.buf = buf
+		self.offset = offset
+		self.record_size = record_size
+		self.capacity = capacity
+
+	@classmethod
+	def getSize(cls, record_size, capacity):
+		""" @return int Bytes ring takes """
+		return cls.HEADER.size + record_size * capacity
+
+	def getCounters(self):
+		""" @return tuple Head and tail """
+		return self.HEADER.unpack_from(self.buf, self.offset)
+
+	def getRecordOffset(self, n):
+		""" @return int Offset of n-th record ever written in buf """
+		return self.offset + self.HEADER.size + (n % self.capacity) * self.record_size
+
+	def put(self, records, block = True):
+		""" Write records and make them visible to reader at once
+		@param list records Byte strings of record_size
+		@param boolean block Wait for reader if ring is full, otherwise drop records
+		@return boolean Whether records were written
+		"""
+
+		while True:
+			head, tail = self.getCounters()
+			if head + len(records) - tail <= self.capacity:
+				break
+			if not block:
+				return False
+			time.sleep(0.001)
+
+		for i, record in enumerate(records):
+			offset = self.getRecordOffset(head + i)
+			self.buf[offset:offset + self.record_size] = record
+
+		# head goes last, so reader never sees half written records
+		struct.pack_into("<Q", self.buf, self.offset, head + len(records))
+		return True
+
+	def peek(self):
+		""" Find oldest record not read yet
+		@return int Its offset in buf, None if there is none
+		"""
+		head, tail = self.getCounters()
+		if tail == head:
+			return None
+		return self.getRecordOffset(tail)
+
+	def advance(self):
+		""" Free oldest record for writer """
+		head, tail = self.getCounters()
+		struct.pack_into("<Q", self.buf, self.offset + 8, tail + 1)
+
+class Runner(object):
+
+	# worker's status: seed of game being played (-1 if none), observations dropped
+	STATUS = struct.Struct("<qq")
+
+	# stage summary: seed, stage, outcome, ticks, kills by enemy type, enemies
+	# left, castle standing, whether it was game's last stage
+	RESULT = struct.Struct("<q10i")
+
+	OUTCOMES = ("cleared", "lost", "timeout")
+
+	# observation: seed, tick in stage, then planes
+	OBSERVATION = struct.Struct("<qi")
+
+	def __init__(self, workers = None, stages = 1, max_ticks = 15000, observe = 0, recycle = 0, results = 1024, observations = 64):
+		"""
+		@param int workers Number of worker processes, None for one per core
+		@param int stages Stages to play in each game
+		@param int max_ticks Give up stage after this many ticks
+		@param int observe Take observation every n ticks, 0 for none
+		@param int recycle Replace worker after it has played so many games, 0 never
+		@param int results Capacity of workers' summary rings, at least stages, as
+			summaries of a game are written at once
+		@param int observations Capacity of workers' observation rings. Observations
+			that don't fit are dropped, so workers don't wait for slow readers
+		"""
+
+		if stages > results:
+			raise ValueError("summary rings hold %d records, fewer than %d stages" % (results, stages))
+
+		self.workers = workers or multiprocessing.cpu_count()
+		self.stages = stages
+		self.max_ticks = max_ticks
+		self.observe = observe
+		self.recycle = recycle
+		self.results = results
+		self.observations = observations
+
+		self.planes_shape = None
+		self.observation_size = 0
+		if observe:
+			from observation import Observer
+			self.planes_shape = (Observer.PLANES, Observer.SIZE, Observer.SIZE)
+			self.observation_size = self.OBSERVATION.size + Observer.PLANES * Observer.SIZE * Observer.SIZE
+
+		self.size = self.STATUS.size + Ring.getSize(self.RESULT.size, results)
+		if observe:
+			self.size += Ring.getSize(self.observation_size, observations)
+
+	def getRings(self, buf):
+		""" Find rings in worker's shared memory
+		@return tuple Summary ring and observation ring (None if observations are off)
+		"""
+
+		results = Ring(buf, self.STATUS.size, self.RESULT.size, self.results)
+		observations = None
+		if self.observe:
+			observations = Ring(buf, self.STATUS.size + Ring.getSize(self.RESULT.size, self.results), self.observation_size, self.observations)
+		return (results, observations)
+
+	def run(self, seeds, onResult = None, onObservation = None, report = 1.0):
+		""" Play a game for each seed
+		@param list seeds Distinct seeds
+		@param callable onResult Called with summary dict of each stage played,
+			see Game.stageSummary(), with seed and last (whether game ended) added
+		@param callable onObservation Called with seed, tick and planes. Planes are
+			a view into shared memory, valid only during the call
+		@param float report Print throughput every so many seconds, 0 never
+		@return dict games, ticks, seconds taken, games and ticks per second, workers
+			restarted and observations dropped
+		"""
+
+		jobs = multiprocessing.Queue()
+		for seed in seeds:
+			jobs.put(seed)
+
+		memories = [shared_memory.SharedMemory(create = True, size = self.size) for i in range(self.workers)]
+		processes = [None] * self.workers
+
+		stats = {"games" : 0, "ticks" : 0, "restarts" : 0, "dropped" : 0}
+		games = len(seeds)
+
+		# seeds of games whose results have all come
+		finished = set()
+
+		try:
+			for i in range(self.workers):
+				self.STATUS.pack_into(memories[i].buf, 0, -1, 0)
+				results, observations = self.getRings(memories[i].buf)
+				Ring.HEADER.pack_into(memories[i].buf, results.offset, 0, 0)
+				if observations != None:
+					Ring.HEADER.pack_into(memories[i].buf, observations.offset, 0, 0)
+				processes[i] = self.startWorker(i, memories[i], jobs)
+
+			start = time.time()
+			last_report = start
+
+			while stats["games"] < games:
+				idle = True
+
+				for i, memory in enumerate(memories):
+					results, observations = self.getRings(memory.buf)
+
+					if self.readResults(memory.buf, results, stats, finished, onResult):
+						idle = False
+
+					if observations != None:
+						offset = observations.peek()
+						while offset != None:
+							if onObservation != None:
+								self.readObservation(memory.buf, offset, onObservation)
+							observations.advance()
+							idle = False
+							offset = observations.peek()
+
+					# replace dead worker, play its game again
+					process = processes[i]
+					if not process.is_alive() and stats["games"] < games:
+						process.join()
+
+						# summaries written before worker died may have come after
+						# those read above. with them read, its game is finished
+						self.readResults(memory.buf, results, stats, finished, onResult)
+
+						seed, dropped = self.STATUS.unpack_from(memory.buf, 0)
+						if seed != -1 and seed not in finished:
+							jobs.put(seed)
+						if process.exitcode != 0:
+							stats["restarts"] += 1
+						stats["dropped"] += dropped
+						self.STATUS.pack_into(memory.buf, 0, -1, 0)
+						processes[i] = self.startWorker(i, memory, jobs)
+
+				now = time.time()
+				if report and now - last_report >= report:
+					last_report = now
+					print(self.formatStats(stats, now - start))
+
+				if idle:
+					time.sleep(0.001)
+
+			for process in processes:
+				jobs.put(None)
+			for process in processes:
+				process.join()
+
+			for memory in memories:
+				stats["dropped"] += self.STATUS.unpack_from(memory.buf, 0)[1]
+
+			stats["seconds"] = time.time() - start
+			stats["games_per_second"] = stats["games"] / stats["seconds"]
+			stats["ticks_per_second"] = stats["ticks"] / stats["seconds"]
+			stats["workers"] = self.workers
+			return stats
+
+		finally:
+			for process in processes:
+				if process != None and process.is_alive():
+					process.terminate()
+					process.join()
+			for memory in memories:
+				memory.close()
+				memory.unlink()
+
+	def startWorker(self, index, memory, jobs):
+		""" Start worker process writing into given shared memory """
+		process = multiprocessing.Process(target = work, args = (self, memory.name, jobs))
+		process.daemon = True
+		process.start()
+		return process
+
+	def readResults(self, buf, results, stats, finished, onResult):
+		""" Take summaries from worker's ring. Summaries of games already finished,
+		played again after their worker died, are dropped
+		@param set finished Seeds of games whose summaries have all come, updated
+		@return boolean Whether any summary was read
+		"""
+
+		read = False
+		offset = results.peek()
+		while offset != None:
+			summary = self.readResult(buf, offset)
+			results.advance()
+			read = True
+			offset = results.peek()
+
+			if summary["seed"] in finished:
+				continue
+
+			stats["ticks"] += summary["ticks"]
+			if summary["last"]:
+				finished.add(summary["seed"])
+				stats["games"] = len(finished)
+			if onResult != None:
+				onResult(summary)
+
+		return read
+
+	def readResult(self, buf, offset):
+		""" Decode stage summary written by worker """
+
+		values = self.RESULT.unpack_from(buf, offset)
+		return {
+			"seed" : values[0],
+			"stage" : values[1],
+			"outcome" : self.OUTCOMES[values[2]],
+			"ticks" : values[3],
+			"kills" : list(values[4:8]),
+			"enemies_left" : values[8],
+			"castle" : bool(values[9]),
+			"last" : bool(values[10])
+		}
+
+	def readObservation(self, buf, offset, callback):
+		""" Pass observation to callback as view into shared memory """
+
+		import numpy
+
+		seed, tick = self.OBSERVATION.unpack_from(buf, offset)
+		planes = numpy.frombuffer(buf, numpy.uint8, self.observation_size - self.OBSERVATION.size, offset + self.OBSERVATION.size).reshape(self.planes_shape)
+		try:
+			callback(seed, tick, planes)
+		finally:
+			del planes
+
+	def formatStats(self, stats, seconds):
+		return "%d games, %d ticks in %.1f s: %.2f games/s, %.0f ticks/s, %d workers restarted" % (
+			stats["games"], stats["ticks"], seconds, stats["games"] / seconds, stats["ticks"] / seconds, stats["restarts"]
+		)
+
+def work(runner, name, jobs):
+	""" Worker process: play games for seeds from jobs until None comes """
+
+	from tanks import Game
+
+	memory = shared_memory.SharedMemory(name = name)
+	buf = memory.buf
+	results, observations = runner.getRings(buf)
+
+	game = Game(True)
+	world = game.world
+
+	observer = None
+	if runner.observe:
+		from observation import Observer
+		observer = Observer()
+
+	games = 0
+	while runner.recycle == 0 or games < runner.recycle:
+		seed = jobs.get()
+		if seed == None:
+			break
+
+		dropped = runner.STATUS.unpack_from(buf, 0)[1]
+		runner.STATUS.pack_into(buf, 0, seed, dropped)
+
+		world.rng.seed(seed)
+		del world.players[:]
+		game.stage = 0
+
+		# summaries are written when whole game is over, so game of worker that
+		# dies midway is played again from scratch
+		records = []
+		for i in range(runner.stages):
+			game.startLevel()
+
+			ticks = 0
+			while game.running and ticks < runner.max_ticks:
+				for player in world.players:
+					game.autopilot(player)
+				game.update(game.TICK_MS)
+				ticks += 1
+
+				if observer != None and ticks % runner.observe == 0:
+					observer.encode(game)
+					if not observations.put([runner.OBSERVATION.pack(seed, ticks) + observer.planes.tobytes()], False):
+						dropped += 1
+
+			summary = game.stageSummary(ticks)
+			records.append(runner.RESULT.pack(
+				seed, summary["stage"], runner.OUTCOMES.index(summary["outcome"]), ticks,
+				summary["kills"][0], summary["kills"][1], summary["kills"][2], summary["kills"][3],
+				summary["enemies_left"], int(summary["castle"]), int(i == runner.stages - 1)
+			))
+
+			for player in world.players:
+				if player.lives < 1:
+					player.lives = 3
+
+		results.put(records)
+
+		games += 1
+		runner.STATUS.pack_into(buf, 0, -1, dropped)
+
+	del buf, results, observations
+	memory.close()
+
+if __name__ == "__main__":
+
+	options = {}
+	for arg in sys.argv[1:]:
+		if arg.startswith("--") and "=" in arg:
+			name, value = arg[2:].split("=", 1)
+			options[name] = value
+
+	seed = int(options.get("seed", 0))
+	games = int(options.get("games", 100))
+
+	runner = Runner(
+		int(options["workers"]) if "workers" in options else None,
+		int(options.get("stages", 1)),
+		observe = int(options.get("observe", 0)),
+		recycle = int(options.get("recycle", 0))
+	)
+
+	observations = [0]
+	def count(seed, tick, planes):
+		observations[0] += 1
+
+	stats = runner.run(list(range(seed, seed + games)), onObservation = count)
+	print(runner.formatStats(stats, stats["seconds"]))
+	if runner.observe:
+		print("%d observations" % observations[0])
@@ -0,0 +1,371 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Multiplayer server
+Runs the game authoritatively at 50 ticks per second and lets players play it
+over TCP. Game is headless here, clients only send their input - buttons held
+and fire presses, as in replays - and draw what server tells them. After every
+tick each client gets a delta of game's state against the last state it has
+acknowledged, see netstate.py. Clients that don't keep up with reading are
+skipped until they do, and then get everything they've missed in one delta.
+
+First clients to connect take players' tanks, the rest watch. Stages follow one
+another without score screens. After game over the campaign starts again from
+the first stage.
+
+The load test plays a game with many simulated clients on loopback. They run in
+separate processes, press random buttons, decode every state and check samples
+of them against the server's own.
+
+Requires Python 3.7 or later. To play, start the server and connect with
+tanks.py --connect=<host>:<port>.
+
+Usage (from repository root):
+	python server.py [--host=<host>] [--port=<n>] [--players=<n>] [--levels=<file>]
+	python server.py --bots=<n> [--bot-processes=<n>] [--ticks=<n>] [--players=<n>]
+"""
+
+import sys, time, random, struct, asyncio, socket, multiprocessing
+
+from tanks import Game
+from netstate import StateEncoder, StateDecoder, packMessage, HEADER, HELLO, INPUT, SPECTATOR, MSG_HELLO, MSG_INPUT, MSG_STATE
+
+class Connection(object):
+	""" Client connected to server """
+
+	def __init__(self, writer, player):
+		"""
+		@param asyncio.StreamWriter writer
+		@param int player Index of player client controls, SPECTATOR if none
+		"""
+
+		self.writer = writer
+		self.player = player
+
+		# last tick client has received, deltas are based on it
+		self.ack = StateEncoder.NO_TICK
+
+		# buttons held and fire presses not played yet, see Game.getInput()
+		self.buttons = 0
+		self.fire_presses = 0
+
+class Server(object):
+
+	# ticks to show how stage ended before next one starts
+	PAUSE_TICKS = 150
+
+	# most ticks played at once to catch up after a late wakeup, later are skipped
+	MAX_CATCH_UP_TICKS = 5
+
+	# clients with this many bytes still waiting to be sent are skipped
+	MAX_BUFFERED = 64 * 1024
+
+	def __init__(self, players = 2, level_pack = None, history = 64):
+		"""
+		@param int players Number of players, 1 or 2
+		@param LevelPack level_pack Take levels from pack instead of levels/ directory
+		@param int history Number of past states kept as bases for deltas. Clients
+			further behind get whole state
+		"""
+
+		self.players = players
+
+		self.game = Game(True, level_pack)
+		self.game.nr_of_players = players
+
+		self.encoder = StateEncoder(history)
+
+		self.connections = []
+
+		# ticks played
+		self.tick = 0
+
+		# ticks since stage ended
+		self.pause = 0
+
+		# tick => checksum of state, kept only if not None, see loadTest()
+		self.digests = None
+
+		self.stats = {"ticks" : 0, "late" : 0, "skipped" : 0, "sent" : 0, "messages" : 0, "held" : 0, "clients" : 0}
+
+		# time each tick took, in seconds
+		self.tick_times = []
+
+		self.game.startCampaign()
+
+	def update(self):
+		""" Play one tick with clients' input and send them the new state """
+
+		game = self.game
+		world = game.world
+
+		if not game.running:
+			self.pause += 1
+			if self.pause >= self.PAUSE_TICKS:
+				self.pause = 0
+				if game.game_over:
+					game.startCampaign()
+				else:
+					game.startLevel()
+
+		for connection in self.connections:
+			if connection.player < len(world.players):
+				game.applyInput(world.players[connection.player], connection.buttons, connection.fire_presses)
+				connection.fire_presses = 0
+
+		game.update(game.TICK_MS)
+		self.tick += 1
+
+		state = self.encoder.capture(game, self.tick)
+		if self.digests != None:
+			self.digests[self.tick] = state.digest()
+
+		for connection in self.connections:
+			if connection.writer.transport.get_write_buffer_size() > self.MAX_BUFFERED:
+				self.stats["skipped"] += 1
+				continue
+			message = self.encoder.encode(self.tick, connection.ack)
+			connection.writer.write(message)
+			self.stats["sent"] += len(message)
+			self.stats["messages"] += 1
+
+	async def handleClient(self, reader, writer):
+		""" Give client a player, if any is free, and take its input until it leaves """
+
+		sock = writer.get_extra_info("socket")
+		if sock != None:
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+		taken = [connection.player for connection in self.connections]
+		free = [i for i in range(self.players) if i not in taken]
+		connection = Connection(writer, free[0] if free else SPECTATOR)
+
+		self.connections.append(connection)
+		self.stats["clients"] = max(self.stats["clients"], len(self.connections))
+
+		writer.write(packMessage(MSG_HELLO, HELLO.pack(connection.player, self.players, Game.TICK_MS)))
+
+		try:
+			while True:
+				length, msg_type = HEADER.unpack(await reader.readexactly(HEADER.size))
+				payload = await reader.readexactly(length)
+				if msg_type == MSG_INPUT:
+					connection.ack, value = INPUT.unpack(payload)
+					connection.buttons = value & 0x0f
+					connection.fire_presses += value >> 4
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			self.connections.remove(connection)
+			writer.close()
+
+			# release buttons it held, or its tank would keep driving
+			connection.buttons = 0
+			connection.fire_presses = 0
+			players = self.game.world.players
+			if connection.player < len(players):
+				self.game.setInput(players[connection.player], 0)
+
+	async def run(self, ticks = 0):
+		""" Play ticks in real time, TICK_MS apart
+		@param int ticks Stop after this many, 0 never
+		"""
+
+		loop = asyncio.get_running_loop()
+		interval = Game.TICK_MS / 1000.0
+
+		next_tick = loop.time()
+		while ticks == 0 or self.tick < ticks:
+			now = loop.time()
+			if now < next_tick:
+				await asyncio.sleep(next_tick - now)
+				continue
+
+			# too far behind, skip ticks instead of playing them all at once
+			behind = int((now - next_tick) / interval)
+			if behind >= self.MAX_CATCH_UP_TICKS:
+				self.stats["held"] += behind
+				next_tick = now
+			elif behind > 0:
+				self.stats["late"] += 1
+
+			start = time.perf_counter()
+			self.update()
+			self.tick_times.append(time.perf_counter() - start)
+			self.stats["ticks"] += 1
+
+			next_tick += interval
+
+			# let clients' input in between ticks that are played to catch up
+			await asyncio.sleep(0)
+
+	async def serve(self, host, port, ticks = 0, listening = None):
+		""" Accept clients and play
+		@param str host
+		@param int port 0 for any free port
+		@param int ticks Stop after this many, 0 never
+		@param callable listening Called with port once server is accepting clients
+		"""
+
+		server = await asyncio.start_server(self.handleClient, host, port)
+		if listening != None:
+			listening(server.sockets[0].getsockname()[1])
+
+		try:
+			await self.run(ticks)
+		finally:
+			server.close()
+			for connection in list(self.connections):
+				connection.writer.close()
+
+			# handlers see connections closed and end
+			while self.connections:
+				await asyncio.sleep(0.01)
+			await server.wait_closed()
+
+	def formatStats(self, seconds):
+		""" @return str Ticks and traffic so far """
+
+		times = sorted(self.tick_times) or [0.0]
+		stats = self.stats
+
+		return "\n".join([
+			"%d ticks in %.1f s, %d late, %d skipped to catch up" % (stats["ticks"], seconds, stats["late"], stats["held"]),
+			"tick: mean %.2f ms, p99 %.2f ms, max %.2f ms" % (
+				sum(times) / len(times) * 1000, times[int(len(times) * 0.99)] * 1000, times[-1] * 1000
+			),
+			"sent %d states, %.1f KB/s, mean %.0f B, %d skipped for slow clients, whole state %d B" % (
+				stats["messages"], stats["sent"] / 1024.0 / seconds, stats["sent"] / float(max(stats["messages"], 1)),
+				stats["skipped"], len(self.encoder.encode(self.tick, StateEncoder.NO_TICK))
+			)
+		])
+
+async def bot(host, port, rng, result):
+	""" Simulated client: press random buttons, decode and acknowledge every state
+	@param dict result Filled with what bot received
+	"""
+
+	reader, writer = await asyncio.open_connection(host, port)
+	writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+	decoder = StateDecoder()
+	buttons = 0
+
+	try:
+		while True:
+			length, msg_type = HEADER.unpack(await reader.readexactly(HEADER.size))
+			payload = await reader.readexactly(length)
+			result["received"] += HEADER.size + length
+
+			if msg_type == MSG_HELLO:
+				result["player"] = HELLO.unpack(payload)[0]
+			elif msg_type == MSG_STATE:
+				state = decoder.decode(payload)
+				result["states"] += 1
+				if struct.unpack_from("<I", payload, 4)[0] == StateEncoder.NO_TICK:
+					result["whole"] += 1
+				if state.tick % 50 == 0:
+					result["digests"].append((state.tick, state.digest()))
+
+				if rng.randint(1, 25) == 1:
+					buttons = 1 << rng.randint(0, 3)
+				fire = int(rng.randint(1, 10) == 1)
+				writer.write(packMessage(MSG_INPUT, INPUT.pack(state.tick, buttons | fire << 4)))
+	except (asyncio.IncompleteReadError, ConnectionError):
+		pass
+	finally:
+		writer.close()
+
+def runBots(host, port, count, seed, results):
+	""" Bot process: run count bots until server closes, put their results on queue """
+
+	async def main():
+		bots = []
+		for i in range(count):
+			result = {"player" : SPECTATOR, "received" : 0, "states" : 0, "whole" : 0, "digests" : []}
+			bots.append(result)
+		await asyncio.gather(*[bot(host, port, random.Random(seed + i), result) for i, result in enumerate(bots)])
+		return bots
+
+	results.put(asyncio.run(main()))
+
+def loadTest(bots, ticks, players = 2, processes = 1, seed = 0):
+	""" Play game on loopback with bots as clients
+	@param int bots Number of clients
+	@param int ticks Ticks to play
+	@param int processes Processes to run bots in
+	@return str Report
+	"""
+
+	server = Server(players)
+	server.game.world.rng.seed(seed)
+	server.digests = {}
+
+	results = multiprocessing.Queue()
+	workers = []
+
+	def listening(port):
+		for i in range(processes):
+			count = bots // processes + int(i < bots % processes)
+			worker = multiprocessing.Process(target = runBots, args = ("127.0.0.1", port, count, seed + i * bots, results))
+			worker.start()
+			workers.append(worker)
+
+	start = time.time()
+	asyncio.run(server.serve("127.0.0.1", 0, ticks, listening))
+	seconds = time.time() - start
+
+	clients = []
+	for worker in workers:
+		clients.extend(results.get())
+		worker.join()
+
+	checked = 0
+	desyncs = 0
+	for client in clients:
+		for tick, digest in client["digests"]:
+			checked += 1
+			if server.digests[tick] != digest:
+				desyncs += 1
+
+	states = sum([client["states"] for client in clients])
+	received = sum([client["received"] for client in clients])
+
+	return "\n".join([
+		"%d clients (%d players) in %d processes" % (len(clients), len([client for client in clients if client["player"] != SPECTATOR]), processes),
+		server.formatStats(seconds),
+		"clients: %.0f states each, %.1f KB/s each, %d whole states, %d of %d sampled states differ from server's" % (
+			states / float(max(len(clients), 1)), received / 1024.0 / seconds / max(len(clients), 1),
+			sum([client["whole"] for client in clients]), desyncs, checked
+		)
+	])
+
+if __name__ == "__main__":
+
+	options = {}
+	for arg in sys.argv[1:]:
+		if arg.startswith("--") and "=" in arg:
+			name, value = arg[2:].split("=", 1)
+			options[name] = value
+
+	players = int(options.get("players", 2))
+
+	if "bots" in options:
+		print(loadTest(int(options["bots"]), int(options.get("ticks", 1500)), players, int(options.get("bot-processes", 1))))
+		sys.exit()
+
+	level_pack = None
+	if "levels" in options:
+		from levelpack import LevelPack
+		level_pack = LevelPack(options["levels"])
+
+	server = Server(players, level_pack)
+
+	def listening(port):
+		print("Listening on port %d" % port)
+
+	start = time.time()
+	try:
+		asyncio.run(server.serve(options.get("host", "0.0.0.0"), int(options.get("port", 8765)), 0, listening))
+	except KeyboardInterrupt:
+		print(server.formatStats(time.time() - start))
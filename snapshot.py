@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# coding=utf-8
+
+""" Game state snapshots
+Game.getSnapshot() captures the game world as plain data and
+Game.restoreSnapshot() puts it back, so a game can be forked into any number of
+simulations going on from the same moment, or checkpointed and continued later.
+Given the same input afterwards, restored game plays out exactly as the
+original one would have.
+
+Here snapshots are turned into bytes and files. Like replays, they are bound to
+levels and game version they were taken with.
+
+File layout: magic "BCSS", version (uint16), then snapshot as zlib compressed
+JSON
+"""
+
+import struct, json, zlib
+
+class Snapshot():
+
+	MAGIC = b"BCSS"
+
+	VERSION = 1
+
+	HEADER = struct.Struct("<4sH")
+
+	@classmethod
+	def dumps(cls, snapshot):
+		""" Encode snapshot
+		@param dict snapshot See Game.getSnapshot()
+		@return bytes
+		"""
+		data = json.dumps(snapshot, separators = (",", ":"), sort_keys = True)
+		return cls.HEADER.pack(cls.MAGIC, cls.VERSION) + zlib.compress(data.encode("utf-8"))
+
+	@classmethod
+	def loads(cls, data):
+		""" Decode snapshot encoded by dumps()
+		@param bytes data
+		@return dict
+		"""
+
+		magic, version = cls.HEADER.unpack(data[:cls.HEADER.size])
+		if magic != cls.MAGIC or version != cls.VERSION:
+			raise ValueError("not a snapshot")
+
+		return json.loads(zlib.decompress(data[cls.HEADER.size:]).decode("utf-8"))
+
+	@classmethod
+	def save(cls, snapshot, filename):
+		""" Write snapshot file
+		@param dict snapshot See Game.getSnapshot()
+		@param string filename
+		@return None
+		"""
+		f = open(filename, "wb")
+		f.write(cls.dumps(snapshot))
+		f.close()
+
+	@classmethod
+	def load(cls, filename):
+		""" Read snapshot file
+		@param string filename
+		@return dict Snapshot to pass to Game.restoreSnapshot()
+		"""
+
+		f = open(filename, "rb")
+		data = f.read()
+		f.close()
+
+		try:
+			return cls.loads(data)
+		except ValueError:
+			raise ValueError(filename + " is not a snapshot")
@@ -1,65 +1,643 @@
 #!/usr/bin/python
 # coding=utf-8
 
-import os, pygame, time, random, uuid, sys
+import os, pygame, time, random, heapq, sys, math
+from array import array
+from assets import AssetCache
+from replay import Replay
+from profiler import TickProfiler
+
+def interpolate(last, current, alpha):
+	""" Position between last tick's and current one, for drawing between ticks
+	@param tuple last Position after previous tick, None if not known
+	@param tuple current Position after current tick
+	@param float alpha How far between ticks to draw, 0.0 - 1.0
+	@return tuple Position to draw at
+	"""
+
+	# moves longer than a tile are teleports (spawns), don't slide those
+	if last == None or alpha >= 1 or abs(current[0] - last[0]) + abs(current[1] - last[1]) > 16:
+		return current
+
+	return (int(math.floor(last[0] + (current[0] - last[0]) * alpha + 0.5)), int(math.floor(last[1] + (current[1] - last[1]) * alpha + 0.5)))
 
-class myRect(pygame.Rect):
-	""" Add type property """
-	def __init__(self, left, top, width, height, type):
-		pygame.Rect.__init__(self, left, top, width, height)
-		self.type = type
+def getFields(obj, names):
+	""" Copy object's attributes for snapshot, see Game.getSnapshot()
+	Lists and dicts are copied, so snapshot doesn't change with object. Attributes
+	object doesn't have are left out
+	@param object obj
+	@param tuple names Attribute names
+	@return dict
+	"""
+	state = {}
+	for name in names:
+		if name in obj.__dict__:
+			state[name] = copyValue(obj.__dict__[name])
+	return state
+
+def setFields(obj, state, names):
+	""" Set attributes copied by getFields() """
+	for name in names:
+		if name in state:
+			setattr(obj, name, copyValue(state[name]))
+
+def copyValue(value):
+	if value.__class__ is list:
+		return list(value)
+	if value.__class__ is dict:
+		return dict(value)
+	return value
+
+def getObject(objects, ref):
+	""" Find object of restored snapshot by reference, see Game.restoreSnapshot()
+	@param dict objects Collection name => list of objects
+	@param list ref Collection name and index, or None
+	@return object None if ref is None
+	"""
+	if ref == None:
+		return None
+	return objects[ref[0]][ref[1]]
 
 class Timer(object):
+	""" Calls functions after given intervals of game time
+	Timers are kept in a heap ordered by due time, so update() only touches timers
+	that have to fire. Timers that are due in the same update fire in order of due
+	time and, on ties, in order they were added. Repeating timers without interval
+	fire once per update
+	"""
+
 	def __init__(self):
-		self.timers = []
 
-	def add(self, interval, f, repeat = -1):
+		# game time in ms
+		self.time = 0
+
+		# heap of (due time, timer id). destroyed timers are dropped when popped
+		self.queue = []
+
+		# active timers: timer id => options
+		self.timers = {}
+
+		self.last_id = 0
+
+		# how many callbacks fired during last update
+		self.fired = 0
+
+	def add(self, interval, f, repeat = -1, args = ()):
+		""" Add timer
+		@param int interval Time in ms between calls
+		@param callable f Callback, bound method of game object so timer can be
+			saved in snapshot, see getState()
+		@param int repeat How many times to call f. -1 means forever
+		@param tuple args Arguments to call f with
+		@return int Timer id, see destroy()
+		"""
+		self.last_id += 1
 		options = {
 			"interval"	: interval,
 			"callback"	: f,
+			"args"			: args,
 			"repeat"		: repeat,
 			"times"			: 0,
-			"time"			: 0,
-			"uuid"			: uuid.uuid4()
+			"due"				: self.time + interval
 		}
-		self.timers.append(options)
+		self.timers[self.last_id] = options
+		heapq.heappush(self.queue, (options["due"], self.last_id))
 
-		return options["uuid"]
+		return self.last_id
 
-	def destroy(self, uuid_nr):
-		for timer in self.timers:
-			if timer["uuid"] == uuid_nr:
-				self.timers.remove(timer)
-				return
+	def destroy(self, timer_id):
+		""" Remove timer. Unknown ids are ignored """
+		if self.timers.pop(timer_id, None) == None:
+			return
+
+		# too many dead entries in heap, rebuild it
+		if len(self.queue) > 2 * len(self.timers) + 64:
+			self.queue[:] = [(timer["due"], i) for i, timer in self.timers.items()]
+			heapq.heapify(self.queue)
+
+	def clear(self):
+		""" Remove all timers """
+		self.timers.clear()
+		del self.queue[:]
+
+	def pending(self):
+		""" @return int Number of active timers """
+		return len(self.timers)
+
+	def getState(self, refs):
+		""" Timers as plain data for snapshot: callback is saved as reference to the
+		object it's bound to and method name. Timers of objects no longer in game
+		are left out, all they would do is remove themselves
+		@param dict refs Object => reference, see Game.getSnapshot()
+		@return dict
+		"""
+
+		timers = []
+		for timer_id in sorted(self.timers):
+			timer = self.timers[timer_id]
+
+			target = refs.get(getattr(timer["callback"], "__self__", None))
+			args = []
+			for arg in timer["args"]:
+				if isinstance(arg, (bool, int)):
+					args.append(arg)
+				elif arg in refs:
+					args.append({"ref" : refs[arg]})
+				else:
+					target = None
+
+			if target != None:
+				timers.append([timer_id, timer["due"], timer["interval"], timer["repeat"], timer["times"], target, timer["callback"].__name__, args])
+
+		return {"time" : self.time, "last_id" : self.last_id, "timers" : timers}
+
+	def setState(self, state, objects):
+		""" Replace all timers with those saved by getState()
+		@param dict state
+		@param dict objects Objects of restored snapshot, see getObject()
+		@return None
+		"""
+
+		self.time = state["time"]
+		self.last_id = state["last_id"]
+
+		self.timers.clear()
+		for timer_id, due, interval, repeat, times, target, name, args in state["timers"]:
+			self.timers[timer_id] = {
+				"interval"	: interval,
+				"callback"	: getattr(getObject(objects, target), name),
+				"args"			: tuple([getObject(objects, arg["ref"]) if isinstance(arg, dict) else arg for arg in args]),
+				"repeat"		: repeat,
+				"times"			: times,
+				"due"				: due
+			}
+
+		self.queue[:] = [(timer["due"], i) for i, timer in self.timers.items()]
+		heapq.heapify(self.queue)
 
 	def update(self, time_passed):
-		for timer in self.timers:
-			timer["time"] += time_passed
-			if timer["time"] > timer["interval"]:
-				timer["time"] -= timer["interval"]
-				timer["times"] += 1
-				if timer["repeat"] > -1 and timer["times"] == timer["repeat"]:
-					self.timers.remove(timer)
-				try:
-					timer["callback"]()
-				except:
-					try:
-						self.timers.remove(timer)
-					except:
-						pass
-
-class Castle():
+		self.time += time_passed
+		self.fired = 0
+
+		queue = self.queue
+		while queue and queue[0][0] < self.time:
+			due, timer_id = heapq.heappop(queue)
+			timer = self.timers.get(timer_id)
+			if timer == None or timer["due"] != due:
+				continue
+
+			timer["times"] += 1
+			if timer["repeat"] > -1 and timer["times"] == timer["repeat"]:
+				del self.timers[timer_id]
+			elif timer["interval"] > 0:
+				timer["due"] += timer["interval"]
+				heapq.heappush(queue, (timer["due"], timer_id))
+			else:
+				# without interval timer would be due again right away, so it waits
+				# for next update
+				timer["due"] = self.time
+				heapq.heappush(queue, (timer["due"], timer_id))
+
+			self.fired += 1
+			try:
+				timer["callback"](*timer["args"])
+			except:
+				self.destroy(timer_id)
+
+class SpatialHash(object):
+	""" Uniform grid of moving objects (tanks, bullets, bonuses)
+	Each object is kept in every cell its rect overlaps, so finding objects that
+	might collide with a rect only looks at a few cells nearby instead of every
+	object on the map. Objects must have a rect attribute and have to be
+	re-indexed with update() whenever their rect changes.
+
+	Gathering cells and sorting what's found costs more than it saves while there
+	are only a few objects of a kind, as during a game (up to about 30 objects),
+	so those are scanned in order instead, see SCAN_LIMIT
+	"""
+
+	# kinds with at most this many objects are scanned instead of looked up in
+	# cells, see benchmarks/collisions.py
+	SCAN_LIMIT = 64
+
+	def __init__(self, cell_size = 32):
+
+		self.cell_size = cell_size
+
+		# (column, row) => set of objects
+		self.cells = {}
+
+		# object => (first column, first row, last column, last row) it's in
+		self.places = {}
+
+		# object => order in which objects were added. queries return objects in
+		# this order, same as they are in players/enemies/bullets/bonuses lists
+		self.order = {}
+		self.last_order = 0
+
+		# class => objects of it in order they were added, as dict keys
+		self.kinds = {}
+
+	def getPlace(self, rect):
+		size = self.cell_size
+		return (rect.left // size, rect.top // size, (rect.right - 1) // size, (rect.bottom - 1) // size)
+
+	def add(self, obj):
+		""" Start tracking object """
+		self.last_order += 1
+		self.order[obj] = self.last_order
+		self.kinds.setdefault(obj.__class__, {})[obj] = None
+		self.places[obj] = None
+		self.update(obj)
+
+	def remove(self, obj):
+		""" Stop tracking object. Unknown objects are ignored """
+		if obj not in self.places:
+			return
+		self.setPlace(obj, None)
+		del self.places[obj]
+		del self.order[obj]
+		del self.kinds[obj.__class__][obj]
+
+	def update(self, obj):
+		""" Re-index object after its rect has changed. Unknown objects are ignored """
+		if obj not in self.places:
+			return
+		place = self.getPlace(obj.rect)
+		if place != self.places[obj]:
+			self.setPlace(obj, place)
+
+	def setPlace(self, obj, place):
+		""" Move object from cells it's in to cells of place """
+
+		old_place = self.places[obj]
+		if old_place != None:
+			for x in range(old_place[0], old_place[2] + 1):
+				for y in range(old_place[1], old_place[3] + 1):
+					cell = self.cells[(x, y)]
+					cell.discard(obj)
+					if len(cell) == 0:
+						del self.cells[(x, y)]
+
+		if place != None:
+			for x in range(place[0], place[2] + 1):
+				for y in range(place[1], place[3] + 1):
+					if (x, y) in self.cells:
+						self.cells[(x, y)].add(obj)
+					else:
+						self.cells[(x, y)] = set([obj])
+
+		self.places[obj] = place
+
+	def query(self, rect, kind = None):
+		""" Find objects that share cells with rect
+		This is broadphase only, caller still has to check if rects really collide
+		@param pygame.Rect rect
+		@param class kind If set, only return objects of this class (not of its
+			subclasses)
+		@return list Objects in order they were added
+		"""
+
+		x1, y1, x2, y2 = self.getPlace(rect)
+
+		objects = self.places if kind == None else self.kinds.get(kind, ())
+
+		if len(objects) <= self.SCAN_LIMIT:
+			places = self.places
+			found = []
+			for obj in objects:
+				place = places[obj]
+				if place[0] <= x2 and place[2] >= x1 and place[1] <= y2 and place[3] >= y1:
+					found.append(obj)
+			return found
+
+		found = set()
+		for x in range(x1, x2 + 1):
+			for y in range(y1, y2 + 1):
+				cell = self.cells.get((x, y))
+				if cell:
+					found.update(cell)
+
+		if kind != None:
+			found = [obj for obj in found if obj.__class__ is kind]
+
+		return sorted(found, key = self.order.get)
+
+class FlowField(object):
+	""" Distance from tank positions to castle, shared by all hunting enemies
+	Tank positions are taken every 8px (node), for each node distance to nearest
+	spot castle can be shot from is kept, together with direction to go from
+	there. Bricks can be shot through, so nodes overlapping bricks are passable,
+	but cost more. When level's tiles change, only nodes around them and those
+	whose route went through them are recalculated.
+	"""
+
+	# px between nodes
+	STEP = 8
+
+	# nodes along each axis, so 26px tank still fits in 416px map
+	SIZE = (416 - 26) // STEP + 1
+
+	# cost of entering node, see getCost()
+	(COST_BLOCKED, COST_FREE, COST_BRICK) = (0, 1, 6)
+
+	INFINITY = 0x7fffffff
+
+	# px offset of each direction (up, right, down, left)
+	OFFSETS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+	def __init__(self, level):
+
+		world = level.world
+
+		self.level = level
+
+		nodes = self.SIZE * self.SIZE
+
+		# cost of entering each node, index is y * SIZE + x
+		self.costs = array("B", [self.COST_BLOCKED] * nodes)
+
+		# cost of reaching castle from each node
+		self.distances = array("i", [self.INFINITY] * nodes)
+
+		# direction to go from each node, -1 if castle can't be reached
+		self.directions = array("b", [-1] * nodes)
+
+		# node => direction to castle, for nodes castle can be shot from
+		self.goals = {}
+
+		for i in range(nodes):
+			self.costs[i] = self.getCost(i)
+
+			rect = self.getRect(i)
+			for direction, (dx, dy) in enumerate(self.OFFSETS):
+				if rect.colliderect(world.castle.rect) or not rect.move(dx * self.STEP, dy * self.STEP).colliderect(world.castle.rect):
+					continue
+				# bullet flies from tank's center
+				line = pygame.Rect(rect.center, (1, 1)).union(pygame.Rect(rect.centerx + dx * 416, rect.centery + dy * 416, 1, 1))
+				if line.colliderect(world.castle.rect):
+					self.goals[i] = direction
+
+		self.repair(range(nodes), [])
+
+	def getState(self):
+		""" @return dict Costs, distances and routes for snapshot, see Level.getState()
+		Routes are saved rather than found again, as where two are equally short the
+		one taken depends on order tiles changed in
+		"""
+		return {
+			"costs" : self.costs.tolist(),
+			"distances" : self.distances.tolist(),
+			"directions" : self.directions.tolist(),
+			"goals" : sorted(self.goals.items())
+		}
+
+	def setState(self, state, level):
+		""" Set up flow field created without __init__() from getState() data """
+		self.level = level
+		self.costs = array("B", state["costs"])
+		self.distances = array("i", state["distances"])
+		self.directions = array("b", state["directions"])
+		self.goals = dict([(i, direction) for i, direction in state["goals"]])
+
+	def getRect(self, i):
+		return pygame.Rect((i % self.SIZE) * self.STEP, (i // self.SIZE) * self.STEP, 26, 26)
+
+	def getNode(self, rect):
+		""" Node nearest to rect's position """
+		x = min(max((rect.left + self.STEP // 2) // self.STEP, 0), self.SIZE - 1)
+		y = min(max((rect.top + self.STEP // 2) // self.STEP, 0), self.SIZE - 1)
+		return y * self.SIZE + x
+
+	def getNeighbour(self, i, direction):
+		""" @return int Node next to i in given direction, None if it's off map """
+		x = i % self.SIZE + self.OFFSETS[direction][0]
+		y = i // self.SIZE + self.OFFSETS[direction][1]
+		if x < 0 or y < 0 or x >= self.SIZE or y >= self.SIZE:
+			return None
+		return y * self.SIZE + x
+
+	def getCost(self, i):
+		""" Cost of tank entering node, according to tiles it would overlap """
+
+		world = self.level.world
+
+		rect = self.getRect(i)
+		if not self.level.hitsObstacle(rect):
+			return self.COST_FREE
+		if rect.colliderect(world.castle.rect) or self.level.getTilesAt(rect, (self.level.TILE_STEEL, self.level.TILE_WATER)):
+			return self.COST_BLOCKED
+		return self.COST_BRICK
+
+	def tileChanged(self, x, y):
+		""" Update costs of nodes overlapping map cell and repair routes
+		@param int x Cell's column
+		@param int y Cell's row
+		@return None
+		"""
+
+		size = self.level.TILE_SIZE
+
+		# nodes whose tank rect overlaps the cell
+		x1 = max(-((26 - 1 - x * size) // self.STEP), 0)
+		x2 = min((x * size + size - 1) // self.STEP, self.SIZE - 1)
+		y1 = max(-((26 - 1 - y * size) // self.STEP), 0)
+		y2 = min((y * size + size - 1) // self.STEP, self.SIZE - 1)
+
+		increased = []
+		changed = []
+		for ny in range(y1, y2 + 1):
+			for nx in range(x1, x2 + 1):
+				i = ny * self.SIZE + nx
+				cost = self.getCost(i)
+				old_cost = self.costs[i]
+				if cost == old_cost:
+					continue
+				self.costs[i] = cost
+				changed.append(i)
+				if cost == self.COST_BLOCKED or (old_cost != self.COST_BLOCKED and cost > old_cost):
+					increased.append(i)
+
+		if changed:
+			self.repair(changed, increased)
+
+	def repair(self, changed, increased):
+		""" Recalculate distances after costs of nodes changed
+		Routes entering nodes that got more expensive (and blocked nodes themselves)
+		are dropped, then distances spread again from nodes around them, like in
+		Dijkstra's algorithm
+		@param list changed Nodes whose cost changed
+		@param list increased Nodes which got more expensive or blocked
+		@return None
+		"""
+
+		# drop routes which went through nodes that got worse
+		invalid = set()
+		stack = []
+		for i in increased:
+			if self.costs[i] == self.COST_BLOCKED:
+				stack.append(i)
+			for direction in range(4):
+				n = self.getNeighbour(i, direction)
+				if n != None and n not in self.goals and self.directions[n] == direction ^ 2:
+					stack.append(n)
+		while stack:
+			i = stack.pop()
+			if i in invalid:
+				continue
+			invalid.add(i)
+			self.distances[i] = self.INFINITY
+			self.directions[i] = -1
+			for direction in range(4):
+				n = self.getNeighbour(i, direction)
+				if n != None and n not in invalid and n not in self.goals and self.directions[n] == direction ^ 2:
+					stack.append(n)
+
+		# nodes which may now have shorter route: dropped and changed ones and
+		# those next to changed ones
+		seeds = set(invalid)
+		for i in changed:
+			seeds.add(i)
+			for direction in range(4):
+				n = self.getNeighbour(i, direction)
+				if n != None:
+					seeds.add(n)
+
+		queue = []
+		for i in seeds:
+			if self.costs[i] == self.COST_BLOCKED:
+				self.distances[i] = self.INFINITY
+				self.directions[i] = -1
+				continue
+
+			if i in self.goals:
+				self.distances[i] = 0
+				self.directions[i] = self.goals[i]
+				heapq.heappush(queue, (0, i))
+				continue
+
+			for direction in range(4):
+				n = self.getNeighbour(i, direction)
+				if n == None or self.costs[n] == self.COST_BLOCKED or self.distances[n] == self.INFINITY:
+					continue
+				distance = self.distances[n] + self.costs[n]
+				if distance < self.distances[i]:
+					self.distances[i] = distance
+					self.directions[i] = direction
+			if self.distances[i] != self.INFINITY:
+				heapq.heappush(queue, (self.distances[i], i))
+
+		# spread distances
+		while queue:
+			distance, i = heapq.heappop(queue)
+			if distance > self.distances[i]:
+				continue
+			distance += self.costs[i]
+			for direction in range(4):
+				n = self.getNeighbour(i, direction)
+				if n == None or n in self.goals or self.costs[n] == self.COST_BLOCKED:
+					continue
+				if distance < self.distances[n]:
+					self.distances[n] = distance
+					self.directions[n] = direction ^ 2
+					heapq.heappush(queue, (distance, n))
+
+class Atlas():
+	""" Images cut out of sprites, shared by all game objects
+	Built once, right after sprites are loaded. Every image is a converted copy in
+	display's pixel format and tank and bullet images are pre-rotated to all four
+	directions, so spawning tanks and firing bullets doesn't create any surfaces
+	"""
+
+	# color of transparent pixels, not used in sprites
+	KEY = AssetCache.KEY
+
+	def __init__(self, sprites):
+
+		self.sprites = sprites
+
+		# rect => image or list of its rotations
+		self.cache = {}
+
+		self.castle = [
+			self.image((0, 15*2, 16*2, 16*2)),
+			self.image((16*2, 15*2, 16*2, 16*2))
+		]
+
+		self.bonuses = [self.image((16*2*i, 32*2, 16*2, 15*2)) for i in range(6)]
+
+		self.bullet = self.rotations((75*2, 74*2, 3*2, 4*2))
+
+		self.explosion = [
+			self.image((0, 80*2, 32*2, 32*2)),
+			self.image((32*2, 80*2, 32*2, 32*2)),
+			self.image((64*2, 80*2, 32*2, 32*2))
+		]
+
+		# bullets explode without the last, biggest frame
+		self.bullet_explosion = self.explosion[:2]
+
+		self.shield = [
+			self.image((0, 48*2, 16*2, 16*2)),
+			self.image((16*2, 48*2, 16*2, 16*2))
+		]
+
+		self.spawn = [
+			self.image((32*2, 48*2, 16*2, 16*2)),
+			self.image((48*2, 48*2, 16*2, 16*2))
+		]
+
+		# enemy tanks by type: regular and bonus carrier (flashing) images
+		self.enemies = [
+			[self.rotations((32*2+16*2*i, 0, 13*2, 15*2)), self.rotations((32*2+16*2*i, 16*2, 13*2, 15*2))]
+			for i in range(4)
+		]
+
+	def image(self, rect):
+		""" Get image from sprites
+		@param tuple rect x, y, width, height in sprites
+		@return pygame.Surface
+		"""
+		rect = tuple(rect)
+		if rect not in self.cache:
+			# sprites are paletted and transparent pixels are told apart from white
+			# ones by palette index, which is lost when converting to display's
+			# format. paint them with a color of our own instead
+			image = pygame.Surface(rect[2:]).convert()
+			image.fill(self.KEY)
+			image.blit(self.sprites.subsurface(rect), (0, 0))
+			image.set_colorkey(self.KEY)
+			self.cache[rect] = image
+		return self.cache[rect]
+
+	def rotations(self, rect):
+		""" Get image from sprites, rotated to all directions
+		@param tuple rect x, y, width, height in sprites of the upwards facing image
+		@return list Images facing up, right, down and left
+		"""
+		key = ("rotations",) + tuple(rect)
+		if key not in self.cache:
+			image = self.image(rect)
+			self.cache[key] = [
+				image,
+				pygame.transform.rotate(image, 270).convert(),
+				pygame.transform.rotate(image, 180).convert(),
+				pygame.transform.rotate(image, 90).convert()
+			]
+		return self.cache[key]
+
+class Castle(object):
 	""" Player's castle/fortress """
 
 	(STATE_STANDING, STATE_DESTROYED, STATE_EXPLODING) = range(3)
 
-	def __init__(self):
+	def __init__(self, world):
 
-		global sprites
+		self.world = world
 
 		# images
-		self.img_undamaged = sprites.subsurface(0, 15*2, 16*2, 16*2)
-		self.img_destroyed = sprites.subsurface(16*2, 15*2, 16*2, 16*2)
+		self.img_undamaged = world.atlas.castle[0]
+		self.img_destroyed = world.atlas.castle[1]
 
 		# init position
 		self.rect = pygame.Rect(12*16, 24*16, 32, 32)
@@ -68,17 +646,21 @@ class Castle():
 		self.rebuild()
 
 	def draw(self):
-		""" Draw castle """
-		global screen
+		""" Draw castle
+		@return pygame.Rect Area of screen drawn over
+		"""
+		world = self.world
 
-		screen.blit(self.image, self.rect.topleft)
+		rect = world.screen.blit(self.image, self.rect.topleft)
 
 		if self.state == self.STATE_EXPLODING:
 			if not self.explosion.active:
 				self.state = self.STATE_DESTROYED
 				del self.explosion
 			else:
-				self.explosion.draw()
+				rect = rect.union(self.explosion.draw())
+
+		return rect
 
 	def rebuild(self):
 		""" Reset castle """
@@ -89,11 +671,31 @@ class Castle():
 	def destroy(self):
 		""" Destroy castle """
 		self.state = self.STATE_EXPLODING
-		self.explosion = Explosion(self.rect.topleft)
+		self.explosion = Explosion(self.world, self.rect.topleft)
 		self.image = self.img_destroyed
 		self.active = False
 
-class Bonus():
+	def getState(self, refs):
+		""" @return dict Castle's state for snapshot, see Game.getSnapshot() """
+		return {"state" : self.state, "active" : self.active, "explosion" : refs.get(getattr(self, "explosion", None))}
+
+	def setState(self, state, objects):
+		""" Restore state saved by getState() """
+
+		self.state = state["state"]
+		self.active = state["active"]
+
+		if self.state == self.STATE_STANDING:
+			self.image = self.img_undamaged
+		else:
+			self.image = self.img_destroyed
+
+		if state["explosion"] != None:
+			self.explosion = getObject(objects, state["explosion"])
+		elif hasattr(self, "explosion"):
+			del self.explosion
+
+class Bonus(object):
 	""" Various power-ups
 	When bonus is spawned, it begins flashing and after some time dissapears
 
@@ -109,9 +711,9 @@ class Bonus():
 	# bonus types
 	(BONUS_GRENADE, BONUS_HELMET, BONUS_SHOVEL, BONUS_STAR, BONUS_TANK, BONUS_TIMER) = range(6)
 
-	def __init__(self, level):
+	def __init__(self, world, level):
 
-		global sprites
+		self.world = world
 
 		# to know where to place
 		self.level = level
@@ -122,9 +724,9 @@ class Bonus():
 		# blinking state
 		self.visible = True
 
-		self.rect = pygame.Rect(random.randint(0, 416-32), random.randint(0, 416-32), 32, 32)
+		self.rect = pygame.Rect(world.rng.randint(0, 416-32), world.rng.randint(0, 416-32), 32, 32)
 
-		self.bonus = random.choice([
+		self.bonus = world.rng.choice([
 			self.BONUS_GRENADE,
 			self.BONUS_HELMET,
 			self.BONUS_SHOVEL,
@@ -133,20 +735,41 @@ class Bonus():
 			self.BONUS_TIMER
 		])
 
-		self.image = sprites.subsurface(16*2*self.bonus, 32*2, 16*2, 15*2)
+		self.image = world.atlas.bonuses[self.bonus]
 
 	def draw(self):
-		""" draw bonus """
-		global screen
+		""" draw bonus
+		@return pygame.Rect Area of screen drawn over, None if invisible
+		"""
+		world = self.world
 		if self.visible:
-			screen.blit(self.image, self.rect.topleft)
+			return world.screen.blit(self.image, self.rect.topleft)
 
 	def toggleVisibility(self):
 		""" Toggle bonus visibility """
 		self.visible = not self.visible
 
+	# attributes saved in snapshots as they are, see getState()
+	SNAPSHOT_FIELDS = ("active", "visible", "bonus")
+
+	def getState(self, refs):
+		""" @return dict Bonus' state for snapshot, see Game.getSnapshot() """
+		state = getFields(self, self.SNAPSHOT_FIELDS)
+		state["rect"] = tuple(self.rect)
+		return state
+
+	def setState(self, state, objects, level):
+		""" Set up bonus created without __init__() from getState() data """
 
-class Bullet():
+		world = self.world
+
+		setFields(self, state, self.SNAPSHOT_FIELDS)
+		self.level = level
+		self.rect = pygame.Rect(state["rect"])
+		self.image = world.atlas.bonuses[self.bonus]
+
+
+class Bullet(object):
 	# direction constants
 	(DIR_UP, DIR_RIGHT, DIR_DOWN, DIR_LEFT) = range(4)
 
@@ -155,9 +778,9 @@ class Bullet():
 
 	(OWNER_PLAYER, OWNER_ENEMY) = range(2)
 
-	def __init__(self, level, position, direction, damage = 100, speed = 5):
+	def __init__(self, world, level, position, direction, damage = 100, speed = 5):
 
-		global sprites
+		self.world = world
 
 		self.level = level
 		self.direction = direction
@@ -169,41 +792,41 @@ class Bullet():
 		# 2-can destroy steel
 		self.power = 1
 
-		self.image = sprites.subsurface(75*2, 74*2, 3*2, 4*2)
+		self.image = world.atlas.bullet[direction]
 
 		# position is player's top left corner, so we'll need to
-		# recalculate a bit. also rotate image itself.
+		# recalculate a bit
 		if direction == self.DIR_UP:
 			self.rect = pygame.Rect(position[0] + 11, position[1] - 8, 6, 8)
 		elif direction == self.DIR_RIGHT:
-			self.image = pygame.transform.rotate(self.image, 270)
 			self.rect = pygame.Rect(position[0] + 26, position[1] + 11, 8, 6)
 		elif direction == self.DIR_DOWN:
-			self.image = pygame.transform.rotate(self.image, 180)
 			self.rect = pygame.Rect(position[0] + 11, position[1] + 26, 6, 8)
 		elif direction == self.DIR_LEFT:
-			self.image = pygame.transform.rotate(self.image, 90)
 			self.rect = pygame.Rect(position[0] - 8 , position[1] + 11, 8, 6)
 
-		self.explosion_images = [
-			sprites.subsurface(0, 80*2, 32*2, 32*2),
-			sprites.subsurface(32*2, 80*2, 32*2, 32*2),
-		]
+		self.explosion_images = world.atlas.bullet_explosion
 
 		self.speed = speed
 
 		self.state = self.STATE_ACTIVE
 
-	def draw(self):
-		""" draw bullet """
-		global screen
+		# position after previous tick, see Game.storePositions()
+		self.last_position = None
+
+	def draw(self, alpha = 1.0):
+		""" draw bullet
+		@param float alpha How far between previous and current tick to draw
+		@return pygame.Rect Area of screen drawn over, None if nothing was drawn
+		"""
+		world = self.world
 		if self.state == self.STATE_ACTIVE:
-			screen.blit(self.image, self.rect.topleft)
+			return world.screen.blit(self.image, interpolate(self.last_position, self.rect.topleft, alpha))
 		elif self.state == self.STATE_EXPLODING:
-			self.explosion.draw()
+			return self.explosion.draw()
 
 	def update(self):
-		global castle, players, enemies, bullets
+		world = self.world
 
 		if self.state == self.STATE_EXPLODING:
 			if not self.explosion.active:
@@ -216,30 +839,34 @@ class Bullet():
 		""" move bullet """
 		if self.direction == self.DIR_UP:
 			self.rect.topleft = [self.rect.left, self.rect.top - self.speed]
+			self.level.spatial.update(self)
 			if self.rect.top < 0:
-				if play_sounds and self.owner == self.OWNER_PLAYER:
-					sounds["steel"].play()
+				if world.play_sounds and self.owner == self.OWNER_PLAYER:
+					world.sounds["steel"].play()
 				self.explode()
 				return
 		elif self.direction == self.DIR_RIGHT:
 			self.rect.topleft = [self.rect.left + self.speed, self.rect.top]
+			self.level.spatial.update(self)
 			if self.rect.left > (416 - self.rect.width):
-				if play_sounds and self.owner == self.OWNER_PLAYER:
-					sounds["steel"].play()
+				if world.play_sounds and self.owner == self.OWNER_PLAYER:
+					world.sounds["steel"].play()
 				self.explode()
 				return
 		elif self.direction == self.DIR_DOWN:
 			self.rect.topleft = [self.rect.left, self.rect.top + self.speed]
+			self.level.spatial.update(self)
 			if self.rect.top > (416 - self.rect.height):
-				if play_sounds and self.owner == self.OWNER_PLAYER:
-					sounds["steel"].play()
+				if world.play_sounds and self.owner == self.OWNER_PLAYER:
+					world.sounds["steel"].play()
 				self.explode()
 				return
 		elif self.direction == self.DIR_LEFT:
 			self.rect.topleft = [self.rect.left - self.speed, self.rect.top]
+			self.level.spatial.update(self)
 			if self.rect.left < 0:
-				if play_sounds and self.owner == self.OWNER_PLAYER:
-					sounds["steel"].play()
+				if world.play_sounds and self.owner == self.OWNER_PLAYER:
+					world.sounds["steel"].play()
 				self.explode()
 				return
 
@@ -247,56 +874,83 @@ class Bullet():
 
 		# check for collisions with walls. one bullet can destroy several (1 or 2)
 		# tiles but explosion remains 1
-		rects = self.level.obstacle_rects
-		collisions = self.rect.collidelistall(rects)
-		if collisions != []:
-			for i in collisions:
-				if self.level.hitTile(rects[i].topleft, self.power, self.owner == self.OWNER_PLAYER):
-					has_collided = True
+		for pos in self.level.getTilesAt(self.rect, (self.level.TILE_BRICK, self.level.TILE_STEEL)):
+			if self.level.hitTile(pos, self.power, self.owner == self.OWNER_PLAYER):
+				has_collided = True
 		if has_collided:
 			self.explode()
 			return
 
 		# check for collisions with other bullets
-		for bullet in bullets:
+		for bullet in self.level.spatial.query(self.rect, Bullet):
 			if self.state == self.STATE_ACTIVE and bullet.owner != self.owner and bullet != self and self.rect.colliderect(bullet.rect):
 				self.destroy()
 				self.explode()
 				return
 
 		# check for collisions with players
-		for player in players:
+		for player in self.level.spatial.query(self.rect, Player):
 			if player.state == player.STATE_ALIVE and self.rect.colliderect(player.rect):
 				if player.bulletImpact(self.owner == self.OWNER_PLAYER, self.damage, self.owner_class):
 					self.destroy()
 					return
 
 		# check for collisions with enemies
-		for enemy in enemies:
+		for enemy in self.level.spatial.query(self.rect, Enemy):
 			if enemy.state == enemy.STATE_ALIVE and self.rect.colliderect(enemy.rect):
 				if enemy.bulletImpact(self.owner == self.OWNER_ENEMY, self.damage, self.owner_class):
 					self.destroy()
 					return
 
 		# check for collision with castle
-		if castle.active and self.rect.colliderect(castle.rect):
-			castle.destroy()
+		if world.castle.active and self.rect.colliderect(world.castle.rect):
+			world.castle.destroy()
 			self.destroy()
 			return
 
 	def explode(self):
 		""" start bullets's explosion """
-		global screen
 		if self.state != self.STATE_REMOVED:
 			self.state = self.STATE_EXPLODING
-			self.explosion = Explosion([self.rect.left-13, self.rect.top-13], None, self.explosion_images)
+			self.explosion = Explosion(self.world, [self.rect.left-13, self.rect.top-13], None, self.explosion_images)
 
 	def destroy(self):
 		self.state = self.STATE_REMOVED
 
+	# attributes saved in snapshots as they are, see getState()
+	SNAPSHOT_FIELDS = ("direction", "damage", "owner", "power", "speed", "state", "last_position")
+
+	def getState(self, refs):
+		""" @return dict Bullet's state for snapshot, see Game.getSnapshot() """
+		state = getFields(self, self.SNAPSHOT_FIELDS)
+		state["rect"] = tuple(self.rect)
+		state["owner_class"] = refs.get(self.owner_class)
+		state["explosion"] = refs.get(getattr(self, "explosion", None))
+		return state
+
+	def setState(self, state, objects, level):
+		""" Set up bullet created without __init__() from getState() data """
+
+		world = self.world
+
+		setFields(self, state, self.SNAPSHOT_FIELDS)
+		self.level = level
+		self.rect = pygame.Rect(state["rect"])
+		self.owner_class = getObject(objects, state["owner_class"])
+		if state["explosion"] != None:
+			self.explosion = getObject(objects, state["explosion"])
+		self.image = world.atlas.bullet[self.direction]
+		self.explosion_images = world.atlas.bullet_explosion
+
+
+class Label(object):
+
+	# font of all labels, loaded when first needed. SysFont() is slow
+	font = None
+
+	def __init__(self, world, position, text = "", duration = None):
 
-class Label():
-	def __init__(self, position, text = "", duration = None):
+		self.world = world
 
 		self.position = position
 
@@ -304,24 +958,40 @@ class Label():
 
 		self.text = text
 
-		self.font = pygame.font.SysFont("Arial", 13)
+		if Label.font == None:
+			Label.font = pygame.font.SysFont("Arial", 13)
 
 		if duration != None:
-			gtimer.add(duration, lambda :self.destroy(), 1)
+			self.world.timer.add(duration, self.destroy, 1)
 
 	def draw(self):
-		""" draw label """
-		global screen
-		screen.blit(self.font.render(self.text, False, (200,200,200)), [self.position[0]+4, self.position[1]+8])
+		""" draw label
+		@return pygame.Rect Area of screen drawn over
+		"""
+		world = self.world
+		return world.screen.blit(self.font.render(self.text, False, (200,200,200)), [self.position[0]+4, self.position[1]+8])
 
 	def destroy(self):
 		self.active = False
 
+	# attributes saved in snapshots as they are, see getState()
+	SNAPSHOT_FIELDS = ("position", "active", "text")
+
+	def getState(self, refs):
+		""" @return dict Label's state for snapshot, see Game.getSnapshot() """
+		return getFields(self, self.SNAPSHOT_FIELDS)
+
+	def setState(self, state, objects, level):
+		""" Set up label created without __init__() from getState() data """
+		setFields(self, state, self.SNAPSHOT_FIELDS)
+		if Label.font == None:
+			Label.font = pygame.font.SysFont("Arial", 13)
 
-class Explosion():
-	def __init__(self, position, interval = None, images = None):
 
-		global sprites
+class Explosion(object):
+	def __init__(self, world, position, interval = None, images = None):
+
+		self.world = world
 
 		self.position = [position[0]-16, position[1]-16]
 		self.active = True
@@ -330,24 +1000,24 @@ class Explosion():
 			interval = 100
 
 		if images == None:
-			images = [
-				sprites.subsurface(0, 80*2, 32*2, 32*2),
-				sprites.subsurface(32*2, 80*2, 32*2, 32*2),
-				sprites.subsurface(64*2, 80*2, 32*2, 32*2)
-			]
+			images = world.atlas.explosion
 
-		images.reverse()
+		# all frames, to tell which ones these are in snapshots
+		self.frames = images
 
-		self.images = [] + images
+		# frames are popped from the end. images are shared, so don't touch them
+		self.images = images[::-1]
 
 		self.image = self.images.pop()
 
-		gtimer.add(interval, lambda :self.update(), len(self.images) + 1)
+		world.timer.add(interval, self.update, len(self.images) + 1)
 
 	def draw(self):
-		global screen
-		""" draw current explosion frame """
-		screen.blit(self.image, self.position)
+		""" draw current explosion frame
+		@return pygame.Rect Area of screen drawn over
+		"""
+		world = self.world
+		return world.screen.blit(self.image, self.position)
 
 	def update(self):
 		""" Advace to the next image """
@@ -356,32 +1026,114 @@ class Explosion():
 		else:
 			self.active = False
 
-class Level():
+	# Atlas attributes explosion frames can come from
+	FRAMES = ("explosion", "bullet_explosion")
+
+	def getState(self):
+		""" @return dict Explosion's state for snapshot, see Game.getSnapshot() """
+
+		world = self.world
+
+		for name in self.FRAMES:
+			if getattr(world.atlas, name) is self.frames:
+				break
+
+		return {"position" : list(self.position), "active" : self.active, "frames" : name, "left" : len(self.images)}
+
+	def setState(self, state):
+		""" Set up explosion created without __init__() from getState() data """
+
+		world = self.world
+
+		self.position = list(state["position"])
+		self.active = state["active"]
+		self.frames = getattr(world.atlas, state["frames"])
+
+		left = state["left"]
+		self.images = self.frames[::-1][:left]
+		self.image = self.frames[len(self.frames) - left - 1]
+
+class Level(object):
 
 	# tile constants
 	(TILE_EMPTY, TILE_BRICK, TILE_STEEL, TILE_WATER, TILE_GRASS, TILE_FROZE) = range(6)
 
+	# tiles that stop tanks
+	OBSTACLE_TILES = (TILE_BRICK, TILE_STEEL, TILE_WATER)
+
 	# tile width/height in px
 	TILE_SIZE = 16
 
-	def __init__(self, level_nr = None):
+	# map width/height in tiles
+	GRID_SIZE = 26
+
+	# transparent color of grass layer
+	GRASS_KEY = (255, 0, 255)
+
+	# characters in level files
+	TILE_CHARS = {
+		"#" : TILE_BRICK,
+		"@" : TILE_STEEL,
+		"~" : TILE_WATER,
+		"%" : TILE_GRASS,
+		"-" : TILE_FROZE
+	}
+
+	# number of enemies by types (basic, fast, power, armor) according to level
+	LEVELS_ENEMIES = (
+		(18,2,0,0), (14,4,0,2), (14,4,0,2), (2,5,10,3), (8,5,5,2),
+		(9,2,7,2), (7,4,6,3), (7,4,7,2), (6,4,7,3), (12,2,4,2),
+		(5,5,4,6), (0,6,8,6), (0,8,8,4), (0,4,10,6), (0,2,10,8),
+		(16,2,0,2), (8,2,8,2), (2,8,6,4), (4,4,4,8), (2,8,2,8),
+		(6,2,8,4), (6,8,2,4), (0,10,4,6), (10,4,4,2), (0,8,2,10),
+		(4,6,4,6), (2,8,2,8), (15,2,2,1), (0,4,10,6), (4,8,4,4),
+		(3,8,3,6), (6,4,2,8), (4,4,4,8), (0,10,4,6), (0,6,4,10)
+	)
+
+	def __init__(self, world, level_nr = None, pack = None):
 		""" There are total 35 different levels. If level_nr is larger than 35, loop over
-		to next according level so, for example, if level_nr ir 37, then load level 2 """
+		to next according level so, for example, if level_nr ir 37, then load level 2
+		@param World world
+		@param int level_nr Stage number, starting from 1
+		@param LevelPack pack Take levels from this pack instead of levels/ directory.
+			Number of levels is then the number of levels in pack
+		"""
 
-		global sprites
+		self.world = world
 
 		# max number of enemies simultaneously  being on map
 		self.max_active_enemies = 4
 
+		self.loadTileImages()
+
+		# tile type of every map cell, row by row. index is y * GRID_SIZE + x
+		self.grid = array("B", [self.TILE_EMPTY] * (self.GRID_SIZE * self.GRID_SIZE))
+
+		self.resetIndexes()
+
+		tiles, self.enemies_by_type = self.getStage(1 if level_nr == None else level_nr, pack)
+		if tiles != None:
+			self.grid[:] = array("B", tiles)
+
+		# update these tiles
+		self.updateObstacleRows()
+
+		self.world.timer.add(400, self.toggleWaves)
+
+	def loadTileImages(self):
+		""" Take tile images from atlas """
+
+		world = self.world
+
 		tile_images = [
 			pygame.Surface((8*2, 8*2)),
-			sprites.subsurface(48*2, 64*2, 8*2, 8*2),
-			sprites.subsurface(48*2, 72*2, 8*2, 8*2),
-			sprites.subsurface(56*2, 72*2, 8*2, 8*2),
-			sprites.subsurface(64*2, 64*2, 8*2, 8*2),
-			sprites.subsurface(64*2, 64*2, 8*2, 8*2),
-			sprites.subsurface(72*2, 64*2, 8*2, 8*2),
-			sprites.subsurface(64*2, 72*2, 8*2, 8*2)
+			world.atlas.image((48*2, 64*2, 8*2, 8*2)),
+			world.atlas.image((48*2, 72*2, 8*2, 8*2)),
+			world.atlas.image((56*2, 72*2, 8*2, 8*2)),
+			world.atlas.image((64*2, 64*2, 8*2, 8*2)),
+			world.atlas.image((64*2, 64*2, 8*2, 8*2)),
+			world.atlas.image((72*2, 64*2, 8*2, 8*2)),
+			world.atlas.image((64*2, 72*2, 8*2, 8*2))
 		]
 		self.tile_empty = tile_images[0]
 		self.tile_brick = tile_images[1]
@@ -392,21 +1144,89 @@ class Level():
 		self.tile_water2= tile_images[5]
 		self.tile_froze = tile_images[6]
 
-		self.obstacle_rects = []
+	def resetIndexes(self):
+		""" Empty everything that is derived from grid and objects on map """
 
-		level_nr = 1 if level_nr == None else level_nr%35
-		if level_nr == 0:
-			level_nr = 35
+		# tanks, bullets and bonuses on map
+		self.spatial = SpatialHash()
 
-		self.loadLevel(level_nr)
+		# cells tanks cannot move over, as bitmask of blocked cells for each row
+		self.obstacle_rows = [0] * self.GRID_SIZE
 
-		# tiles' rects on map, tanks cannot move over
-		self.obstacle_rects = []
+		# pre-rendered layers, see renderLayers()
+		self.terrain = None
+		self.grass = None
 
-		# update these tiles
-		self.updateObstacleRects()
+		# grid indexes of water tiles, repainted when waves toggle
+		self.water_cells = set()
+
+		# rects of cells repainted since last frame, see Game.drawDirty()
+		self.dirty_cells = []
+
+		# routes to castle for hunting enemies, see getFlowField()
+		self.flow_field = None
+
+	def getState(self):
+		""" @return dict Level's state for snapshot, see Game.getSnapshot() """
+		return {
+			"grid" : self.grid.tolist(),
+			"max_active_enemies" : self.max_active_enemies,
+			"enemies_by_type" : list(self.enemies_by_type),
+			"enemies_left" : list(self.enemies_left),
+			"waves" : self.tile_water is self.tile_water2,
+			"flow_field" : self.flow_field.getState() if self.flow_field != None else None
+		}
+
+	def setState(self, state):
+		""" Set up level created without __init__() from getState() data
+		Obstacles are indexed anew, spatial index is left empty and layers and
+		flow field are rebuilt when needed
+		"""
+
+		self.max_active_enemies = state["max_active_enemies"]
+		self.loadTileImages()
+		if state["waves"]:
+			self.tile_water = self.tile_water2
+
+		self.grid = array("B", state["grid"])
+		self.enemies_by_type = tuple(state["enemies_by_type"])
+		self.enemies_left = list(state["enemies_left"])
+
+		self.resetIndexes()
+		self.updateObstacleRows()
+		self.setFlowField(state.get("flow_field"))
+
+	def revert(self, state):
+		""" Bring level still in play back to getState() data, see Game.restoreSnapshot()
+		Unlike setState(), only cells that differ are changed, so obstacles and
+		pre-rendered layers are kept. Spatial index is left empty
+		"""
+
+		self.max_active_enemies = state["max_active_enemies"]
+		self.enemies_by_type = tuple(state["enemies_by_type"])
+		self.enemies_left = list(state["enemies_left"])
+
+		if state["waves"] != (self.tile_water is self.tile_water2):
+			self.toggleWaves()
+
+		# flow field is replaced anyway, no point repairing it
+		self.flow_field = None
+
+		grid = state["grid"]
+		if self.grid.tolist() != grid:
+			for i, tile in enumerate(grid):
+				if self.grid[i] != tile:
+					self.setTile(i % self.GRID_SIZE, i // self.GRID_SIZE, tile)
 
-		gtimer.add(400, lambda :self.toggleWaves())
+		self.setFlowField(state.get("flow_field"))
+		self.spatial = SpatialHash()
+
+	def setFlowField(self, state):
+		""" Restore flow field from FlowField.getState() data, None if it wasn't calculated yet """
+		self.flow_field = None
+		if state != None:
+			self.flow_field = FlowField.__new__(FlowField)
+			self.flow_field.setState(state, self)
 
 	def hitTile(self, pos, power = 1, sound = False):
 		"""
@@ -415,25 +1235,119 @@ class Level():
 			@return True if bullet was stopped, False otherwise
 		"""
 
-		global play_sounds, sounds
-
-		for tile in self.mapr:
-			if tile.topleft == pos:
-				if tile.type == self.TILE_BRICK:
-					if play_sounds and sound:
-						sounds["brick"].play()
-					self.mapr.remove(tile)
-					self.updateObstacleRects()
-					return True
-				elif tile.type == self.TILE_STEEL:
-					if play_sounds and sound:
-						sounds["steel"].play()
-					if power == 2:
-						self.mapr.remove(tile)
-						self.updateObstacleRects()
-					return True
-				else:
-					return False
+		world = self.world
+
+		x = pos[0] // self.TILE_SIZE
+		y = pos[1] // self.TILE_SIZE
+		tile = self.grid[y * self.GRID_SIZE + x]
+
+		if tile == self.TILE_BRICK:
+			if world.play_sounds and sound:
+				world.sounds["brick"].play()
+			self.setTile(x, y, self.TILE_EMPTY)
+			return True
+		elif tile == self.TILE_STEEL:
+			if world.play_sounds and sound:
+				world.sounds["steel"].play()
+			if power == 2:
+				self.setTile(x, y, self.TILE_EMPTY)
+			return True
+		else:
+			return False
+
+	def getTilesAt(self, rect, tiles):
+		""" Find map cells of given types which given rect overlaps
+		@param pygame.Rect rect Area in px
+		@param tuple tiles Tile types to look for
+		@return list Tiles' x, y in px
+		"""
+
+		size = self.TILE_SIZE
+		last = self.GRID_SIZE - 1
+
+		x1 = max(rect.left // size, 0)
+		x2 = min((rect.right - 1) // size, last)
+		y1 = max(rect.top // size, 0)
+		y2 = min((rect.bottom - 1) // size, last)
+
+		found = []
+		for y in range(y1, y2 + 1):
+			row = y * self.GRID_SIZE
+			for x in range(x1, x2 + 1):
+				if self.grid[row + x] in tiles:
+					found.append((x * size, y * size))
+		return found
+
+	def setTile(self, x, y, tile):
+		""" Change type of single map cell and keep obstacle_rows in sync
+		@param int x Cell's column
+		@param int y Cell's row
+		@param int tile New tile type
+		@return None
+		"""
+
+		i = y * self.GRID_SIZE + x
+		old_tile = self.grid[i]
+		self.grid[i] = tile
+
+		if tile in self.OBSTACLE_TILES or self.isCastleCell(x, y):
+			self.obstacle_rows[y] |= 1 << x
+		else:
+			self.obstacle_rows[y] &= ~(1 << x)
+
+		if self.terrain != None:
+			self.renderTile(i)
+
+		if self.flow_field != None and tile != old_tile:
+			self.flow_field.tileChanged(x, y)
+
+	def hitsObstacle(self, rect):
+		""" Check if rect overlaps any obstacle tile or castle
+		Looks only at bitmasks of rows rect is in, see obstacle_rows
+		@param pygame.Rect rect Area in px
+		@return boolean
+		"""
+
+		size = self.TILE_SIZE
+		last = self.GRID_SIZE - 1
+
+		x1 = max(rect.left // size, 0)
+		x2 = min((rect.right - 1) // size, last)
+		y1 = max(rect.top // size, 0)
+		y2 = min((rect.bottom - 1) // size, last)
+
+		if x1 > x2 or rect.width <= 0 or rect.height <= 0:
+			return False
+
+		mask = ((1 << (x2 - x1 + 1)) - 1) << x1
+		for y in range(y1, y2 + 1):
+			if self.obstacle_rows[y] & mask:
+				return True
+		return False
+
+	def getFlowField(self):
+		""" Get routes to castle, calculating them when first needed
+		@return FlowField
+		"""
+		if self.flow_field == None:
+			self.flow_field = FlowField(self)
+		return self.flow_field
+
+	def isCastleCell(self, x, y):
+		""" Check if castle covers map cell """
+
+		world = self.world
+
+		size = self.TILE_SIZE
+		return world.castle.rect.colliderect((x * size, y * size, size, size))
+
+	def removeBonus(self, bonus):
+		""" Take bonus off the map """
+
+		world = self.world
+
+		world.bonuses.remove(bonus)
+		self.spatial.remove(bonus)
 
 	def toggleWaves(self):
 		""" Toggle water image """
@@ -442,98 +1356,163 @@ class Level():
 		else:
 			self.tile_water = self.tile_water1
 
+		if self.terrain != None:
+			for i in self.water_cells:
+				self.renderTile(i)
 
-	def loadLevel(self, level_nr = 1):
-		""" Load specified level
-		@return boolean Whether level was loaded
+
+	@classmethod
+	def getStage(cls, stage, pack = None):
+		""" Find tiles and enemies of stage, without loading it
+		@param int stage Stage number, starting from 1, see __init__()
+		@param LevelPack pack
+		@return tuple Tiles (None if level file is missing) and number of enemies by type
 		"""
-		filename = "levels/"+str(level_nr)
+
+		levels_total = 35 if pack == None else len(pack)
+
+		level_nr = stage % levels_total
+		if level_nr == 0:
+			level_nr = levels_total
+
+		# after last level enemies stay as in the last one
+		if pack == None:
+			return (cls.readTiles(level_nr), cls.LEVELS_ENEMIES[min(stage, levels_total) - 1])
+		return (pack.getTiles(level_nr - 1), pack.getEnemies(min(stage, levels_total) - 1))
+
+	# level file name => tiles read from it, shared by all games
+	tiles_read = {}
+
+	@classmethod
+	def readTiles(cls, level_nr = 1, directory = "levels"):
+		""" Read level from levels/ directory. Each file is read only once
+		@param string directory Read from this directory instead
+		@return tuple Tile type of every cell, row by row. None if there is no such level
+		"""
+		filename = os.path.join(directory, str(level_nr))
+		if filename in cls.tiles_read:
+			return cls.tiles_read[filename]
+
 		if (not os.path.isfile(filename)):
-			return False
-		level = []
+			return None
 		f = open(filename, "r")
 		data = f.read().split("\n")
-		self.mapr = []
-		x, y = 0, 0
-		for row in data:
-			for ch in row:
-				if ch == "#":
-					self.mapr.append(myRect(x, y, self.TILE_SIZE, self.TILE_SIZE, self.TILE_BRICK))
-				elif ch == "@":
-					self.mapr.append(myRect(x, y, self.TILE_SIZE, self.TILE_SIZE, self.TILE_STEEL))
-				elif ch == "~":
-					self.mapr.append(myRect(x, y, self.TILE_SIZE, self.TILE_SIZE, self.TILE_WATER))
-				elif ch == "%":
-					self.mapr.append(myRect(x, y, self.TILE_SIZE, self.TILE_SIZE, self.TILE_GRASS))
-				elif ch == "-":
-					self.mapr.append(myRect(x, y, self.TILE_SIZE, self.TILE_SIZE, self.TILE_FROZE))
-				x += self.TILE_SIZE
-			x = 0
-			y += self.TILE_SIZE
-		return True
+		f.close()
+
+		tiles = [cls.TILE_EMPTY] * (cls.GRID_SIZE * cls.GRID_SIZE)
+		for y, row in enumerate(data[:cls.GRID_SIZE]):
+			for x, ch in enumerate(row[:cls.GRID_SIZE]):
+				if ch in cls.TILE_CHARS:
+					tiles[y * cls.GRID_SIZE + x] = cls.TILE_CHARS[ch]
+
+		cls.tiles_read[filename] = tuple(tiles)
+		return cls.tiles_read[filename]
+
+
+	def renderLayers(self):
+		""" Pre-render whole map into two layers: terrain, which goes below tanks, and
+		grass, which covers them. Afterwards only changed tiles are repainted, see
+		renderTile() """
+
+		size = self.GRID_SIZE * self.TILE_SIZE
+
+		self.terrain = pygame.Surface((size, size))
 
+		# grass layer is transparent except for grass tiles
+		self.grass = pygame.Surface((size, size))
+		self.grass.set_colorkey(self.GRASS_KEY)
+		self.grass.fill(self.GRASS_KEY)
 
-	def draw(self, tiles = None):
-		""" Draw specified map on top of existing surface """
+		self.water_cells = set()
 
-		global screen
+		for i in range(len(self.grid)):
+			self.renderTile(i)
 
-		if tiles == None:
-			tiles = [TILE_BRICK, TILE_STEEL, TILE_WATER, TILE_GRASS, TILE_FROZE]
+		# whole map is drawn anyway
+		self.dirty_cells = []
 
-		for tile in self.mapr:
-			if tile.type in tiles:
-				if tile.type == self.TILE_BRICK:
-					screen.blit(self.tile_brick, tile.topleft)
-				elif tile.type == self.TILE_STEEL:
-					screen.blit(self.tile_steel, tile.topleft)
-				elif tile.type == self.TILE_WATER:
-					screen.blit(self.tile_water, tile.topleft)
-				elif tile.type == self.TILE_FROZE:
-					screen.blit(self.tile_froze, tile.topleft)
-				elif tile.type == self.TILE_GRASS:
-					screen.blit(self.tile_grass, tile.topleft)
+	def renderTile(self, i):
+		""" Repaint single cell in pre-rendered layers
+		@param int i Grid index
+		@return None
+		"""
+
+		tile = self.grid[i]
+		pos = ((i % self.GRID_SIZE) * self.TILE_SIZE, (i // self.GRID_SIZE) * self.TILE_SIZE)
+		cell = pygame.Rect(pos, (self.TILE_SIZE, self.TILE_SIZE))
+
+		if tile == self.TILE_WATER:
+			self.water_cells.add(i)
+		else:
+			self.water_cells.discard(i)
+
+		if tile == self.TILE_BRICK:
+			self.terrain.blit(self.tile_brick, pos)
+		elif tile == self.TILE_STEEL:
+			self.terrain.blit(self.tile_steel, pos)
+		elif tile == self.TILE_WATER:
+			self.terrain.blit(self.tile_water, pos)
+		elif tile == self.TILE_FROZE:
+			self.terrain.blit(self.tile_froze, pos)
+		else:
+			self.terrain.fill((0, 0, 0), cell)
+
+		if tile == self.TILE_GRASS:
+			self.grass.blit(self.tile_grass, pos)
+		else:
+			self.grass.fill(self.GRASS_KEY, cell)
 
-	def updateObstacleRects(self):
-		""" Set self.obstacle_rects to all tiles' rects that players can destroy
-		with bullets """
+		self.dirty_cells.append(cell)
 
-		global castle
+	def drawTerrain(self):
+		""" Draw everything that goes below tanks, including empty (black) tiles """
 
-		self.obstacle_rects = [castle.rect]
+		world = self.world
 
-		for tile in self.mapr:
-			if tile.type in (self.TILE_BRICK, self.TILE_STEEL, self.TILE_WATER):
-				self.obstacle_rects.append(tile)
+		if self.terrain == None:
+			self.renderLayers()
+		world.screen.blit(self.terrain, (0, 0))
+
+	def drawGrass(self):
+		""" Draw grass on top of tanks """
+
+		world = self.world
+
+		if self.grass == None:
+			self.renderLayers()
+		world.screen.blit(self.grass, (0, 0))
+
+	def updateObstacleRows(self):
+		""" Set self.obstacle_rows to cells of all tiles tanks cannot move over and
+		castle """
+
+		world = self.world
+
+		self.obstacle_rows = [0] * self.GRID_SIZE
+
+		size = self.TILE_SIZE
+		for i, tile in enumerate(self.grid):
+			if tile in self.OBSTACLE_TILES:
+				self.obstacle_rows[i // self.GRID_SIZE] |= 1 << (i % self.GRID_SIZE)
+
+		# cells castle covers, see isCastleCell()
+		for y in range(world.castle.rect.top // size, (world.castle.rect.bottom - 1) // size + 1):
+			for x in range(world.castle.rect.left // size, (world.castle.rect.right - 1) // size + 1):
+				self.obstacle_rows[y] |= 1 << x
 
 	def buildFortress(self, tile):
 		""" Build walls around castle made from tile """
 
 		positions = [
-			(11*self.TILE_SIZE, 23*self.TILE_SIZE),
-			(11*self.TILE_SIZE, 24*self.TILE_SIZE),
-			(11*self.TILE_SIZE, 25*self.TILE_SIZE),
-			(14*self.TILE_SIZE, 23*self.TILE_SIZE),
-			(14*self.TILE_SIZE, 24*self.TILE_SIZE),
-			(14*self.TILE_SIZE, 25*self.TILE_SIZE),
-			(12*self.TILE_SIZE, 23*self.TILE_SIZE),
-			(13*self.TILE_SIZE, 23*self.TILE_SIZE)
+			(11, 23), (11, 24), (11, 25),
+			(14, 23), (14, 24), (14, 25),
+			(12, 23), (13, 23)
 		]
 
-		obsolete = []
-
-		for i, rect in enumerate(self.mapr):
-			if rect.topleft in positions:
-				obsolete.append(rect)
-		for rect in obsolete:
-			self.mapr.remove(rect)
+		for x, y in positions:
+			self.setTile(x, y, tile)
 
-		for pos in positions:
-			self.mapr.append(myRect(pos[0], pos[1], self.TILE_SIZE, self.TILE_SIZE, tile))
-
-		self.updateObstacleRects()
-
-class Tank():
+class Tank(object):
 
 	# possible directions
 	(DIR_UP, DIR_RIGHT, DIR_DOWN, DIR_LEFT) = range(4)
@@ -544,9 +1523,9 @@ class Tank():
 	# sides
 	(SIDE_PLAYER, SIDE_ENEMY) = range(2)
 
-	def __init__(self, level, side, position = None, direction = None, filename = None):
+	def __init__(self, world, level, side, position = None, direction = None, filename = None):
 
-		global sprites
+		self.world = world
 
 		# health. 0 health means dead
 		self.health = 100
@@ -587,17 +1566,11 @@ class Tank():
 		# currently pressed buttons (navigation only)
 		self.pressed = [False] * 4
 
-		self.shield_images = [
-			sprites.subsurface(0, 48*2, 16*2, 16*2),
-			sprites.subsurface(16*2, 48*2, 16*2, 16*2)
-		]
+		self.shield_images = world.atlas.shield
 		self.shield_image = self.shield_images[0]
 		self.shield_index = 0
 
-		self.spawn_images = [
-			sprites.subsurface(32*2, 48*2, 16*2, 16*2),
-			sprites.subsurface(48*2, 48*2, 16*2, 16*2)
-		]
+		self.spawn_images = world.atlas.spawn
 		self.spawn_image = self.spawn_images[0]
 		self.spawn_index = 0
 
@@ -608,31 +1581,34 @@ class Tank():
 		else:
 			self.rect = pygame.Rect(0, 0, 26, 26)
 
+		# position after previous tick, see Game.storePositions()
+		self.last_position = None
+
 		if direction == None:
-			self.direction = random.choice([self.DIR_RIGHT, self.DIR_DOWN, self.DIR_LEFT])
+			self.direction = world.rng.choice([self.DIR_RIGHT, self.DIR_DOWN, self.DIR_LEFT])
 		else:
 			self.direction = direction
 
 		self.state = self.STATE_SPAWNING
 
 		# spawning animation
-		self.timer_uuid_spawn = gtimer.add(100, lambda :self.toggleSpawnImage())
+		self.timer_uuid_spawn = world.timer.add(100, self.toggleSpawnImage)
 
 		# duration of spawning
-		self.timer_uuid_spawn_end = gtimer.add(1000, lambda :self.endSpawning())
+		self.timer_uuid_spawn_end = world.timer.add(1000, self.endSpawning)
 
 	def endSpawning(self):
 		""" End spawning
 		Player becomes operational
 		"""
 		self.state = self.STATE_ALIVE
-		gtimer.destroy(self.timer_uuid_spawn_end)
+		self.world.timer.destroy(self.timer_uuid_spawn_end)
 
 
 	def toggleSpawnImage(self):
 		""" advance to the next spawn image """
 		if self.state != self.STATE_SPAWNING:
-			gtimer.destroy(self.timer_uuid_spawn)
+			self.world.timer.destroy(self.timer_uuid_spawn)
 			return
 		self.spawn_index += 1
 		if self.spawn_index >= len(self.spawn_images):
@@ -642,7 +1618,7 @@ class Tank():
 	def toggleShieldImage(self):
 		""" advance to the next shield image """
 		if self.state != self.STATE_ALIVE:
-			gtimer.destroy(self.timer_uuid_shield)
+			self.world.timer.destroy(self.timer_uuid_shield)
 			return
 		if self.shielded:
 			self.shield_index += 1
@@ -651,23 +1627,28 @@ class Tank():
 			self.shield_image = self.shield_images[self.shield_index]
 
 
-	def draw(self):
-		""" draw tank """
-		global screen
+	def draw(self, alpha = 1.0):
+		""" draw tank
+		@param float alpha How far between previous and current tick to draw
+		@return pygame.Rect Area of screen drawn over, None if nothing was drawn
+		"""
+		world = self.world
 		if self.state == self.STATE_ALIVE:
-			screen.blit(self.image, self.rect.topleft)
+			x, y = interpolate(self.last_position, self.rect.topleft, alpha)
+			rect = world.screen.blit(self.image, (x, y))
 			if self.shielded:
-				screen.blit(self.shield_image, [self.rect.left-3, self.rect.top-3])
+				rect = rect.union(world.screen.blit(self.shield_image, [x-3, y-3]))
+			return rect
 		elif self.state == self.STATE_EXPLODING:
-			self.explosion.draw()
+			return self.explosion.draw()
 		elif self.state == self.STATE_SPAWNING:
-			screen.blit(self.spawn_image, self.rect.topleft)
+			return world.screen.blit(self.spawn_image, self.rect.topleft)
 
 	def explode(self):
 		""" start tanks's explosion """
 		if self.state != self.STATE_DEAD:
 			self.state = self.STATE_EXPLODING
-			self.explosion = Explosion(self.rect.topleft)
+			self.explosion = Explosion(self.world, self.rect.topleft)
 
 			if self.bonus:
 				self.spawnBonus()
@@ -678,10 +1659,10 @@ class Tank():
 		@return boolean True if bullet was fired, false otherwise
 		"""
 
-		global bullets, labels
+		world = self.world
 
 		if self.state != self.STATE_ALIVE:
-			gtimer.destroy(self.timer_uuid_fire)
+			world.timer.destroy(self.timer_uuid_fire)
 			return False
 
 		if self.paused:
@@ -689,13 +1670,13 @@ class Tank():
 
 		if not forced:
 			active_bullets = 0
-			for bullet in bullets:
+			for bullet in world.bullets:
 				if bullet.owner_class == self and bullet.state == bullet.STATE_ACTIVE:
 					active_bullets += 1
 			if active_bullets >= self.max_active_bullets:
 				return False
 
-		bullet = Bullet(self.level, self.rect.topleft, self.direction)
+		bullet = Bullet(self.world, self.level, self.rect.topleft, self.direction)
 
 		# if superpower level is at least 1
 		if self.superpowers > 0:
@@ -712,7 +1693,8 @@ class Tank():
 			self.bullet_queued = False
 
 		bullet.owner_class = self
-		bullets.append(bullet)
+		world.bullets.append(bullet)
+		self.level.spatial.add(bullet)
 		return True
 
 	def rotate(self, direction, fix_position = True):
@@ -721,14 +1703,8 @@ class Tank():
 		"""
 		self.direction = direction
 
-		if direction == self.DIR_UP:
-			self.image = self.image_up
-		elif direction == self.DIR_RIGHT:
-			self.image = self.image_right
-		elif direction == self.DIR_DOWN:
-			self.image = self.image_down
-		elif direction == self.DIR_LEFT:
-			self.image = self.image_left
+		# self.images holds tank's image for each direction
+		self.image = self.images[direction]
 
 		if fix_position:
 			new_x = self.nearest(self.rect.left, 8) + 3
@@ -740,6 +1716,8 @@ class Tank():
 			if (abs(self.rect.top - new_y) < 5):
 				self.rect.top = new_y
 
+			self.level.spatial.update(self)
+
 	def turnAround(self):
 		""" Turn tank into opposite direction """
 		if self.direction in (self.DIR_UP, self.DIR_RIGHT):
@@ -755,8 +1733,8 @@ class Tank():
 				del self.explosion
 
 	def nearest(self, num, base):
-		""" Round number to nearest divisible """
-		return int(round(num / (base * 1.0)) * base)
+		""" Round number to nearest divisible, halves up on both Python 2 and 3 """
+		return int(math.floor(num / (base * 1.0) + 0.5)) * base
 
 
 	def bulletImpact(self, friendly_fire = False, damage = 100, tank = None):
@@ -765,7 +1743,7 @@ class Tank():
 		doesn't trigger bullet explosion
 		"""
 
-		global play_sounds, sounds
+		world = self.world
 
 		if self.shielded:
 			return True
@@ -777,10 +1755,10 @@ class Tank():
 					tank.trophies["enemy"+str(self.type)] += 1
 					points = (self.type+1) * 100
 					tank.score += points
-					if play_sounds:
-						sounds["explosion"].play()
+					if world.play_sounds:
+						world.sounds["explosion"].play()
 
-					labels.append(Label(self.rect.topleft, str(points), 500))
+					world.labels.append(Label(world, self.rect.topleft, str(points), 500))
 
 				self.explode()
 			return True
@@ -790,7 +1768,7 @@ class Tank():
 		elif self.side == self.SIDE_PLAYER:
 			if not self.paralised:
 				self.setParalised(True)
-				self.timer_uuid_paralise = gtimer.add(10000, lambda :self.setParalised(False), 1)
+				self.timer_uuid_paralise = world.timer.add(10000, self.setParalised, 1, (False,))
 			return True
 
 	def setParalised(self, paralised = True):
@@ -799,23 +1777,70 @@ class Tank():
 		@return None
 		"""
 		if self.state != self.STATE_ALIVE:
-			gtimer.destroy(self.timer_uuid_paralise)
+			self.world.timer.destroy(self.timer_uuid_paralise)
 			return
 		self.paralised = paralised
 
+	# attributes saved in snapshots as they are, see getState()
+	SNAPSHOT_FIELDS = (
+		"health", "paralised", "paused", "shielded", "speed", "max_active_bullets",
+		"side", "flash", "superpowers", "controls", "pressed", "shield_index",
+		"spawn_index", "direction", "state", "last_position", "timer_uuid_spawn",
+		"timer_uuid_spawn_end", "timer_uuid_shield", "timer_uuid_fire",
+		"timer_uuid_paralise", "timer_uuid_flash"
+	)
+
+	def getState(self, refs):
+		""" @return dict Tank's state for snapshot, see Game.getSnapshot() """
+
+		state = getFields(self, self.SNAPSHOT_FIELDS)
+		state["rect"] = tuple(self.rect)
+		state["explosion"] = refs.get(getattr(self, "explosion", None))
+
+		# players carry bonus they've just picked up, enemies only a flag
+		if isinstance(self.bonus, Bonus):
+			state["bonus"] = refs.get(self.bonus)
+		else:
+			state["bonus"] = self.bonus
+		return state
+
+	def setState(self, state, objects, level):
+		""" Set up tank created without __init__() from getState() data
+		Subclasses set images
+		"""
+
+		world = self.world
+
+		setFields(self, state, self.SNAPSHOT_FIELDS)
+		self.level = level
+		self.rect = pygame.Rect(state["rect"])
+		if state["explosion"] != None:
+			self.explosion = getObject(objects, state["explosion"])
+
+		if isinstance(state["bonus"], list):
+			self.bonus = getObject(objects, state["bonus"])
+		else:
+			self.bonus = state["bonus"]
+
+		self.shield_images = world.atlas.shield
+		self.shield_image = self.shield_images[self.shield_index]
+		self.spawn_images = world.atlas.spawn
+		self.spawn_image = self.spawn_images[self.spawn_index]
+
 class Enemy(Tank):
 
 	(TYPE_BASIC, TYPE_FAST, TYPE_POWER, TYPE_ARMOR) = range(4)
 
-	def __init__(self, level, type, position = None, direction = None, filename = None):
+	def __init__(self, world, level, type, position = None, direction = None, filename = None, hunter = False):
 
-		Tank.__init__(self, level, type, position = None, direction = None, filename = None)
-
-		global enemies, sprites
+		Tank.__init__(self, world, level, type, position = None, direction = None, filename = None)
 
 		# if true, do not fire
 		self.bullet_queued = False
 
+		# if true, head for castle instead of wandering around
+		self.hunter = hunter
+
 		# chose type on random
 		if len(level.enemies_left) > 0:
 			self.type = level.enemies_left.pop()
@@ -833,42 +1858,14 @@ class Enemy(Tank):
 			self.health = 400
 
 		# 1 in 5 chance this will be bonus carrier, but only if no other tank is
-		if random.randint(1, 5) == 1:
+		if world.rng.randint(1, 5) == 1:
 			self.bonus = True
-			for enemy in enemies:
+			for enemy in world.enemies:
 				if enemy.bonus:
 					self.bonus = False
 					break
 
-		images = [
-			sprites.subsurface(32*2, 0, 13*2, 15*2),
-			sprites.subsurface(48*2, 0, 13*2, 15*2),
-			sprites.subsurface(64*2, 0, 13*2, 15*2),
-			sprites.subsurface(80*2, 0, 13*2, 15*2),
-			sprites.subsurface(32*2, 16*2, 13*2, 15*2),
-			sprites.subsurface(48*2, 16*2, 13*2, 15*2),
-			sprites.subsurface(64*2, 16*2, 13*2, 15*2),
-			sprites.subsurface(80*2, 16*2, 13*2, 15*2)
-		]
-
-		self.image = images[self.type+0]
-
-		self.image_up = self.image;
-		self.image_left = pygame.transform.rotate(self.image, 90)
-		self.image_down = pygame.transform.rotate(self.image, 180)
-		self.image_right = pygame.transform.rotate(self.image, 270)
-
-		if self.bonus:
-			self.image1_up = self.image_up;
-			self.image1_left = self.image_left
-			self.image1_down = self.image_down
-			self.image1_right = self.image_right
-
-			self.image2 = images[self.type+4]
-			self.image2_up = self.image2;
-			self.image2_left = pygame.transform.rotate(self.image2, 90)
-			self.image2_down = pygame.transform.rotate(self.image2, 180)
-			self.image2_right = pygame.transform.rotate(self.image2, 270)
+		self.images = world.atlas.enemies[self.type][0]
 
 		self.rotate(self.direction, False)
 
@@ -878,58 +1875,59 @@ class Enemy(Tank):
 				self.state = self.STATE_DEAD
 				return
 
-		# list of map coords where tank should go next
-		self.path = self.generatePath(self.direction)
+		# straight line where tank should go next: starting position, px per step
+		# along each axis and number of steps, see generatePath()
+		self.path_x = self.path_y = 0
+		self.path_dx = self.path_dy = 0
+		self.path_steps = 0
+		self.path_step = 0
+		if not self.hunter or not self.huntPath():
+			self.generatePath(self.direction)
 
 		# 1000 is duration between shots
-		self.timer_uuid_fire = gtimer.add(1000, lambda :self.fire())
+		self.timer_uuid_fire = world.timer.add(1000, self.fire)
 
 		# turn on flashing
 		if self.bonus:
-			self.timer_uuid_flash = gtimer.add(200, lambda :self.toggleFlash())
+			self.timer_uuid_flash = world.timer.add(200, self.toggleFlash)
 
 	def toggleFlash(self):
 		""" Toggle flash state """
+
+		world = self.world
+
 		if self.state not in (self.STATE_ALIVE, self.STATE_SPAWNING):
-			gtimer.destroy(self.timer_uuid_flash)
+			world.timer.destroy(self.timer_uuid_flash)
 			return
 		self.flash = not self.flash
-		if self.flash:
-			self.image_up = self.image2_up
-			self.image_right = self.image2_right
-			self.image_down = self.image2_down
-			self.image_left = self.image2_left
-		else:
-			self.image_up = self.image1_up
-			self.image_right = self.image1_right
-			self.image_down = self.image1_down
-			self.image_left = self.image1_left
+		self.images = world.atlas.enemies[self.type][int(self.flash)]
 		self.rotate(self.direction, False)
 
 	def spawnBonus(self):
 		""" Create new bonus if needed """
 
-		global bonuses
+		world = self.world
 
-		if len(bonuses) > 0:
+		if len(world.bonuses) > 0:
 			return
-		bonus = Bonus(self.level)
-		bonuses.append(bonus)
-		gtimer.add(500, lambda :bonus.toggleVisibility())
-		gtimer.add(10000, lambda :bonuses.remove(bonus), 1)
+		bonus = Bonus(world, self.level)
+		world.bonuses.append(bonus)
+		self.level.spatial.add(bonus)
+		world.timer.add(500, bonus.toggleVisibility)
+		world.timer.add(10000, self.level.removeBonus, 1, (bonus,))
 
 
 	def getFreeSpawningPosition(self):
 
-		global players, enemies
+		world = self.world
 
 		available_positions = [
-			[(self.level.TILE_SIZE * 2 - self.rect.width) / 2, (self.level.TILE_SIZE * 2 - self.rect.height) / 2],
-			[12 * self.level.TILE_SIZE + (self.level.TILE_SIZE * 2 - self.rect.width) / 2, (self.level.TILE_SIZE * 2 - self.rect.height) / 2],
-			[24 * self.level.TILE_SIZE + (self.level.TILE_SIZE * 2 - self.rect.width) / 2,  (self.level.TILE_SIZE * 2 - self.rect.height) / 2]
+			[(self.level.TILE_SIZE * 2 - self.rect.width) // 2, (self.level.TILE_SIZE * 2 - self.rect.height) // 2],
+			[12 * self.level.TILE_SIZE + (self.level.TILE_SIZE * 2 - self.rect.width) // 2, (self.level.TILE_SIZE * 2 - self.rect.height) // 2],
+			[24 * self.level.TILE_SIZE + (self.level.TILE_SIZE * 2 - self.rect.width) // 2,  (self.level.TILE_SIZE * 2 - self.rect.height) // 2]
 		]
 
-		random.shuffle(available_positions)
+		world.rng.shuffle(available_positions)
 
 		for pos in available_positions:
 
@@ -937,7 +1935,7 @@ class Enemy(Tank):
 
 			# collisions with other enemies
 			collision = False
-			for enemy in enemies:
+			for enemy in self.level.spatial.query(enemy_rect, Enemy):
 				if enemy_rect.colliderect(enemy.rect):
 					collision = True
 					continue
@@ -947,7 +1945,7 @@ class Enemy(Tank):
 
 			# collisions with players
 			collision = False
-			for player in players:
+			for player in self.level.spatial.query(enemy_rect, Player):
 				if enemy_rect.colliderect(player.rect):
 					collision = True
 					continue
@@ -961,62 +1959,61 @@ class Enemy(Tank):
 	def move(self):
 		""" move enemy if possible """
 
-		global players, enemies, bonuses
-
 		if self.state != self.STATE_ALIVE or self.paused or self.paralised:
 			return
 
-		if self.path == []:
-			self.path = self.generatePath(None, True)
+		if self.path_step >= self.path_steps:
+			self.choosePath(None, True)
 
-		new_position = self.path.pop(0)
+		new_position = self.nextPathPosition()
 
 		# move enemy
 		if self.direction == self.DIR_UP:
 			if new_position[1] < 0:
-				self.path = self.generatePath(self.direction, True)
+				self.choosePath(self.direction, True)
 				return
 		elif self.direction == self.DIR_RIGHT:
 			if new_position[0] > (416 - 26):
-				self.path = self.generatePath(self.direction, True)
+				self.choosePath(self.direction, True)
 				return
 		elif self.direction == self.DIR_DOWN:
 			if new_position[1] > (416 - 26):
-				self.path = self.generatePath(self.direction, True)
+				self.choosePath(self.direction, True)
 				return
 		elif self.direction == self.DIR_LEFT:
 			if new_position[0] < 0:
-				self.path = self.generatePath(self.direction, True)
+				self.choosePath(self.direction, True)
 				return
 
 		new_rect = pygame.Rect(new_position, [26, 26])
 
 		# collisions with tiles
-		if new_rect.collidelist(self.level.obstacle_rects) != -1:
-			self.path = self.generatePath(self.direction, True)
+		if self.level.hitsObstacle(new_rect):
+			self.choosePath(self.direction, True)
 			return
 
 		# collisions with other enemies
-		for enemy in enemies:
+		for enemy in self.level.spatial.query(new_rect, Enemy):
 			if enemy != self and new_rect.colliderect(enemy.rect):
 				self.turnAround()
-				self.path = self.generatePath(self.direction)
+				self.generatePath(self.direction)
 				return
 
 		# collisions with players
-		for player in players:
+		for player in self.level.spatial.query(new_rect, Player):
 			if new_rect.colliderect(player.rect):
 				self.turnAround()
-				self.path = self.generatePath(self.direction)
+				self.generatePath(self.direction)
 				return
 
 		# collisions with bonuses
-		for bonus in bonuses:
+		for bonus in self.level.spatial.query(new_rect, Bonus):
 			if new_rect.colliderect(bonus.rect):
-				bonuses.remove(bonus)
+				self.level.removeBonus(bonus)
 
 		# if no collision, move enemy
 		self.rect.topleft = new_rect.topleft
+		self.level.spatial.update(self)
 
 
 	def update(self, time_passed):
@@ -1024,8 +2021,77 @@ class Enemy(Tank):
 		if self.state == self.STATE_ALIVE and not self.paused:
 			self.move()
 
+	def choosePath(self, direction = None, fix_direction = False):
+		""" Set new path: hunters follow routes to castle if there are any, others
+		(and hunters bumping into tanks) move at random, see generatePath()
+		"""
+		if not self.hunter or not self.huntPath():
+			self.generatePath(direction, fix_direction)
+
+	def huntPath(self):
+		""" Set path along level's flow field, up to 4 nodes long
+		If castle can be shot from here, stay and face it for a while
+		@return boolean False if castle can't be reached
+		"""
+
+		field = self.level.getFlowField()
+		node = field.getNode(self.rect)
+		direction = field.directions[node]
+
+		if direction == -1:
+			return False
+
+		# line up with node across direction of movement (or fully, when castle
+		# is to be shot from here), unless it's blocked
+		x, y = self.rect.topleft
+		if direction in (self.DIR_UP, self.DIR_DOWN) or node in field.goals:
+			x = (node % field.SIZE) * field.STEP
+		if direction in (self.DIR_RIGHT, self.DIR_LEFT) or node in field.goals:
+			y = (node // field.SIZE) * field.STEP
+		if not self.level.hitsObstacle(pygame.Rect(x, y, 26, 26)):
+			self.rect.topleft = (x, y)
+			self.level.spatial.update(self)
+
+		self.rotate(direction, False)
+
+		self.path_x = self.rect.left
+		self.path_y = self.rect.top
+		self.path_dx = (0, self.speed, 0, -self.speed)[direction]
+		self.path_dy = (-self.speed, 0, self.speed, 0)[direction]
+		self.path_step = 0
+
+		if node in field.goals:
+			self.path_dx = self.path_dy = 0
+			self.path_steps = 25
+			return True
+
+		# go as long as route goes straight
+		target = node
+		for i in range(4):
+			if field.directions[target] != direction or target in field.goals:
+				break
+			target = field.getNeighbour(target, direction)
+
+		if direction in (self.DIR_UP, self.DIR_DOWN):
+			pixels = abs((target // field.SIZE) * field.STEP - self.rect.top)
+		else:
+			pixels = abs((target % field.SIZE) * field.STEP - self.rect.left)
+
+		self.path_steps = (pixels + self.speed - 1) // self.speed + 1
+		return True
+
+	def nextPathPosition(self):
+		""" Take next step of path
+		@return tuple Tank's x, y in px after this step
+		"""
+
+		step = self.path_step
+		self.path_step = step + 1
+		return (self.path_x + self.path_dx * step, self.path_y + self.path_dy * step)
+
 	def generatePath(self, direction = None, fix_direction = False):
 		""" If direction is specified, try continue that way, otherwise choose at random
+		New path starts at current position, first step of it doesn't move tank
 		"""
 
 		all_directions = [self.DIR_UP, self.DIR_RIGHT, self.DIR_DOWN, self.DIR_LEFT]
@@ -1036,7 +2102,7 @@ class Enemy(Tank):
 			else:
 				opposite_direction = self.direction - 2
 			directions = all_directions
-			random.shuffle(directions)
+			self.world.rng.shuffle(directions)
 			directions.remove(opposite_direction)
 			directions.append(opposite_direction)
 		else:
@@ -1050,44 +2116,44 @@ class Enemy(Tank):
 			else:
 				opposite_direction = direction - 2
 			directions = all_directions
-			random.shuffle(directions)
+			self.world.rng.shuffle(directions)
 			directions.remove(opposite_direction)
 			directions.remove(direction)
 			directions.insert(0, direction)
 			directions.append(opposite_direction)
 
 		# at first, work with general units (steps) not px
-		x = int(round(self.rect.left / 16))
-		y = int(round(self.rect.top / 16))
+		x = self.rect.left // 16
+		y = self.rect.top // 16
 
 		new_direction = None
 
 		for direction in directions:
 			if direction == self.DIR_UP and y > 1:
 				new_pos_rect = self.rect.move(0, -8)
-				if new_pos_rect.collidelist(self.level.obstacle_rects) == -1:
+				if not self.level.hitsObstacle(new_pos_rect):
 					new_direction = direction
 					break
 			elif direction == self.DIR_RIGHT and x < 24:
 				new_pos_rect = self.rect.move(8, 0)
-				if new_pos_rect.collidelist(self.level.obstacle_rects) == -1:
+				if not self.level.hitsObstacle(new_pos_rect):
 					new_direction = direction
 					break
 			elif direction == self.DIR_DOWN and y < 24:
 				new_pos_rect = self.rect.move(0, 8)
-				if new_pos_rect.collidelist(self.level.obstacle_rects) == -1:
+				if not self.level.hitsObstacle(new_pos_rect):
 					new_direction = direction
 					break
 			elif direction == self.DIR_LEFT and x > 1:
 				new_pos_rect = self.rect.move(-8, 0)
-				if new_pos_rect.collidelist(self.level.obstacle_rects) == -1:
+				if not self.level.hitsObstacle(new_pos_rect):
 					new_direction = direction
 					break
 
 		# if we can go anywhere else, turn around
 		if new_direction == None:
 			new_direction = opposite_direction
-			print "nav izejas. griezhamies"
+			print("nav izejas. griezhamies")
 
 		# fix tanks position
 		if fix_direction and new_direction == self.direction:
@@ -1095,47 +2161,42 @@ class Enemy(Tank):
 
 		self.rotate(new_direction, fix_direction)
 
-		positions = []
+		pixels = self.nearest(self.world.rng.randint(1, 12) * 32, 32) + 3
 
-		x = self.rect.left
-		y = self.rect.top
+		self.path_x = self.rect.left
+		self.path_y = self.rect.top
+		self.path_dx = (0, self.speed, 0, -self.speed)[new_direction]
+		self.path_dy = (-self.speed, 0, self.speed, 0)[new_direction]
+		self.path_steps = (pixels + self.speed - 1) // self.speed
+		self.path_step = 0
 
-		if new_direction in (self.DIR_RIGHT, self.DIR_LEFT):
-			axis_fix = self.nearest(y, 16) - y
-		else:
-			axis_fix = self.nearest(x, 16) - x
-		axis_fix = 0
+	SNAPSHOT_FIELDS = Tank.SNAPSHOT_FIELDS + (
+		"bullet_queued", "hunter", "type", "path_x", "path_y", "path_dx", "path_dy",
+		"path_steps", "path_step"
+	)
 
-		pixels = self.nearest(random.randint(1, 12) * 32, 32) + axis_fix + 3
+	def setState(self, state, objects, level):
 
-		if new_direction == self.DIR_UP:
-			for px in range(0, pixels, self.speed):
-				positions.append([x, y-px])
-		elif new_direction == self.DIR_RIGHT:
-			for px in range(0, pixels, self.speed):
-				positions.append([x+px, y])
-		elif new_direction == self.DIR_DOWN:
-			for px in range(0, pixels, self.speed):
-				positions.append([x, y+px])
-		elif new_direction == self.DIR_LEFT:
-			for px in range(0, pixels, self.speed):
-				positions.append([x-px, y])
+		world = self.world
 
-		return positions
+		Tank.setState(self, state, objects, level)
+		self.images = world.atlas.enemies[self.type][int(self.flash)]
+		self.image = self.images[self.direction]
 
 
 
 class Player(Tank):
 
-	def __init__(self, level, type, position = None, direction = None, filename = None):
-
-		Tank.__init__(self, level, type, position = None, direction = None, filename = None)
+	def __init__(self, world, level, type, position = None, direction = None, filename = None):
 
-		global sprites
+		Tank.__init__(self, world, level, type, position = None, direction = None, filename = None)
 
 		if filename == None:
 			filename = (0, 0, 16*2, 16*2)
 
+		# tank's image in sprites
+		self.filename = filename
+
 		self.start_position = position
 		self.start_direction = direction
 
@@ -1144,6 +2205,9 @@ class Player(Tank):
 		# total score
 		self.score = 0
 
+		# how many times fire was pressed during current tick, see Game.getInput()
+		self.fire_presses = 0
+
 		# store how many bonuses in this stage this player has collected
 		self.trophies = {
 			"bonus" : 0,
@@ -1153,11 +2217,7 @@ class Player(Tank):
 			"enemy3" : 0
 		}
 
-		self.image = sprites.subsurface(filename)
-		self.image_up = self.image;
-		self.image_left = pygame.transform.rotate(self.image, 90)
-		self.image_down = pygame.transform.rotate(self.image, 180)
-		self.image_right = pygame.transform.rotate(self.image, 270)
+		self.images = world.atlas.rotations(filename)
 
 		if direction == None:
 			self.rotate(self.DIR_UP, False)
@@ -1167,8 +2227,6 @@ class Player(Tank):
 	def move(self, direction):
 		""" move player if possible """
 
-		global players, enemies, bonuses
-
 		if self.state == self.STATE_EXPLODING:
 			if not self.explosion.active:
 				self.state = self.STATE_DEAD
@@ -1205,31 +2263,33 @@ class Player(Tank):
 		player_rect = pygame.Rect(new_position, [26, 26])
 
 		# collisions with tiles
-		if player_rect.collidelist(self.level.obstacle_rects) != -1:
+		if self.level.hitsObstacle(player_rect):
 			return
 
 		# collisions with other players
-		for player in players:
+		for player in self.level.spatial.query(player_rect, Player):
 			if player != self and player.state == player.STATE_ALIVE and player_rect.colliderect(player.rect) == True:
 				return
 
 		# collisions with enemies
-		for enemy in enemies:
+		for enemy in self.level.spatial.query(player_rect, Enemy):
 			if player_rect.colliderect(enemy.rect) == True:
 				return
 
 		# collisions with bonuses
-		for bonus in bonuses:
+		for bonus in self.level.spatial.query(player_rect, Bonus):
 			if player_rect.colliderect(bonus.rect) == True:
 				self.bonus = bonus
 
 		#if no collision, move player
 		self.rect.topleft = (new_position[0], new_position[1])
+		self.level.spatial.update(self)
 
 	def reset(self):
 		""" reset player """
 		self.rotate(self.start_direction, False)
 		self.rect.topleft = self.start_position
+		self.level.spatial.update(self)
 		self.superpowers = 0
 		self.max_active_bullets = 1
 		self.health = 100
@@ -1238,6 +2298,50 @@ class Player(Tank):
 		self.pressed = [False] * 4
 		self.state = self.STATE_ALIVE
 
+	SNAPSHOT_FIELDS = Tank.SNAPSHOT_FIELDS + (
+		"filename", "start_position", "start_direction", "lives", "score",
+		"fire_presses", "trophies"
+	)
+
+	def setState(self, state, objects, level):
+
+		world = self.world
+
+		Tank.setState(self, state, objects, level)
+		self.filename = tuple(self.filename)
+		self.images = world.atlas.rotations(self.filename)
+		self.image = self.images[self.direction]
+
+class World(object):
+	""" State shared by objects of one game. Every game has its own, so any
+	number of games can run in one process
+	"""
+
+	def __init__(self, atlas, screen, sounds = None, seed = None):
+		"""
+		@param Atlas atlas Sprites
+		@param pygame.Surface screen Surface to draw on
+		@param dict sounds Sound name => pygame.mixer.Sound, empty to play no sounds
+		@param int seed Seed of random number generator
+		"""
+
+		self.atlas = atlas
+		self.screen = screen
+
+		self.sounds = {} if sounds == None else sounds
+		self.play_sounds = len(self.sounds) > 0
+
+		self.timer = Timer()
+		self.rng = random.Random(seed)
+
+		self.players = []
+		self.enemies = []
+		self.bullets = []
+		self.bonuses = []
+		self.labels = []
+
+		self.castle = Castle(self)
+
 class Game():
 
 	# direction constants
@@ -1245,100 +2349,169 @@ class Game():
 
 	TILE_SIZE = 16
 
-	def __init__(self):
+	# duration of one game tick in ms (game runs at 50 ticks per second)
+	TICK_MS = 20
+
+	# most ticks played to catch up before drawing a frame. if a frame took
+	# longer than this, the game slows down instead of never catching up
+	MAX_CATCH_UP_TICKS = 5
+
+	# frame rate cap when display's refresh rate can't be found out
+	DEFAULT_FPS = 60
+
+	# screen areas
+	MAP_RECT = pygame.Rect(0, 0, 416, 416)
+	SIDEBAR_RECT = pygame.Rect(416, 0, 64, 416)
+
+	# first and second player's tank in sprites
+	PLAYER_IMAGES = ((0, 0, 13*2, 13*2), (16*2, 0, 13*2, 13*2))
+
+	def __init__(self, headless = False, level_pack = None, template = None, fullscreen = False, fps = None, dirty = False, hunters = False, profile = False):
+		"""
+		@param boolean headless Run without window, sounds and frame limiter
+		@param LevelPack level_pack Take levels from pack instead of levels/ directory
+		@param Game template Share sprites, sounds, fonts and, if both are headless,
+			screen with this game instead of loading them again, see matchhost.py
+		@param boolean fullscreen Open window in fullscreen mode
+		@param int fps Frames per second to draw during game, 0 for uncapped, None
+			for display's refresh rate
+		@param boolean dirty Update only changed parts of display
+		@param boolean hunters Enemies head for castle
+		@param mixed profile Time phases of ticks if true, "detail" for draw phases too
+		"""
+
+		# if true, run without window, sounds and frame limiter. see simulate()
+		self.headless = headless
+
+		# LevelPack to take levels from. if None, levels/ directory is used
+		self.level_pack = level_pack
+
+		# if true, update only changed parts of display. see drawDirty()
+		self.dirty_rendering = dirty
+
+		# if true, enemies head for castle. see Enemy.huntPath()
+		self.hunters = hunters
+
+		# replay being recorded and where to save it
+		self.recording = None
+		self.record_filename = None
+		self.record_seed = None
+
+		# times phases of ticks. F9 saves trace of next ticks during game
+		self.profiler = TickProfiler(bool(profile), profile == "detail")
+
+		# replay being played back, its current stage index and tick. see seekReplay()
+		self.replay = None
+		self.replay_stage = 0
+		self.replay_tick = 0
+
+		# areas of screen covered by sprites in last frame. None forces full redraw
+		self.drawn_rects = None
+
+		# what was shown in sidebar in last frame
+		self.sidebar_state = None
 
-		global screen, sprites, play_sounds, sounds
+		play_sounds = not headless
 
-		# center window
-		os.environ['SDL_VIDEO_WINDOW_POS'] = 'center'
+		if headless:
+			os.environ["SDL_VIDEODRIVER"] = "dummy"
+		else:
+			# center window
+			os.environ['SDL_VIDEO_WINDOW_POS'] = 'center'
 
 		if play_sounds:
 			pygame.mixer.pre_init(44100, -16, 1, 512)
 
 		pygame.init()
 
-
 		pygame.display.set_caption("Battle City")
 
 		size = width, height = 480, 416
 
-		if "-f" in sys.argv[1:]:
+		if headless:
+			# games in the same process share the display, each draws to
+			# its own surface, unless it shares template's
+			if pygame.display.get_surface() == None:
+				pygame.display.set_mode(size)
+			if template != None and template.headless:
+				screen = template.world.screen
+			else:
+				screen = pygame.Surface(size)
+		elif fullscreen:
 			screen = pygame.display.set_mode(size, pygame.FULLSCREEN)
 		else:
 			screen = pygame.display.set_mode(size)
 
 		self.clock = pygame.time.Clock()
 
-		# load sprites (funky version)
-		#sprites = pygame.transform.scale2x(pygame.image.load("images/sprites.gif"))
-		# load sprites (pixely version)
-		sprites = pygame.transform.scale(pygame.image.load("images/sprites.gif"), [192, 224])
-		#screen.set_colorkey((0,138,104))
-
-		pygame.display.set_icon(sprites.subsurface(0, 0, 13*2, 13*2))
+		# frames per second to draw during game, 0 means uncapped. see nextLevel()
+		self.fps = self.getDisplayFps() if fps == None else fps
 
-		# load sounds
 		if play_sounds:
 			pygame.mixer.init(44100, -16, 1, 512)
 
-			sounds["start"] = pygame.mixer.Sound("sounds/gamestart.ogg")
-			sounds["end"] = pygame.mixer.Sound("sounds/gameover.ogg")
-			sounds["score"] = pygame.mixer.Sound("sounds/score.ogg")
-			sounds["bg"] = pygame.mixer.Sound("sounds/background.ogg")
-			sounds["fire"] = pygame.mixer.Sound("sounds/fire.ogg")
-			sounds["bonus"] = pygame.mixer.Sound("sounds/bonus.ogg")
-			sounds["explosion"] = pygame.mixer.Sound("sounds/explosion.ogg")
-			sounds["brick"] = pygame.mixer.Sound("sounds/brick.ogg")
-			sounds["steel"] = pygame.mixer.Sound("sounds/steel.ogg")
+		# load sprites (scaled, pixely version) and sounds. they come from baked
+		# cache file, unless source files have changed, see assets.py
+		if template != None:
+			atlas = template.world.atlas
+			sounds = template.world.sounds if play_sounds else {}
+		else:
+			sprites, sounds = AssetCache().load(play_sounds)
+			atlas = Atlas(sprites)
+			pygame.display.set_icon(sprites.subsurface(0, 0, 13*2, 13*2))
 
-		self.enemy_life_image = sprites.subsurface(81*2, 57*2, 7*2, 7*2)
-		self.player_life_image = sprites.subsurface(89*2, 56*2, 7*2, 8*2)
-		self.flag_image = sprites.subsurface(64*2, 49*2, 16*2, 15*2)
+		# everything game objects share: screen, sprites, sounds, timer, random
+		# number generator and lists of objects in play
+		self.world = World(atlas, screen, sounds)
 
-		# this is used in intro screen
-		self.player_image = pygame.transform.rotate(sprites.subsurface(0, 0, 13*2, 13*2), 270)
+		self.enemy_life_image = atlas.image((81*2, 57*2, 7*2, 7*2))
+		self.player_life_image = atlas.image((89*2, 56*2, 7*2, 8*2))
+		self.flag_image = atlas.image((64*2, 49*2, 16*2, 15*2))
 
 		# if true, no new enemies will be spawn during this time
 		self.timefreeze = False
 
-		# load custom font
-		self.font = pygame.font.Font("fonts/prstart.ttf", 16)
+		if template != None:
+			self.player_image = template.player_image
+			self.font = template.font
+			self.im_game_over = template.im_game_over
+		else:
+			# this is used in intro screen
+			self.player_image = pygame.transform.rotate(atlas.sprites.subsurface(0, 0, 13*2, 13*2), 270)
+
+			# load custom font
+			self.font = pygame.font.Font("fonts/prstart.ttf", 16)
+
+			# pre-render game over text
+			self.im_game_over = pygame.Surface((64, 40))
+			self.im_game_over.set_colorkey((0,0,0))
+			self.im_game_over.blit(self.font.render("GAME", False, (127, 64, 64)), [0, 0])
+			self.im_game_over.blit(self.font.render("OVER", False, (127, 64, 64)), [0, 20])
 
-		# pre-render game over text
-		self.im_game_over = pygame.Surface((64, 40))
-		self.im_game_over.set_colorkey((0,0,0))
-		self.im_game_over.blit(self.font.render("GAME", False, (127, 64, 64)), [0, 0])
-		self.im_game_over.blit(self.font.render("OVER", False, (127, 64, 64)), [0, 20])
 		self.game_over_y = 416+40
 
 		# number of players. here is defined preselected menu value
 		self.nr_of_players = 1
 
-		del players[:]
-		del bullets[:]
-		del enemies[:]
-		del bonuses[:]
-
-
 	def triggerBonus(self, bonus, player):
 		""" Execute bonus powers """
 
-		global enemies, labels, play_sounds, sounds
+		world = self.world
 
-		if play_sounds:
-			sounds["bonus"].play()
+		if world.play_sounds:
+			world.sounds["bonus"].play()
 
 		player.trophies["bonus"] += 1
 		player.score += 500
 
 		if bonus.bonus == bonus.BONUS_GRENADE:
-			for enemy in enemies:
+			for enemy in world.enemies:
 				enemy.explode()
 		elif bonus.bonus == bonus.BONUS_HELMET:
 			self.shieldPlayer(player, True, 10000)
 		elif bonus.bonus == bonus.BONUS_SHOVEL:
 			self.level.buildFortress(self.level.TILE_STEEL)
-			gtimer.add(10000, lambda :self.level.buildFortress(self.level.TILE_BRICK), 1)
+			world.timer.add(10000, self.level.buildFortress, 1, (self.level.TILE_BRICK,))
 		elif bonus.bonus == bonus.BONUS_STAR:
 			player.superpowers += 1
 			if player.superpowers == 2:
@@ -1347,10 +2520,10 @@ class Game():
 			player.lives += 1
 		elif bonus.bonus == bonus.BONUS_TIMER:
 			self.toggleEnemyFreeze(True)
-			gtimer.add(10000, lambda :self.toggleEnemyFreeze(False), 1)
-		bonuses.remove(bonus)
+			world.timer.add(10000, self.toggleEnemyFreeze, 1, (False,))
+		self.level.removeBonus(bonus)
 
-		labels.append(Label(bonus.rect.topleft, "500", 500))
+		world.labels.append(Label(world, bonus.rect.topleft, "500", 500))
 
 	def shieldPlayer(self, player, shield = True, duration = None):
 		""" Add/remove shield
@@ -1360,12 +2533,12 @@ class Game():
 		"""
 		player.shielded = shield
 		if shield:
-			player.timer_uuid_shield = gtimer.add(100, lambda :player.toggleShieldImage())
+			player.timer_uuid_shield = self.world.timer.add(100, player.toggleShieldImage)
 		else:
-			gtimer.destroy(player.timer_uuid_shield)
+			self.world.timer.destroy(player.timer_uuid_shield)
 
 		if shield and duration != None:
-			gtimer.add(duration, lambda :self.shieldPlayer(player, False), 1)
+			self.world.timer.add(duration, self.shieldPlayer, 1, (player, False))
 
 
 	def spawnEnemy(self):
@@ -1376,15 +2549,16 @@ class Game():
 			- now isn't timefreeze
 		"""
 
-		global enemies
+		world = self.world
 
-		if len(enemies) >= self.level.max_active_enemies:
+		if len(world.enemies) >= self.level.max_active_enemies:
 			return
 		if len(self.level.enemies_left) < 1 or self.timefreeze:
 			return
-		enemy = Enemy(self.level, 1)
+		enemy = Enemy(world, self.level, 1, hunter = self.hunters)
 
-		enemies.append(enemy)
+		world.enemies.append(enemy)
+		self.level.spatial.add(enemy)
 
 
 	def respawnPlayer(self, player, clear_scores = False):
@@ -1401,28 +2575,36 @@ class Game():
 	def gameOver(self):
 		""" End game and return to menu """
 
-		global play_sounds, sounds
+		world = self.world
 
-		print "Game Over"
-		if play_sounds:
-			for sound in sounds:
-				sounds[sound].stop()
-			sounds["end"].play()
+		self.game_over = True
+
+		# no "game over" animation and scores in headless mode
+		if self.headless:
+			self.running = False
+			return
+
+		print("Game Over")
+		if world.play_sounds:
+			for sound in world.sounds:
+				world.sounds[sound].stop()
+			world.sounds["end"].play()
+
+		self.stopRecording()
 
 		self.game_over_y = 416+40
 
-		self.game_over = True
-		gtimer.add(3000, lambda :self.showScores(), 1)
+		world.timer.add(3000, self.showScores, 1)
 
 	def gameOverScreen(self):
 		""" Show game over screen """
 
-		global screen
+		world = self.world
 
 		# stop game main loop (if any)
 		self.running = False
 
-		screen.fill([0, 0, 0])
+		world.screen.fill([0, 0, 0])
 
 		self.writeInBricks("game", [125, 140])
 		self.writeInBricks("over", [125, 220])
@@ -1444,13 +2626,13 @@ class Game():
 		exit from this screen and start the game with selected number of players
 		"""
 
-		global players, screen
+		world = self.world
 
 		# stop game main loop (if any)
 		self.running = False
 
 		# clear all timers
-		del gtimer.timers[:]
+		world.timer.clear()
 
 		# set current stage to 0
 		self.stage = 1
@@ -1478,7 +2660,11 @@ class Game():
 					elif event.key == pygame.K_RETURN:
 						main_loop = False
 
-		del players[:]
+		del world.players[:]
+
+		if self.record_filename != None:
+			self.startRecording()
+
 		self.nextLevel()
 
 	def reloadPlayers(self):
@@ -1486,70 +2672,66 @@ class Game():
 		If players already exist, just reset them
 		"""
 
-		global players
+		world = self.world
 
-		if len(players) == 0:
+		if len(world.players) == 0:
 			# first player
-			x = 8 * self.TILE_SIZE + (self.TILE_SIZE * 2 - 26) / 2
-			y = 24 * self.TILE_SIZE + (self.TILE_SIZE * 2 - 26) / 2
+			x = 8 * self.TILE_SIZE + (self.TILE_SIZE * 2 - 26) // 2
+			y = 24 * self.TILE_SIZE + (self.TILE_SIZE * 2 - 26) // 2
 
 			player = Player(
-				self.level, 0, [x, y], self.DIR_UP, (0, 0, 13*2, 13*2)
+				world, self.level, 0, [x, y], self.DIR_UP, self.PLAYER_IMAGES[0]
 			)
-			players.append(player)
+			world.players.append(player)
 
 			# second player
 			if self.nr_of_players == 2:
-				x = 16 * self.TILE_SIZE + (self.TILE_SIZE * 2 - 26) / 2
-				y = 24 * self.TILE_SIZE + (self.TILE_SIZE * 2 - 26) / 2
+				x = 16 * self.TILE_SIZE + (self.TILE_SIZE * 2 - 26) // 2
+				y = 24 * self.TILE_SIZE + (self.TILE_SIZE * 2 - 26) // 2
 				player = Player(
-					self.level, 0, [x, y], self.DIR_UP, (16*2, 0, 13*2, 13*2)
+					world, self.level, 0, [x, y], self.DIR_UP, self.PLAYER_IMAGES[1]
 				)
 				player.controls = [102, 119, 100, 115, 97]
-				players.append(player)
+				world.players.append(player)
 
-		for player in players:
+		for player in world.players:
 			player.level = self.level
+			self.level.spatial.add(player)
 			self.respawnPlayer(player, True)
 
 	def showScores(self):
 		""" Show level scores """
 
-		global screen, sprites, players, play_sounds, sounds
+		world = self.world
 
 		# stop game main loop (if any)
 		self.running = False
 
 		# clear all timers
-		del gtimer.timers[:]
+		world.timer.clear()
 
-		if play_sounds:
-			for sound in sounds:
-				sounds[sound].stop()
+		if world.play_sounds:
+			for sound in world.sounds:
+				world.sounds[sound].stop()
 
 		hiscore = self.loadHiscore()
 
 		# update hiscore if needed
-		if players[0].score > hiscore:
-			hiscore = players[0].score
+		if world.players[0].score > hiscore:
+			hiscore = world.players[0].score
 			self.saveHiscore(hiscore)
-		if self.nr_of_players == 2 and players[1].score > hiscore:
-			hiscore = players[1].score
+		if self.nr_of_players == 2 and world.players[1].score > hiscore:
+			hiscore = world.players[1].score
 			self.saveHiscore(hiscore)
 
-		img_tanks = [
-			sprites.subsurface(32*2, 0, 13*2, 15*2),
-			sprites.subsurface(48*2, 0, 13*2, 15*2),
-			sprites.subsurface(64*2, 0, 13*2, 15*2),
-			sprites.subsurface(80*2, 0, 13*2, 15*2)
-		]
+		img_tanks = [world.atlas.enemies[i][0][self.DIR_UP] for i in range(4)]
 
 		img_arrows = [
-			sprites.subsurface(81*2, 48*2, 7*2, 7*2),
-			sprites.subsurface(88*2, 48*2, 7*2, 7*2)
+			world.atlas.image((81*2, 48*2, 7*2, 7*2)),
+			world.atlas.image((88*2, 48*2, 7*2, 7*2))
 		]
 
-		screen.fill([0, 0, 0])
+		world.screen.fill([0, 0, 0])
 
 		# colors
 		black = pygame.Color("black")
@@ -1557,33 +2739,33 @@ class Game():
 		purple = pygame.Color(127, 64, 64)
 		pink = pygame.Color(191, 160, 128)
 
-		screen.blit(self.font.render("HI-SCORE", False, purple), [105, 35])
-		screen.blit(self.font.render(str(hiscore), False, pink), [295, 35])
+		world.screen.blit(self.font.render("HI-SCORE", False, purple), [105, 35])
+		world.screen.blit(self.font.render(str(hiscore), False, pink), [295, 35])
 
-		screen.blit(self.font.render("STAGE"+str(self.stage).rjust(3), False, white), [170, 65])
+		world.screen.blit(self.font.render("STAGE"+str(self.stage).rjust(3), False, white), [170, 65])
 
-		screen.blit(self.font.render("I-PLAYER", False, purple), [25, 95])
+		world.screen.blit(self.font.render("I-PLAYER", False, purple), [25, 95])
 
 		#player 1 global score
-		screen.blit(self.font.render(str(players[0].score).rjust(8), False, pink), [25, 125])
+		world.screen.blit(self.font.render(str(world.players[0].score).rjust(8), False, pink), [25, 125])
 
 		if self.nr_of_players == 2:
-			screen.blit(self.font.render("II-PLAYER", False, purple), [310, 95])
+			world.screen.blit(self.font.render("II-PLAYER", False, purple), [310, 95])
 
 			#player 2 global score
-			screen.blit(self.font.render(str(players[1].score).rjust(8), False, pink), [325, 125])
+			world.screen.blit(self.font.render(str(world.players[1].score).rjust(8), False, pink), [325, 125])
 
 		# tanks and arrows
 		for i in range(4):
-			screen.blit(img_tanks[i], [226, 160+(i*45)])
-			screen.blit(img_arrows[0], [206, 168+(i*45)])
+			world.screen.blit(img_tanks[i], [226, 160+(i*45)])
+			world.screen.blit(img_arrows[0], [206, 168+(i*45)])
 			if self.nr_of_players == 2:
-				screen.blit(img_arrows[1], [258, 168+(i*45)])
+				world.screen.blit(img_arrows[1], [258, 168+(i*45)])
 
-		screen.blit(self.font.render("TOTAL", False, white), [70, 335])
+		world.screen.blit(self.font.render("TOTAL", False, white), [70, 335])
 
 		# total underline
-		pygame.draw.line(screen, white, [170, 330], [307, 330], 4)
+		pygame.draw.line(world.screen, white, [170, 330], [307, 330], 4)
 
 		pygame.display.flip()
 
@@ -1595,36 +2777,36 @@ class Game():
 		for i in range(4):
 
 			# total specific tanks
-			tanks = players[0].trophies["enemy"+str(i)]
+			tanks = world.players[0].trophies["enemy"+str(i)]
 
 			for n in range(tanks+1):
-				if n > 0 and play_sounds:
-					sounds["score"].play()
+				if n > 0 and world.play_sounds:
+					world.sounds["score"].play()
 
 				# erase previous text
-				screen.blit(self.font.render(str(n-1).rjust(2), False, black), [170, 168+(i*45)])
+				world.screen.blit(self.font.render(str(n-1).rjust(2), False, black), [170, 168+(i*45)])
 				# print new number of enemies
-				screen.blit(self.font.render(str(n).rjust(2), False, white), [170, 168+(i*45)])
+				world.screen.blit(self.font.render(str(n).rjust(2), False, white), [170, 168+(i*45)])
 				# erase previous text
-				screen.blit(self.font.render(str((n-1) * (i+1) * 100).rjust(4)+" PTS", False, black), [25, 168+(i*45)])
+				world.screen.blit(self.font.render(str((n-1) * (i+1) * 100).rjust(4)+" PTS", False, black), [25, 168+(i*45)])
 				# print new total points per enemy
-				screen.blit(self.font.render(str(n * (i+1) * 100).rjust(4)+" PTS", False, white), [25, 168+(i*45)])
+				world.screen.blit(self.font.render(str(n * (i+1) * 100).rjust(4)+" PTS", False, white), [25, 168+(i*45)])
 				pygame.display.flip()
 				self.clock.tick(interval)
 
 			if self.nr_of_players == 2:
-				tanks = players[1].trophies["enemy"+str(i)]
+				tanks = world.players[1].trophies["enemy"+str(i)]
 
 				for n in range(tanks+1):
 
-					if n > 0 and play_sounds:
-						sounds["score"].play()
+					if n > 0 and world.play_sounds:
+						world.sounds["score"].play()
 
-					screen.blit(self.font.render(str(n-1).rjust(2), False, black), [277, 168+(i*45)])
-					screen.blit(self.font.render(str(n).rjust(2), False, white), [277, 168+(i*45)])
+					world.screen.blit(self.font.render(str(n-1).rjust(2), False, black), [277, 168+(i*45)])
+					world.screen.blit(self.font.render(str(n).rjust(2), False, white), [277, 168+(i*45)])
 
-					screen.blit(self.font.render(str((n-1) * (i+1) * 100).rjust(4)+" PTS", False, black), [325, 168+(i*45)])
-					screen.blit(self.font.render(str(n * (i+1) * 100).rjust(4)+" PTS", False, white), [325, 168+(i*45)])
+					world.screen.blit(self.font.render(str((n-1) * (i+1) * 100).rjust(4)+" PTS", False, black), [325, 168+(i*45)])
+					world.screen.blit(self.font.render(str(n * (i+1) * 100).rjust(4)+" PTS", False, white), [325, 168+(i*45)])
 
 					pygame.display.flip()
 					self.clock.tick(interval)
@@ -1632,11 +2814,11 @@ class Game():
 			self.clock.tick(interval)
 
 		# total tanks
-		tanks = sum([i for i in players[0].trophies.values()]) - players[0].trophies["bonus"]
-		screen.blit(self.font.render(str(tanks).rjust(2), False, white), [170, 335])
+		tanks = sum([i for i in world.players[0].trophies.values()]) - world.players[0].trophies["bonus"]
+		world.screen.blit(self.font.render(str(tanks).rjust(2), False, white), [170, 335])
 		if self.nr_of_players == 2:
-			tanks = sum([i for i in players[1].trophies.values()]) - players[1].trophies["bonus"]
-			screen.blit(self.font.render(str(tanks).rjust(2), False, white), [277, 335])
+			tanks = sum([i for i in world.players[1].trophies.values()]) - world.players[1].trophies["bonus"]
+			world.screen.blit(self.font.render(str(tanks).rjust(2), False, white), [277, 335])
 
 		pygame.display.flip()
 
@@ -1650,55 +2832,159 @@ class Game():
 			self.nextLevel()
 
 
-	def draw(self):
-		global screen, castle, players, enemies, bullets, bonuses
+	def draw(self, alpha = 1.0):
+		""" Draw whole game screen
+		In dirty rectangle mode only first frame of stage is drawn here, the rest are
+		handled by drawDirty()
+		@param float alpha How far between previous and current tick to draw
+			moving sprites, see interpolate()
+		"""
+
+		world = self.world
+
+		if self.dirty_rendering and self.drawn_rects != None:
+			self.drawDirty(alpha)
+			return
+
+		# terrain covers whole map, sidebar is filled by drawSidebar()
+		self.level.drawTerrain()
+		self.level.dirty_cells = []
+		self.profiler.lap("draw.terrain", True)
+
+		world.screen.set_clip(self.MAP_RECT)
+
+		self.drawn_rects = self.drawSprites(alpha)
+
+		self.level.drawGrass()
+
+		if self.game_over:
+			self.drawn_rects.append(self.drawGameOver())
+
+		world.screen.set_clip(None)
+		self.profiler.lap("draw.grass", True)
 
-		screen.fill([0, 0, 0])
+		self.drawSidebar()
+		self.sidebar_state = self.getSidebarState()
+		self.profiler.lap("draw.sidebar", True)
 
-		self.level.draw([self.level.TILE_EMPTY, self.level.TILE_BRICK, self.level.TILE_STEEL, self.level.TILE_FROZE, self.level.TILE_WATER])
+		pygame.display.flip()
 
-		castle.draw()
+	def drawDirty(self, alpha = 1.0):
+		""" Redraw only those parts of the map that have changed since last frame:
+		areas covered by sprites in last and current frame and repainted tiles.
+		Sidebar is redrawn only when something on it changes. Only these areas are
+		pushed to display
+		"""
 
-		for enemy in enemies:
-			enemy.draw()
+		world = self.world
 
-		for label in labels:
-			label.draw()
+		level = self.level
 
-		for player in players:
-			player.draw()
+		# restore terrain under last frame's sprites
+		restored = self.drawn_rects + level.dirty_cells
+		level.dirty_cells = []
+		for rect in restored:
+			world.screen.blit(level.terrain, rect, rect)
+		self.profiler.lap("draw.terrain", True)
 
-		for bullet in bullets:
-			bullet.draw()
+		world.screen.set_clip(self.MAP_RECT)
 
-		for bonus in bonuses:
-			bonus.draw()
+		rects = self.drawSprites(alpha)
 
-		self.level.draw([self.level.TILE_GRASS])
+		for rect in restored + rects:
+			world.screen.blit(level.grass, rect, rect)
 
 		if self.game_over:
-			if self.game_over_y > 188:
-				self.game_over_y -= 4
-			screen.blit(self.im_game_over, [176, self.game_over_y]) # 176=(416-64)/2
+			rects.append(self.drawGameOver())
 
-		self.drawSidebar()
+		world.screen.set_clip(None)
+		self.profiler.lap("draw.grass", True)
 
-		pygame.display.flip()
+		self.drawn_rects = rects
+
+		updated = restored + rects
+
+		sidebar_state = self.getSidebarState()
+		if sidebar_state != self.sidebar_state:
+			self.drawSidebar(sidebar_state)
+			self.sidebar_state = sidebar_state
+			updated.append(self.SIDEBAR_RECT)
+		self.profiler.lap("draw.sidebar", True)
+
+		pygame.display.update(updated)
+
+	def drawSprites(self, alpha = 1.0):
+		""" Draw everything between terrain and grass
+		@param float alpha See draw()
+		@return list Areas of screen drawn over
+		"""
+
+		world = self.world
+
+		profiler = self.profiler
+
+		rects = [world.castle.draw()]
+		profiler.lap("draw.castle", True)
+
+		for enemy in world.enemies:
+			rects.append(enemy.draw(alpha))
+		profiler.lap("draw.enemies", True)
 
-	def drawSidebar(self):
+		for label in world.labels:
+			rects.append(label.draw())
+		profiler.lap("draw.labels", True)
 
-		global screen, players, enemies
+		for player in world.players:
+			rects.append(player.draw(alpha))
+		profiler.lap("draw.players", True)
+
+		for bullet in world.bullets:
+			rects.append(bullet.draw(alpha))
+		profiler.lap("draw.bullets", True)
+
+		for bonus in world.bonuses:
+			rects.append(bonus.draw())
+		profiler.lap("draw.bonuses", True)
+
+		return [rect for rect in rects if rect != None]
+
+	def drawGameOver(self):
+		""" Draw "game over" text sliding up
+		@return pygame.Rect Area of screen drawn over
+		"""
+
+		world = self.world
+
+		return world.screen.blit(self.im_game_over, [176, self.game_over_y]) # 176=(416-64)/2
+
+	def getSidebarState(self):
+		""" Everything that is shown in sidebar. If it changes, sidebar has to be redrawn """
+
+		world = self.world
+
+		return (len(self.level.enemies_left) + len(world.enemies), [player.lives for player in world.players], self.stage)
+
+	def drawSidebar(self, state = None):
+		""" Draw enemies left, players' lives and stage
+		@param tuple state What to show, see getSidebarState(). None for current game's
+		"""
+
+		world = self.world
+
+		if state == None:
+			state = self.getSidebarState()
+		enemies, lives, stage = state
 
 		x = 416
 		y = 0
-		screen.fill([100, 100, 100], pygame.Rect([416, 0], [64, 416]))
+		world.screen.fill([100, 100, 100], self.SIDEBAR_RECT)
 
 		xpos = x + 16
 		ypos = y + 16
 
 		# draw enemy lives
-		for n in range(len(self.level.enemies_left) + len(enemies)):
-			screen.blit(self.enemy_life_image, [xpos, ypos])
+		for n in range(enemies):
+			world.screen.blit(self.enemy_life_image, [xpos, ypos])
 			if n % 2 == 1:
 				xpos = x + 16
 				ypos+= 17
@@ -1708,18 +2994,18 @@ class Game():
 		# players' lives
 		if pygame.font.get_init():
 			text_color = pygame.Color('black')
-			for n in range(len(players)):
+			for n in range(len(lives)):
 				if n == 0:
-					screen.blit(self.font.render(str(n+1)+"P", False, text_color), [x+16, y+200])
-					screen.blit(self.font.render(str(players[n].lives), False, text_color), [x+31, y+215])
-					screen.blit(self.player_life_image, [x+17, y+215])
+					world.screen.blit(self.font.render(str(n+1)+"P", False, text_color), [x+16, y+200])
+					world.screen.blit(self.font.render(str(lives[n]), False, text_color), [x+31, y+215])
+					world.screen.blit(self.player_life_image, [x+17, y+215])
 				else:
-					screen.blit(self.font.render(str(n+1)+"P", False, text_color), [x+16, y+240])
-					screen.blit(self.font.render(str(players[n].lives), False, text_color), [x+31, y+255])
-					screen.blit(self.player_life_image, [x+17, y+255])
+					world.screen.blit(self.font.render(str(n+1)+"P", False, text_color), [x+16, y+240])
+					world.screen.blit(self.font.render(str(lives[n]), False, text_color), [x+31, y+255])
+					world.screen.blit(self.player_life_image, [x+17, y+255])
 
-			screen.blit(self.flag_image, [x+17, y+280])
-			screen.blit(self.font.render(str(self.stage), False, text_color), [x+17, y+312])
+			world.screen.blit(self.flag_image, [x+17, y+280])
+			world.screen.blit(self.font.render(str(stage), False, text_color), [x+17, y+312])
 
 
 	def drawIntroScreen(self, put_on_surface = True):
@@ -1728,27 +3014,27 @@ class Game():
 		@return None
 		"""
 
-		global screen
+		world = self.world
 
-		screen.fill([0, 0, 0])
+		world.screen.fill([0, 0, 0])
 
 		if pygame.font.get_init():
 
 			hiscore = self.loadHiscore()
 
-			screen.blit(self.font.render("HI- "+str(hiscore), True, pygame.Color('white')), [170, 35])
+			world.screen.blit(self.font.render("HI- "+str(hiscore), True, pygame.Color('white')), [170, 35])
 
-			screen.blit(self.font.render("1 PLAYER", True, pygame.Color('white')), [165, 250])
-			screen.blit(self.font.render("2 PLAYERS", True, pygame.Color('white')), [165, 275])
+			world.screen.blit(self.font.render("1 PLAYER", True, pygame.Color('white')), [165, 250])
+			world.screen.blit(self.font.render("2 PLAYERS", True, pygame.Color('white')), [165, 275])
 
-			screen.blit(self.font.render("(c) 1980 1985 NAMCO LTD.", True, pygame.Color('white')), [50, 350])
-			screen.blit(self.font.render("ALL RIGHTS RESERVED", True, pygame.Color('white')), [85, 380])
+			world.screen.blit(self.font.render("(c) 1980 1985 NAMCO LTD.", True, pygame.Color('white')), [50, 350])
+			world.screen.blit(self.font.render("ALL RIGHTS RESERVED", True, pygame.Color('white')), [85, 380])
 
 
 		if self.nr_of_players == 1:
-			screen.blit(self.player_image, [125, 245])
+			world.screen.blit(self.player_image, [125, 245])
 		elif self.nr_of_players == 2:
-			screen.blit(self.player_image, [125, 270])
+			world.screen.blit(self.player_image, [125, 270])
 
 		self.writeInBricks("battle", [65, 80])
 		self.writeInBricks("city", [129, 160])
@@ -1762,12 +3048,12 @@ class Game():
 		@return None
 		"""
 
-		global screen
+		world = self.world
 
 		self.drawIntroScreen(False)
-		screen_cp = screen.copy()
+		screen_cp = world.screen.copy()
 
-		screen.fill([0, 0, 0])
+		world.screen.fill([0, 0, 0])
 
 		y = 416
 		while (y > 0):
@@ -1778,11 +3064,11 @@ class Game():
 						y = 0
 						break
 
-			screen.blit(screen_cp, [0, y])
+			world.screen.blit(screen_cp, [0, y])
 			pygame.display.flip()
 			y -= 5
 
-		screen.blit(screen_cp, [0, 0])
+		world.screen.blit(screen_cp, [0, 0])
 		pygame.display.flip()
 
 
@@ -1803,9 +3089,9 @@ class Game():
 		@return None
 		"""
 
-		global screen, sprites
+		world = self.world
 
-		bricks = sprites.subsurface(56*2, 64*2, 8*2, 8*2)
+		bricks = world.atlas.sprites.subsurface(56*2, 64*2, 8*2, 8*2)
 		brick1 = bricks.subsurface((0, 0, 8, 8))
 		brick2 = bricks.subsurface((8, 0, 8, 8))
 		brick3 = bricks.subsurface((8, 8, 8, 8))
@@ -1855,18 +3141,26 @@ class Game():
 					x += 8
 				x = 0
 				y += 8
-			screen.blit(surf_letter, [abs_x, abs_y])
+			world.screen.blit(surf_letter, [abs_x, abs_y])
 			abs_x += letter_w + 16
 
 	def toggleEnemyFreeze(self, freeze = True):
 		""" Freeze/defreeze all enemies """
 
-		global enemies
+		world = self.world
 
-		for enemy in enemies:
+		for enemy in world.enemies:
 			enemy.paused = freeze
 		self.timefreeze = freeze
 
+	def playMusic(self):
+		""" Start background music, after stage's intro tune """
+
+		world = self.world
+
+		if world.play_sounds:
+			world.sounds["bg"].play(-1)
+
 
 	def loadHiscore(self):
 		""" Load hiscore
@@ -1883,7 +3177,7 @@ class Game():
 		if hiscore > 19999 and hiscore < 1000000:
 			return hiscore
 		else:
-			print "cheater =["
+			print("cheater =[")
 			return 20000
 
 	def saveHiscore(self, hiscore):
@@ -1893,7 +3187,7 @@ class Game():
 		try:
 			f = open(".hiscore", "w")
 		except:
-			print "Can't save hi-score"
+			print("Can't save hi-score")
 			return False
 		f.write(str(hiscore))
 		f.close()
@@ -1905,58 +3199,54 @@ class Game():
 		Show earned scores and advance to the next stage
 		"""
 
-		global play_sounds, sounds
+		world = self.world
 
-		if play_sounds:
-			sounds["bg"].stop()
+		if world.play_sounds:
+			world.sounds["bg"].stop()
 
 		self.active = False
-		gtimer.add(3000, lambda :self.showScores(), 1)
 
-		print "Stage "+str(self.stage)+" completed"
+		# in headless mode next stage is started by simulate()
+		if self.headless:
+			self.running = False
+			return
 
-	def nextLevel(self):
-		""" Start next level """
+		world.timer.add(3000, self.showScores, 1)
 
-		global castle, players, bullets, bonuses, play_sounds, sounds
+		print("Stage "+str(self.stage)+" completed")
 
-		del bullets[:]
-		del enemies[:]
-		del bonuses[:]
-		castle.rebuild()
-		del gtimer.timers[:]
+	def startLevel(self):
+		""" Load next stage and reset everything on it, but don't enter main loop """
+
+		world = self.world
+
+		del world.bullets[:]
+		del world.enemies[:]
+		del world.bonuses[:]
+		world.castle.rebuild()
+		world.timer.clear()
 
 		# load level
 		self.stage += 1
-		self.level = Level(self.stage)
+		self.level = Level(world, self.stage, self.level_pack)
+		self.profiler.setStage(self.stage)
 		self.timefreeze = False
 
-		# set number of enemies by types (basic, fast, power, armor) according to level
-		levels_enemies = (
-			(18,2,0,0), (14,4,0,2), (14,4,0,2), (2,5,10,3), (8,5,5,2),
-			(9,2,7,2), (7,4,6,3), (7,4,7,2), (6,4,7,3), (12,2,4,2),
-			(5,5,4,6), (0,6,8,6), (0,8,8,4), (0,4,10,6), (0,2,10,8),
-			(16,2,0,2), (8,2,8,2), (2,8,6,4), (4,4,4,8), (2,8,2,8),
-			(6,2,8,4), (6,8,2,4), (0,10,4,6), (10,4,4,2), (0,8,2,10),
-			(4,6,4,6), (2,8,2,8), (15,2,2,1), (0,4,10,6), (4,8,4,4),
-			(3,8,3,6), (6,4,2,8), (4,4,4,8), (0,10,4,6), (0,6,4,10)
-		)
-
-		if self.stage <= 35:
-			enemies_l = levels_enemies[self.stage - 1]
-		else:
-			enemies_l = levels_enemies[34]
+		enemies_l = self.level.enemies_by_type
 
 		self.level.enemies_left = [0]*enemies_l[0] + [1]*enemies_l[1] + [2]*enemies_l[2] + [3]*enemies_l[3]
-		random.shuffle(self.level.enemies_left)
+		world.rng.shuffle(self.level.enemies_left)
 
-		if play_sounds:
-			sounds["start"].play()
-			gtimer.add(4330, lambda :sounds["bg"].play(-1), 1)
+		if self.recording != None:
+			self.recording.startStage()
+
+		if world.play_sounds:
+			world.sounds["start"].play()
+			world.timer.add(4330, self.playMusic, 1)
 
 		self.reloadPlayers()
 
-		gtimer.add(3000, lambda :self.spawnEnemy())
+		world.timer.add(3000, self.spawnEnemy)
 
 		# if True, start "game over" animation
 		self.game_over = False
@@ -1967,135 +3257,663 @@ class Game():
 		# if False, players won't be able to do anything
 		self.active = True
 
+		# start with full redraw
+		self.drawn_rects = None
+
+	def getDisplayFps(self):
+		""" Refresh rate of display, if pygame can tell (pygame 2.2+) """
+
+		try:
+			rates = pygame.display.get_desktop_refresh_rates()
+		except (AttributeError, pygame.error):
+			return self.DEFAULT_FPS
+
+		if rates and rates[0] > 0:
+			return rates[0]
+		return self.DEFAULT_FPS
+
+	def storePositions(self):
+		""" Remember where moving sprites are before next tick, so frames drawn
+		between ticks can place them in between, see interpolate()
+		"""
+
+		world = self.world
+
+		for tank in world.players:
+			tank.last_position = tank.rect.topleft
+		for tank in world.enemies:
+			tank.last_position = tank.rect.topleft
+		for bullet in world.bullets:
+			bullet.last_position = bullet.rect.topleft
+
+	def nextLevel(self):
+		""" Start next level
+		Game ticks are fixed TICK_MS long and real time is spent on them as it
+		passes, no matter how many frames are drawn meanwhile: slow frames play
+		several ticks at once (and so drop frames), fast ones none and just draw
+		sprites between last two ticks' positions
+		"""
+
+		self.startLevel()
+
 		self.draw()
 
+		# real time not spent on ticks yet, in ms
+		lag = 0
+
 		while self.running:
 
-			time_passed = self.clock.tick(50)
+			lag += self.clock.tick(self.fps)
 
-			for event in pygame.event.get():
-				if event.type == pygame.MOUSEBUTTONDOWN:
-					pass
-				elif event.type == pygame.QUIT:
-					quit()
-				elif event.type == pygame.KEYDOWN and not self.game_over and self.active:
+			# ticks are profiled one by one, events and drawing once per frame
+			self.profiler.startFrame()
 
-					if event.key == pygame.K_q:
-						quit()
-					# toggle sounds
-					elif event.key == pygame.K_m:
-						play_sounds = not play_sounds
-						if not play_sounds:
-							pygame.mixer.stop()
-						else:
-							sounds["bg"].play(-1)
-
-					for player in players:
-						if player.state == player.STATE_ALIVE:
-							try:
-								index = player.controls.index(event.key)
-							except:
-								pass
-							else:
-								if index == 0:
-									if player.fire() and play_sounds:
-										sounds["fire"].play()
-								elif index == 1:
-									player.pressed[0] = True
-								elif index == 2:
-									player.pressed[1] = True
-								elif index == 3:
-									player.pressed[2] = True
-								elif index == 4:
-									player.pressed[3] = True
-				elif event.type == pygame.KEYUP and not self.game_over and self.active:
-					for player in players:
-						if player.state == player.STATE_ALIVE:
-							try:
-								index = player.controls.index(event.key)
-							except:
-								pass
-							else:
-								if index == 1:
-									player.pressed[0] = False
-								elif index == 2:
-									player.pressed[1] = False
-								elif index == 3:
-									player.pressed[2] = False
-								elif index == 4:
-									player.pressed[3] = False
-
-			for player in players:
-				if player.state == player.STATE_ALIVE and not self.game_over and self.active:
-					if player.pressed[0] == True:
-						player.move(self.DIR_UP);
-					elif player.pressed[1] == True:
-						player.move(self.DIR_RIGHT);
-					elif player.pressed[2] == True:
-						player.move(self.DIR_DOWN);
-					elif player.pressed[3] == True:
-						player.move(self.DIR_LEFT);
-				player.update(time_passed)
-
-			for enemy in enemies:
-				if enemy.state == enemy.STATE_DEAD and not self.game_over and self.active:
-					enemies.remove(enemy)
-					if len(self.level.enemies_left) == 0 and len(enemies) == 0:
-						self.finishLevel()
-				else:
-					enemy.update(time_passed)
+			self.handleEvents()
+			self.profiler.lap("events")
+
+			ticks = 0
+			while lag >= self.TICK_MS and self.running:
+				if ticks == self.MAX_CATCH_UP_TICKS:
+					lag = 0
+					break
 
-			if not self.game_over and self.active:
-				for player in players:
+				self.profiler.startTick()
+
+				if self.recording != None:
+					self.recording.addTick(tuple([self.getInput(player) for player in self.world.players]))
+				for player in self.world.players:
+					player.fire_presses = 0
+
+				self.storePositions()
+				self.profiler.lap("record")
+
+				self.update(self.TICK_MS)
+				self.profiler.endTick()
+
+				lag -= self.TICK_MS
+				ticks += 1
+
+			self.draw(float(lag) / self.TICK_MS)
+			self.profiler.lap("draw")
+
+			self.profiler.endFrame()
+
+	def handleEvents(self):
+		""" Process keyboard/window events """
+
+		world = self.world
+
+		for event in pygame.event.get():
+			if event.type == pygame.MOUSEBUTTONDOWN:
+				pass
+			elif event.type == pygame.QUIT:
+				quit()
+			elif event.type == pygame.KEYDOWN and not self.game_over and self.active:
+
+				if event.key == pygame.K_q:
+					quit()
+				# save trace of next 250 ticks, see profiler.py
+				elif event.key == pygame.K_F9:
+					filename = "trace-" + time.strftime("%Y%m%d-%H%M%S") + ".json"
+					self.profiler.startTrace(filename, 250)
+					print("Saving trace to " + filename)
+				# toggle sounds
+				elif event.key == pygame.K_m:
+					world.play_sounds = not world.play_sounds
+					if not world.play_sounds:
+						pygame.mixer.stop()
+					else:
+						world.sounds["bg"].play(-1)
+
+				for player in world.players:
+					if player.state == player.STATE_ALIVE:
+						try:
+							index = player.controls.index(event.key)
+						except:
+							pass
+						else:
+							if index == 0:
+								player.fire_presses += 1
+								if player.fire() and world.play_sounds:
+									world.sounds["fire"].play()
+							elif index == 1:
+								player.pressed[0] = True
+							elif index == 2:
+								player.pressed[1] = True
+							elif index == 3:
+								player.pressed[2] = True
+							elif index == 4:
+								player.pressed[3] = True
+			elif event.type == pygame.KEYUP and not self.game_over and self.active:
+				for player in world.players:
 					if player.state == player.STATE_ALIVE:
-						if player.bonus != None and player.side == player.SIDE_PLAYER:
-							self.triggerBonus(bonus, player)
-							player.bonus = None
-					elif player.state == player.STATE_DEAD:
-						self.superpowers = 0
-						player.lives -= 1
-						if player.lives > 0:
-							self.respawnPlayer(player)
+						try:
+							index = player.controls.index(event.key)
+						except:
+							pass
 						else:
-							self.gameOver()
+							if index == 1:
+								player.pressed[0] = False
+							elif index == 2:
+								player.pressed[1] = False
+							elif index == 3:
+								player.pressed[2] = False
+							elif index == 4:
+								player.pressed[3] = False
 
-			for bullet in bullets:
-				if bullet.state == bullet.STATE_REMOVED:
-					bullets.remove(bullet)
-				else:
-					bullet.update()
+	def update(self, time_passed):
+		""" Advance game world by one tick
+		@param int time_passed Duration of the tick in ms
+		@return None
+		"""
 
-			for bonus in bonuses:
-				if bonus.active == False:
-					bonuses.remove(bonus)
+		world = self.world
+
+		for player in world.players:
+			if player.state == player.STATE_ALIVE and not self.game_over and self.active:
+				if player.pressed[0] == True:
+					player.move(self.DIR_UP);
+				elif player.pressed[1] == True:
+					player.move(self.DIR_RIGHT);
+				elif player.pressed[2] == True:
+					player.move(self.DIR_DOWN);
+				elif player.pressed[3] == True:
+					player.move(self.DIR_LEFT);
+			player.update(time_passed)
+		self.profiler.lap("players")
+
+		for enemy in world.enemies:
+			if enemy.state == enemy.STATE_DEAD and not self.game_over and self.active:
+				world.enemies.remove(enemy)
+				self.level.spatial.remove(enemy)
+				if len(self.level.enemies_left) == 0 and len(world.enemies) == 0:
+					self.finishLevel()
+			else:
+				enemy.update(time_passed)
+		self.profiler.lap("enemies")
+
+		if not self.game_over and self.active:
+			for player in world.players:
+				if player.state == player.STATE_ALIVE:
+					if player.bonus != None and player.side == player.SIDE_PLAYER:
+						self.triggerBonus(player.bonus, player)
+						player.bonus = None
+				elif player.state == player.STATE_DEAD:
+					self.superpowers = 0
+					player.lives -= 1
+					if player.lives > 0:
+						self.respawnPlayer(player)
+					else:
+						self.gameOver()
+		self.profiler.lap("players")
+
+		for bullet in world.bullets:
+			if bullet.state == bullet.STATE_REMOVED:
+				world.bullets.remove(bullet)
+				self.level.spatial.remove(bullet)
+			else:
+				bullet.update()
+		self.profiler.lap("bullets")
 
-			for label in labels:
-				if not label.active:
-					labels.remove(label)
+		for bonus in world.bonuses:
+			if bonus.active == False:
+				self.level.removeBonus(bonus)
 
-			if not self.game_over:
-				if not castle.active:
-					self.gameOver()
+		for label in world.labels:
+			if not label.active:
+				world.labels.remove(label)
 
-			gtimer.update(time_passed)
+		if not self.game_over:
+			if not world.castle.active:
+				self.gameOver()
+		elif self.game_over_y > 188:
+			# slide "game over" text up
+			self.game_over_y -= 4
+		self.profiler.lap("cleanup")
 
-			self.draw()
+		world.timer.update(time_passed)
+		self.profiler.lap("timers")
 
-if __name__ == "__main__":
+	def autopilot(self, player):
+		""" Drive player in headless mode: wander around and shoot whenever possible """
+
+		world = self.world
+
+		if player.state != player.STATE_ALIVE:
+			return
+
+		# change direction now and then
+		if world.rng.randint(1, 25) == 1:
+			player.pressed = [False] * 4
+			player.pressed[world.rng.randint(0, 3)] = True
+
+		# don't shoot own castle
+		if player.direction == self.DIR_UP:
+			line = pygame.Rect(player.rect.left, 0, player.rect.width, player.rect.top)
+		elif player.direction == self.DIR_RIGHT:
+			line = pygame.Rect(player.rect.right, player.rect.top, 416 - player.rect.right, player.rect.height)
+		elif player.direction == self.DIR_DOWN:
+			line = pygame.Rect(player.rect.left, player.rect.bottom, player.rect.width, 416 - player.rect.bottom)
+		else:
+			line = pygame.Rect(0, player.rect.top, player.rect.left, player.rect.height)
+
+		if not line.colliderect(world.castle.rect):
+			player.fire()
+
+	def getInput(self, player):
+		""" Encode buttons player is holding and fire presses during tick
+		@return int See replay.py
+		"""
+		value = min(player.fire_presses, 3) << 4
+		for i in range(4):
+			if player.pressed[i]:
+				value |= 1 << i
+		return value
+
+	def setInput(self, player, value):
+		""" Press player's buttons as encoded by getInput() """
+
+		world = self.world
+
+		player.pressed = [value & (1 << i) != 0 for i in range(4)]
+		for i in range(value >> 4):
+			if player.fire() and world.play_sounds:
+				world.sounds["fire"].play()
 
-	gtimer = Timer()
+	def applyInput(self, player, buttons, presses = 0):
+		""" Press player's buttons and fire as remote or scripted input asks, as keys
+		in handleEvents() do
+		@param int buttons Buttons held, low bits of getInput()
+		@param int presses Fire presses since last tick, up to 3 are played
+		"""
+
+		value = buttons & 0x0f | min(presses, 3) << 4
+
+		# dead and exploding players can't shoot, no one can once stage is over
+		if player.state != player.STATE_ALIVE or self.game_over or not self.active:
+			value &= 0x0f
+
+		self.setInput(player, value)
+
+	def startCampaign(self):
+		""" Start first stage with new players, without menu or score screens """
+
+		del self.world.players[:]
+		self.stage = 0
+		self.game_over_y = 416+40
+		self.startLevel()
+
+	def startRecording(self):
+		""" Start recording game into replay
+		Random number generator is seeded and ticks are fixed anyway, so the game
+		can be played back from recorded input alone. Recording stops on game over or
+		quit, see stopRecording()
+		"""
+
+		self.world.rng.seed(self.record_seed)
+		self.recording = Replay(self.record_seed, self.nr_of_players, self.stage + 1)
+
+	def stopRecording(self):
+		""" Save replay being recorded, if any. Later games are not recorded """
+
+		if self.recording == None:
+			return
+
+		self.recording.save(self.record_filename)
+		print("Replay saved to " + self.record_filename)
+
+		# keyframes of replay saved before under the same name don't fit this one
+		if os.path.exists(self.record_filename + Replay.KEYFRAMES_SUFFIX):
+			os.remove(self.record_filename + Replay.KEYFRAMES_SUFFIX)
+
+		self.recording = None
+		self.record_filename = None
+
+	# attributes saved in snapshots as they are, see getSnapshot()
+	SNAPSHOT_FIELDS = ("stage", "nr_of_players", "hunters", "timefreeze", "game_over", "game_over_y", "running", "active")
+
+	def getSnapshot(self):
+		""" Capture game world: current stage and everything on it, timers and random
+		number generator, as plain data - numbers, strings, lists and dicts only.
+		Objects refer to each other by [collection name, index]. Snapshot doesn't
+		change when game goes on, so it can be restored any number of times, see
+		restoreSnapshot(), or saved, see snapshot.py. Settings (level pack, sounds)
+		are not included
+		@return dict
+		"""
+
+		world = self.world
+
+		collections = (("players", world.players), ("enemies", world.enemies), ("bullets", world.bullets), ("bonuses", world.bonuses), ("labels", world.labels))
+
+		refs = {self : ["game", 0], self.level : ["level", 0], world.castle : ["castle", 0]}
+		for name, objects in collections:
+			for i, obj in enumerate(objects):
+				refs[obj] = [name, i]
+
+		# explosions belong to castle, tanks and bullets
+		explosions = []
+		for obj in [world.castle] + world.players + world.enemies + world.bullets:
+			if hasattr(obj, "explosion"):
+				refs[obj.explosion] = ["explosions", len(explosions)]
+				explosions.append(obj.explosion)
+
+		snapshot = {
+			"game" : getFields(self, self.SNAPSHOT_FIELDS),
+			"random" : world.rng.getstate(),
+			"timer" : world.timer.getState(refs),
+			"level" : self.level.getState(),
+			"castle" : world.castle.getState(refs),
+			"explosions" : [explosion.getState() for explosion in explosions]
+		}
+
+		order = self.level.spatial.order
+		for name, objects in collections:
+			states = []
+			for obj in objects:
+				state = obj.getState(refs)
+				# spatial index returns objects in this order
+				state["order"] = order.get(obj)
+				states.append(state)
+			snapshot[name] = states
+
+		return snapshot
+
+	def restoreSnapshot(self, snapshot):
+		""" Put game world into state captured by getSnapshot()
+		Everything on map is created anew, except level of the stage being played,
+		which is only reverted. Snapshot itself isn't changed
+		@param dict snapshot
+		@return None
+		"""
+
+		world = self.world
+
+		# level of the same stage is only brought back, which is much cheaper than
+		# setting it up anew, see Level.revert()
+		level = getattr(self, "level", None)
+		same_stage = level != None and snapshot["game"]["stage"] == self.stage
+
+		setFields(self, snapshot["game"], self.SNAPSHOT_FIELDS)
+		self.profiler.setStage(self.stage)
+
+		if same_stage:
+			level.revert(snapshot["level"])
+		else:
+			level = Level.__new__(Level)
+			level.world = world
+			level.setState(snapshot["level"])
+			self.level = level
+
+		# create all objects first, so they can be linked to each other
+		objects = {"game" : [self], "level" : [level], "castle" : [world.castle]}
+		classes = (("players", Player), ("enemies", Enemy), ("bullets", Bullet), ("bonuses", Bonus), ("labels", Label))
+		for name, cls in classes + (("explosions", Explosion),):
+			objects[name] = [cls.__new__(cls) for state in snapshot[name]]
+			for obj in objects[name]:
+				obj.world = world
+
+		for explosion, state in zip(objects["explosions"], snapshot["explosions"]):
+			explosion.setState(state)
+		world.castle.setState(snapshot["castle"], objects)
+
+		indexed = []
+		for name, cls in classes:
+			for obj, state in zip(objects[name], snapshot[name]):
+				obj.setState(state, objects, level)
+				if state["order"] != None:
+					indexed.append((state["order"], obj))
+
+		world.players[:] = objects["players"]
+		world.enemies[:] = objects["enemies"]
+		world.bullets[:] = objects["bullets"]
+		world.bonuses[:] = objects["bonuses"]
+		world.labels[:] = objects["labels"]
+
+		# same order as before, as objects' order decides who collides first
+		indexed.sort(key = lambda item: item[0])
+		for order, obj in indexed:
+			level.spatial.add(obj)
+
+		world.timer.setState(snapshot["timer"], objects)
+
+		# lists if snapshot went through json
+		state = snapshot["random"]
+		world.rng.setstate((state[0], tuple(state[1]), state[2]))
+
+		# full redraw
+		self.drawn_rects = None
+		self.sidebar_state = None
+
+	def addKeyframe(self):
+		""" Keep snapshot of game at current replay tick in replay, unless it has one """
+		if self.replay_tick not in self.replay.keyframes:
+			self.replay.keyframes[self.replay_tick] = self.getSnapshot()
+
+	def restoreKeyframe(self, replay, tick):
+		""" Go to replay's keyframe
+		@param Replay replay
+		@param int tick Tick keyframe was taken at
+		@return None
+		"""
+
+		self.restoreSnapshot(replay.keyframes[tick])
 
-	sprites = None
-	screen = None
-	players = []
-	enemies = []
-	bullets = []
-	bonuses = []
-	labels = []
+		self.replay = replay
+		self.replay_stage = replay.getStageAt(tick)
+		self.replay_tick = tick
 
-	play_sounds = True
-	sounds = {}
+	def seekReplay(self, replay, tick):
+		""" Play replay back in headless mode as fast as possible, up to given tick
+		Playback continues from where the last call stopped, or from the closest
+		keyframe before tick if that's nearer. Keyframe is taken at the start of
+		every stage played and every Replay.KEYFRAME_TICKS ticks
+		@param Replay replay
+		@param int tick Stop before this tick is played
+		@return list Summary of each stage finished on the way, see stageSummary()
+		"""
+
+		world = self.world
+
+		tick = min(tick, len(replay))
+
+		# continue from current position, closest keyframe or start of replay
+		start = -1
+		if self.replay == replay and self.replay_tick <= tick:
+			start = self.replay_tick
+
+		keyframe = replay.getKeyframeBefore(tick)
+		if keyframe != None and keyframe > start:
+			self.restoreKeyframe(replay, keyframe)
+		elif start == -1:
+			world.rng.seed(replay.seed)
+			del world.players[:]
+			self.nr_of_players = replay.players
+			self.stage = replay.first_stage - 1
+			self.startLevel()
+
+			self.replay = replay
+			self.replay_stage = 0
+			self.replay_tick = 0
+			self.addKeyframe()
+
+		summaries = []
+
+		while True:
+			stage_start = replay.starts[self.replay_stage]
+			stage_end = stage_start + replay.getStageTicks(self.replay_stage)
+
+			if self.replay_tick < tick:
+				for inputs in replay.iterTicks(self.replay_stage, self.replay_tick - stage_start):
+					if self.replay_tick >= tick:
+						break
+					if self.replay_tick % replay.KEYFRAME_TICKS == 0:
+						self.addKeyframe()
+					self.profiler.startTick()
+					for player, value in zip(world.players, inputs):
+						self.setInput(player, value)
+					self.profiler.lap("events")
+					self.update(self.TICK_MS)
+					self.profiler.endTick()
+					self.replay_tick += 1
+					if self.replay_tick == stage_end:
+						summaries.append(self.stageSummary(stage_end - stage_start))
+
+			# go on to the next stage only if tick is in it
+			if self.replay_tick < stage_end or tick < stage_end or self.replay_stage + 1 >= len(replay.stages):
+				break
+
+			self.replay_stage += 1
+			self.startLevel()
+			self.addKeyframe()
+
+		return summaries
+
+	def stageSummary(self, ticks):
+		""" Collect results of current stage
+		@param int ticks How many ticks stage lasted
+		@return dict
+		"""
+
+		world = self.world
+
+		kills = [0] * 4
+		for player in world.players:
+			for i in range(4):
+				kills[i] += player.trophies["enemy"+str(i)]
+
+		if self.game_over:
+			outcome = "lost"
+		elif not self.active:
+			outcome = "cleared"
+		else:
+			outcome = "timeout"
+
+		return {
+			"stage" : self.stage,
+			"outcome" : outcome,
+			"ticks" : ticks,
+			"kills" : kills,
+			"enemies_left" : len(self.level.enemies_left) + len(world.enemies),
+			"castle" : world.castle.active
+		}
+
+	def simulate(self, stages = 35, max_ticks = 15000):
+		""" Play campaign in headless mode as fast as possible
+		Players are driven by autopilot() and stages follow each other without score
+		or game over screens. Lost stage doesn't end the campaign: players get their
+		lives back and the next stage is played anyway
+		@param int stages Number of stages to play, starting from the first one
+		@param int max_ticks Give up stage after this many ticks (15000 = 5 minutes)
+		@return list Summary of each stage, see stageSummary()
+		"""
+
+		world = self.world
+
+		del world.players[:]
+
+		self.stage = 0
+		self.replay = None
+
+		summaries = []
+
+		for i in range(stages):
+			self.startLevel()
 
-	game = Game()
-	castle = Castle()
-	game.showMenu()
\ No newline at end of file
+			ticks = 0
+			while self.running and ticks < max_ticks:
+				self.profiler.startTick()
+				for player in world.players:
+					self.autopilot(player)
+				self.profiler.lap("events")
+				self.update(self.TICK_MS)
+				self.profiler.endTick()
+				ticks += 1
+
+			summaries.append(self.stageSummary(ticks))
+
+			for player in world.players:
+				if player.lives < 1:
+					player.lives = 3
+
+		return summaries
+
+if __name__ == "__main__":
+
+	# --levels=<file> takes levels from level pack instead of levels/ directory,
+	# --seed=<n> makes runs reproducible, --record=<file> saves game into replay,
+	# --replay=<file> plays it back headless (up to --seek=<tick>, if given),
+	# --connect=<host>:<port> plays on server, see server.py. -f opens fullscreen,
+	# --fps=<n> overrides display's refresh rate (0 means uncapped), --dirty
+	# updates only changed parts of display, --hunters makes enemies head for castle
+	options = {}
+	for arg in sys.argv[1:]:
+		if arg.startswith("--") and "=" in arg:
+			name, value = arg[2:].split("=", 1)
+			options[name] = value
+
+	level_pack = None
+	if "levels" in options:
+		from levelpack import LevelPack
+		level_pack = LevelPack(options["levels"])
+
+	summary_format = "Stage %(stage)d %(outcome)s in %(ticks)d ticks, kills %(kills)s, enemies left %(enemies_left)d, castle standing %(castle)s"
+
+	headless = "replay" in options or "--headless" in sys.argv[1:]
+
+	# --profile prints time taken by phases of ticks at exit (--profile=detail
+	# for draw phases too), --trace=<file> saves first --trace-ticks=<n> ticks as
+	# Chrome trace
+	game = Game(headless, level_pack,
+		fullscreen = "-f" in sys.argv[1:],
+		fps = int(options["fps"]) if "fps" in options else None,
+		dirty = "--dirty" in sys.argv[1:],
+		hunters = "--hunters" in sys.argv[1:],
+		profile = options.get("profile", "--profile" in sys.argv[1:])
+	)
+
+	if "seed" in options:
+		game.world.rng.seed(int(options["seed"]))
+
+	if "trace" in options:
+		game.profiler.startTrace(options["trace"], int(options.get("trace-ticks", 250)))
+
+	try:
+		if "connect" in options:
+			from client import Client
+			host, port = options["connect"].rsplit(":", 1)
+			Client(game, host, int(port)).run()
+		elif "replay" in options:
+			replay = Replay.load(options["replay"])
+
+			# keyframes saved by earlier playbacks let seeking skip ahead
+			keyframes_filename = options["replay"] + Replay.KEYFRAMES_SUFFIX
+			if os.path.exists(keyframes_filename):
+				try:
+					replay.loadKeyframes(keyframes_filename)
+				except ValueError as e:
+					print("Ignoring keyframes: " + str(e))
+			known = len(replay.keyframes)
+
+			start = time.time()
+			for summary in game.seekReplay(replay, int(options.get("seek", len(replay)))):
+				print(summary_format % summary)
+			print("Played %d ticks in %.2f s" % (game.replay_tick, time.time() - start))
+
+			if len(replay.keyframes) > known:
+				replay.saveKeyframes(keyframes_filename)
+				print("Keyframes saved to " + keyframes_filename)
+		elif headless:
+			stages = 35 if level_pack == None else len(level_pack)
+			for summary in game.simulate(stages):
+				print(summary_format % summary)
+		else:
+			if "record" in options:
+				game.record_filename = options["record"]
+				game.record_seed = int(options["seed"]) if "seed" in options else random.randint(0, 0x7fffffff)
+			game.showMenu()
+	finally:
+		game.stopRecording()
+		game.profiler.saveTrace()
+		if game.profiler.enabled:
+			print(game.profiler.report())